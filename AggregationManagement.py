@@ -0,0 +1,187 @@
+import functools
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import shared.config as cfg
+from DocumentManagement import DocumentManagement
+from QueryManagement import QueryManagement
+from shared.ordering import order_key
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - computes counts, sums, averages, minimums and maximums of the documents of a collection on the
+# server, optionally per group, instead of reading every document
+#
+#   AggregationManagement.aggregate(client, 'pysamples', 'data',
+#                                   {'orders': 'count', 'revenue': 'sum(total_due)', 'average': 'avg(subtotal)'},
+#                                   group_by=['account_number'], where='c.order_date > @since',
+#                                   parameters=[{'name': '@since', 'value': '2020'}])
+#   [{'account_number': 'Account1', 'orders': 12, 'revenue': 11820.2, 'average': 982.1}, ...]
+#
+# The aggregates are compiled into one Cosmos SQL query,
+#
+#   SELECT c["account_number"] AS g0, COUNT(1) AS a1, SUM(IS_NUMBER(c["total_due"]) ? c["total_due"] : 0) AS a2,
+#          SUM(IS_NUMBER(c["subtotal"]) ? c["subtotal"] : 0) AS a3, SUM(IS_NUMBER(c["subtotal"]) ? 1 : 0) AS a4
+#   FROM c WHERE c.order_date > @since GROUP BY c["account_number"]
+#
+# which runs on every partition key range, up to max_degree_of_parallelism at once, so each range sends
+# back one row per group it holds. The partial results of the ranges are combined on the client: counts
+# and sums are added up, an average is the sum of the ranges' sums over the sum of their counts (the
+# average of averages would weigh a small range like a big one), minimums and maximums are compared in
+# Cosmos order (null, booleans, numbers, strings). With a partition_key only that partition is queried.
+#
+# An aggregate is 'count', or 'count(field)', 'sum(field)', 'avg(field)', 'min(field)' or 'max(field)', a
+# field being a property name or a dotted path. where is a condition on the documents, called c.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# Sums and averages only count numbers, other values (null, strings, ...) are skipped. Cosmos' own SUM
+# and AVG are undefined as soon as one value is not a number, so the query sums IS_NUMBER(f) ? f : 0
+# instead, and an average is None when no document has a number. Documents without a group_by field form
+# a group whose result does not have that field.
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_DEGREE_OF_PARALLELISM = cfg.settings['query_max_degree_of_parallelism']
+PAGE_SIZE = cfg.settings['page_size']
+
+FUNCTIONS = ('count', 'sum', 'avg', 'min', 'max')
+
+_AGGREGATE = re.compile(r'^\s*(\w+)\s*(?:\(\s*([^()]*?)\s*\))?\s*$')
+
+
+def _path(field):
+    return 'c' + ''.join('[{0}]'.format(json.dumps(step)) for step in field.split('.'))
+
+
+class AggregationManagement:
+
+    @staticmethod
+    def parse(aggregate):
+        """ 'sum(total_due)' as ('sum', 'total_due'), 'count' as ('count', None) """
+        if isinstance(aggregate, (tuple, list)):
+            function, field = aggregate
+        else:
+            match = _AGGREGATE.match(aggregate)
+            if not match:
+                raise ValueError('\'{0}\' is not an aggregate like sum(total_due)'.format(aggregate))
+            function, field = match.group(1), match.group(2) or None
+        function = function.lower()
+        if function not in FUNCTIONS:
+            raise ValueError('Unknown aggregate \'{0}\', use one of {1}'.format(function, ', '.join(FUNCTIONS)))
+        if field is None and function != 'count':
+            raise ValueError('{0} needs a field, eg. {0}(total_due)'.format(function))
+        return function, field
+
+    @staticmethod
+    def compile(aggregates, group_by=None, where=None):
+        """ Returns the query text and, per aggregate, (name, function, [columns of the query it is made of]) """
+        group_by = list(group_by or [])
+        select = ['{0} AS g{1}'.format(_path(field), i) for i, field in enumerate(group_by)]
+        plan = []
+        for name, aggregate in aggregates.items():
+            function, field = AggregationManagement.parse(aggregate)
+            argument = '1' if field is None else _path(field)
+            if function in ('sum', 'avg'):
+                # only numbers are summed, and an average is merged from the sums and counts of the ranges
+                columns = ['a{0}'.format(len(select))]
+                select.append('SUM(IS_NUMBER({0}) ? {0} : 0) AS {1}'.format(argument, columns[0]))
+                if function == 'avg':
+                    columns.append('a{0}'.format(len(select)))
+                    select.append('SUM(IS_NUMBER({0}) ? 1 : 0) AS {1}'.format(argument, columns[1]))
+            else:
+                columns = ['a{0}'.format(len(select))]
+                select.append('{0}({1}) AS {2}'.format(function.upper(), argument, columns[0]))
+            plan.append((name, function, columns))
+
+        query = 'SELECT {0} FROM c'.format(', '.join(select))
+        if where:
+            query += ' WHERE {0}'.format(where)
+        if group_by:
+            query += ' GROUP BY {0}'.format(', '.join(_path(field) for field in group_by))
+        return query, plan
+
+    @staticmethod
+    def _merge(totals, plan, row):
+        """ Adds the partial result of one range to the totals of its group """
+        for name, function, columns in plan:
+            value = row.get(columns[0])
+            if function in ('count', 'sum'):
+                totals[name] = totals.get(name, 0) + (value or 0)
+            elif function == 'avg':
+                partial = totals.setdefault(name, [0, 0])
+                partial[0] += value or 0
+                partial[1] += row.get(columns[1]) or 0
+            elif columns[0] in row:
+                current = totals.get(name, _Missing)
+                if current is _Missing:
+                    totals[name] = value
+                elif (order_key(value) < order_key(current)) == (function == 'min'):
+                    totals[name] = value
+
+    @staticmethod
+    def _result(group_by, key, totals, plan):
+        result = {}
+        for field, value in zip(group_by, key):
+            if value is not _Missing:
+                result[field] = json.loads(value)
+        for name, function, _ in plan:
+            if function == 'avg':
+                total, count = totals.get(name, (0, 0))
+                result[name] = total / float(count) if count else None
+            elif function in ('count', 'sum'):
+                result[name] = totals.get(name, 0)
+            else:
+                value = totals.get(name, _Missing)
+                result[name] = None if value is _Missing else value
+        return result
+
+    @staticmethod
+    def aggregate(client, db, coll, aggregates, group_by=None, where=None, parameters=None, partition_key=None,
+                  max_degree_of_parallelism=MAX_DEGREE_OF_PARALLELISM, page_size=PAGE_SIZE):
+        """ Returns the aggregates ({ name: 'sum(field)', ... }) of the documents as one dictionary or, with
+        group_by fields, as a list with a dictionary per group. See the header of this file. """
+        group_by = list(group_by or [])
+        query, plan = AggregationManagement.compile(aggregates, group_by, where)
+        query = {'query': query, 'parameters': parameters or []}
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+
+        if partition_key is not None:
+            def rows():
+                continuation = None
+                while True:
+                    options = {'maxItemCount': page_size, 'partitionKey': partition_key}
+                    if continuation:
+                        options['continuation'] = continuation
+                    documents, headers = DocumentManagement._fetch_page(client, collection_link, query, options)
+                    for document in documents:
+                        yield document
+                    continuation = headers.get('x-ms-continuation')
+                    if not continuation:
+                        return
+            partials = rows()
+            executor = None
+        else:
+            range_ids = [r['id'] for r in QueryManagement.read_partition_key_ranges(client, collection_link)]
+            fetch = functools.partial(QueryManagement._fetch, client, collection_link, query, page_size=page_size)
+            children = functools.partial(QueryManagement._children, client, collection_link)
+            executor = ThreadPoolExecutor(max_workers=max_degree_of_parallelism)
+            partials = QueryManagement._unordered(executor, fetch, range_ids, children)
+
+        # the totals of every group, by the JSON of its group_by values
+        groups = {}
+        try:
+            for row in partials:
+                key = tuple(json.dumps(row['g{0}'.format(i)], sort_keys=True) if 'g{0}'.format(i) in row else _Missing
+                            for i in range(len(group_by)))
+                AggregationManagement._merge(groups.setdefault(key, {}), plan, row)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if not group_by:
+            return AggregationManagement._result(group_by, (), groups.get((), {}), plan)
+        return [AggregationManagement._result(group_by, key, totals, plan) for key, totals in groups.items()]
+
+
+class _Missing:
+    """ A group_by field a group does not have, or a minimum or maximum without values """
@@ -0,0 +1,179 @@
+import azure.cosmos.errors as errors
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import shared.config as cfg
+from shared.cache import document_cache, metadata_cache
+from shared.throttling import execute
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - demonstrates an asyncio API over the database, collection and document operations
+#
+# Databases - find_database, create_database, read_database, list_databases, delete_database
+#
+# Collections - find_container, create_container, read_container, list_containers, delete_container
+#
+# Documents - create_document, read_document, read_documents (many point reads at once)
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# The azure-cosmos 3.x SDK only has blocking calls. Each call runs on a shared thread pool that is as
+# large as the concurrency limit, and a semaphore keeps at most max_concurrency of them in flight, so
+# thousands of coroutines can be awaited on one event loop without a thread each.
+#
+# Unlike the console classes these methods return results instead of printing them. A missing
+# resource is returned as None (or False for the find methods).
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_CONCURRENCY = cfg.settings['async_max_concurrency']
+
+
+class AsyncManagement:
+
+    def __init__(self, client, max_concurrency=MAX_CONCURRENCY):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_val, trace):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def _execute(self, operation, *args):
+        # created on first use so that it belongs to the loop the coroutines run on
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor,
+                                              functools.partial(execute, self.client, operation, *args))
+
+    async def _execute_or_none(self, operation, *args):
+        try:
+            return await self._execute(operation, *args)
+        except errors.HTTPFailure as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    # Databases
+
+    async def find_database(self, id):
+        database_link = 'dbs/' + id
+        found = metadata_cache.get(database_link)
+        if found is None:
+            databases = await self._execute('QueryDatabases', {
+                "query": "SELECT * FROM r WHERE r.id=@id",
+                "parameters": [
+                    { "name":"@id", "value": id }
+                ]
+            })
+            found = len(databases) > 0
+            metadata_cache.put(database_link, found)
+        return found
+
+    async def create_database(self, id):
+        """ Returns the new database, or None when a database with this id already exists """
+        try:
+            database = await self._execute('CreateDatabase', {"id": id})
+        except errors.HTTPFailure as e:
+            if e.status_code == 409:
+                return None
+            raise
+        finally:
+            metadata_cache.invalidate('dbs/' + id)
+        return database
+
+    async def read_database(self, id):
+        return await self._execute_or_none('ReadDatabase', 'dbs/' + id)
+
+    async def list_databases(self):
+        return await self._execute('ReadDatabases')
+
+    async def delete_database(self, id):
+        """ Returns False when the database does not exist """
+        database_link = 'dbs/' + id
+        try:
+            await self._execute('DeleteDatabase', database_link)
+            return True
+        except errors.HTTPFailure as e:
+            if e.status_code == 404:
+                return False
+            raise
+        finally:
+            metadata_cache.invalidate(database_link)
+
+    # Collections
+
+    async def find_container(self, db, id):
+        db_link = 'dbs/' + db
+        collection_link = db_link + '/colls/{0}'.format(id)
+        found = metadata_cache.get(collection_link)
+        if found is None:
+            collections = await self._execute('QueryContainers', db_link, {
+                "query": "SELECT * FROM r WHERE r.id=@id",
+                "parameters": [
+                    { "name":"@id", "value": id }
+                ]
+            })
+            found = len(collections) > 0
+            metadata_cache.put(collection_link, found)
+        return found
+
+    async def create_container(self, db, id, definition=None):
+        """ Creates a collection from definition (a collection resource without an id, eg. its indexingPolicy).
+        Returns the new collection, or None when a collection with this id already exists """
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(id)
+        coll = dict(definition or {}, id=id)
+        try:
+            collection = await self._execute('CreateContainer', 'dbs/' + db, coll)
+        except errors.HTTPFailure as e:
+            if e.status_code == 409:
+                return None
+            raise
+        finally:
+            metadata_cache.invalidate(collection_link)
+        return collection
+
+    async def read_container(self, db, id):
+        return await self._execute_or_none('ReadContainer', 'dbs/' + db + '/colls/{0}'.format(id))
+
+    async def list_containers(self, db):
+        return await self._execute_or_none('ReadContainers', 'dbs/' + db)
+
+    async def delete_container(self, db, id):
+        """ Returns False when the collection does not exist """
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(id)
+        try:
+            await self._execute('DeleteContainer', collection_link)
+            return True
+        except errors.HTTPFailure as e:
+            if e.status_code == 404:
+                return False
+            raise
+        finally:
+            metadata_cache.invalidate(collection_link)
+
+    # Documents
+
+    async def create_document(self, db, coll, document):
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        created = await self._execute('CreateItem', collection_link, document)
+        document_cache.invalidate(collection_link + '/docs/' + str(document.get('id')))
+        return created
+
+    async def read_document(self, db, coll, doc_id, partition_key=None):
+        doc_link = 'dbs/' + db + '/colls/{0}'.format(coll) + '/docs/' + doc_id
+        options = {} if partition_key is None else {'partitionKey': partition_key}
+        return await self._execute_or_none('ReadItem', doc_link, options)
+
+    async def read_documents(self, db, coll, doc_ids):
+        """ Point reads every id concurrently, the results come back in the order of doc_ids """
+        return await asyncio.gather(*[self.read_document(db, coll, doc_id) for doc_id in doc_ids])
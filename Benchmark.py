@@ -0,0 +1,170 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+from DBManagement import DatabaseManagement
+from CollectionManagement import CollectionManagement
+from DocumentManagement import DocumentManagement
+from BulkManagement import BulkManagement
+from shared.cache import metadata_cache
+from shared.fake_client import FakeCosmosClient
+
+# ----------------------------------------------------------------------------------------------------------
+# Benchmark - runs every database, collection and document operation against the in-memory
+# FakeCosmosClient (shared/fake_client.py), so no Azure Cosmos account is needed
+#
+# For each operation it reports the operations per second, the requests sent per operation and the peak
+# memory allocated while it ran. Extra round trips, eg. an existence query that is no longer cached,
+# show up as a higher requests/op figure.
+#
+#   $ python Benchmark.py --iterations 200 --latency 0.001 --throttle-rate 0.01
+#   $ python Benchmark.py --output baseline.json
+#   $ python Benchmark.py --baseline baseline.json      (exits with 1 when an operation regressed)
+# ----------------------------------------------------------------------------------------------------------
+
+DATABASE_ID = 'benchmark'
+COLLECTION_ID = 'orders'
+
+
+def _cases(client, documents):
+    """ Returns (name, setup, run) for every operation. setup(i) prepares iteration i and is not timed. """
+    db = DATABASE_ID
+    coll = COLLECTION_ID
+
+    def delete_sales_order(i):
+        try:
+            client.DeleteItem('dbs/' + db + '/colls/' + coll + '/docs/SalesOrder1')
+        except Exception:
+            pass
+
+    def import_rows(i):
+        rows = ((n, dict(DocumentManagement.GetSalesOrder('import-{0}-{1}'.format(i, n)))) for n in range(documents))
+        with contextlib.redirect_stdout(io.StringIO()):
+            BulkManagement.import_documents(client, 'dbs/' + db + '/colls/' + coll, rows, 8, 100)
+
+    def scan(i):
+        for page, continuation in DocumentManagement.ReadDocumentPages(client, db, coll):
+            pass
+
+    return [
+        ('list_databases', None, lambda i: DatabaseManagement.list_databases(client)),
+        ('find_database', None, lambda i: DatabaseManagement.find_database(client, db)),
+        ('read_database', None, lambda i: DatabaseManagement.read_database(client, db)),
+        ('create_database', None, lambda i: DatabaseManagement.create_database(client, 'db-{0}'.format(i))),
+        ('delete_database', None, lambda i: DatabaseManagement.delete_database(client, 'db-{0}'.format(i))),
+        ('list_Containers', None, lambda i: CollectionManagement.list_Containers(client, db)),
+        ('find_Container', None, lambda i: CollectionManagement.find_Container(client, db, coll)),
+        ('read_Container', None, lambda i: CollectionManagement.read_Container(client, db, coll)),
+        ('manage_offer_throughput', None, lambda i: CollectionManagement.manage_offer_throughput(client, db, coll)),
+        ('create_Container', None, lambda i: CollectionManagement.create_Container(client, db, 'coll-{0}'.format(i))),
+        ('delete_Container', None, lambda i: CollectionManagement.delete_Container(client, db, 'coll-{0}'.format(i))),
+        ('CreateDocuments', delete_sales_order, lambda i: DocumentManagement.CreateDocuments(client, db, coll)),
+        ('ReadDocument', None, lambda i: DocumentManagement.ReadDocument(client, db, coll, 'SalesOrder1')),
+        ('ReadDocuments', None, lambda i: DocumentManagement.ReadDocuments(client, db, coll)),
+        ('ReadDocumentPages', None, scan),
+        ('import_documents({0})'.format(documents), None, import_rows),
+    ]
+
+
+def _measure(client, setup, run, iterations):
+    elapsed = 0.0
+    requests = 0
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        before = sum(client.request_counts.values())
+        started = time.perf_counter()
+        run(i)
+        elapsed += time.perf_counter() - started
+        requests += sum(client.request_counts.values()) - before
+    return elapsed, requests
+
+
+def run_benchmark(iterations=100, latency=0.0, throttle_rate=0.0, documents=1000, partition_count=4, seed=1):
+    client = FakeCosmosClient(latency=latency, throttle_rate=throttle_rate, partition_count=partition_count, seed=seed)
+    metadata_cache.clear()
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        DatabaseManagement.create_database(client, DATABASE_ID)
+        CollectionManagement.create_Container(client, DATABASE_ID, COLLECTION_ID)
+        BulkManagement.import_documents(client, 'dbs/' + DATABASE_ID + '/colls/' + COLLECTION_ID,
+                                        ((n, DocumentManagement.GetSalesOrderV2('order-{0}'.format(n)))
+                                         for n in range(documents)))
+
+    for name, setup, run in _cases(client, documents):
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, requests = _measure(client, setup, run, iterations)
+
+            # one more iteration under tracemalloc, tracing slows the timed loop down too much
+            tracemalloc.start()
+            _measure(client, setup, lambda i: run(iterations + i), 1)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        results.append({
+            'operation': name,
+            'iterations': iterations,
+            'ops_per_second': iterations / elapsed if elapsed else 0.0,
+            'requests_per_op': requests / float(iterations),
+            'peak_memory_kb': peak / 1024.0
+        })
+    return {'results': results, 'requests': dict(client.request_counts)}
+
+
+def compare(results, baseline, tolerance):
+    """ Returns the operations that send more requests than the baseline or, when a tolerance is given,
+    are slower by more than that share. Timings of sub-millisecond operations are noisy, requests/op is not. """
+    previous = {r['operation']: r for r in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        before = previous.get(result['operation'])
+        if before is None:
+            continue
+        if result['requests_per_op'] > before['requests_per_op'] + 1e-9:
+            regressions.append('{0}: {1:.2f} requests/op, was {2:.2f}'.format(
+                result['operation'], result['requests_per_op'], before['requests_per_op']))
+        if tolerance is not None and result['ops_per_second'] < before['ops_per_second'] * (1 - tolerance):
+            regressions.append('{0}: {1:.1f} ops/s, was {2:.1f}'.format(
+                result['operation'], result['ops_per_second'], before['ops_per_second']))
+    return regressions
+
+
+def print_results(results):
+    print('{0:<28} {1:>12} {2:>14} {3:>16}'.format('operation', 'ops/s', 'requests/op', 'peak memory KB'))
+    print(73 * '-')
+    for r in results['results']:
+        print('{0:<28} {1:>12.1f} {2:>14.2f} {3:>16.1f}'.format(
+            r['operation'], r['ops_per_second'], r['requests_per_op'], r['peak_memory_kb']))
+    print(73 * '-')
+    print('Requests by type: {0}'.format(', '.join('{0}={1}'.format(k, v) for k, v in sorted(results['requests'].items()))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the management operations against an in-memory Cosmos stand-in')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests rejected with 429')
+    parser.add_argument('--documents', type=int, default=1000, help='documents loaded into the benchmark collection')
+    parser.add_argument('--partitions', type=int, default=4)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='compare with results written earlier with --output')
+    parser.add_argument('--tolerance', type=float, help='also fail when ops/s drops by more than this share, eg. 0.25')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.iterations, args.latency, args.throttle_rate, args.documents, args.partitions)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('Regression - ' + regression)
+        sys.exit(1 if regressions else 0)
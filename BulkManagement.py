@@ -0,0 +1,335 @@
+import azure.cosmos.errors as errors
+import csv
+import json
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import shared.config as cfg
+from DBManagement import DatabaseManagement
+from CollectionManagement import CollectionManagement
+from shared.cache import document_cache
+from shared.routing import routing
+from shared.throttling import execute
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - demonstrates bulk ingestion of documents into an Azure Cosmos collection
+#
+# Stream documents from a JSON Lines (.jsonl) or CSV (.csv) file (read_file)
+#
+# Write them concurrently through a bounded thread pool (import_documents)
+#
+# Every batch reports its throughput, the request units it consumed and the rows that failed.
+#
+# Upsert, replace or delete many documents (upsert_documents, replace_documents, delete_documents, bulk)
+#
+# The operations are grouped by the partition key range their partition key hashes to (shared/routing.py).
+# Every group is sent by one worker and up to max_in_flight groups run at once, so the workers each keep to
+# a single physical partition instead of all of them spreading over every partition. Throttled requests
+# are retried (shared/throttling.py), and every operation has its own result: its status code, request
+# charge and error.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# The request charge of a write is read from client.last_response_headers right after the call. The
+# shared client of shared/client.py keeps those headers per thread. A plain CosmosClient shares them
+# between threads, so with many writes in flight the RU figures are close approximations.
+#
+# The 3.x SDK has no transactional batch, the operations of a group are separate requests and a group
+# that fails half way is not rolled back. Groups run concurrently, so the same document should not be
+# changed twice in one call.
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_IN_FLIGHT = cfg.settings['bulk_max_in_flight']
+BATCH_SIZE = cfg.settings['bulk_batch_size']
+GROUP_SIZE = cfg.settings['bulk_group_size']
+
+BULK_OPERATIONS = ('upsert', 'replace', 'delete')
+
+
+class BulkManagement:
+
+    @staticmethod
+    def read_json_lines(path):
+        """ Yields (row number, document) for every non empty line, or (row number, error) if it is not valid JSON """
+        with open(path, encoding='utf-8') as f:
+            for row, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield row, json.loads(line)
+                except ValueError as e:
+                    yield row, e
+
+    @staticmethod
+    def read_csv(path):
+        """ Yields (row number, document) for every CSV record. The header line gives the property names. """
+        with open(path, encoding='utf-8', newline='') as f:
+            for row, record in enumerate(csv.DictReader(f), 2):
+                # ids stay strings, other values that were written as numbers are converted back
+                yield row, {k: v if k == 'id' else BulkManagement._convert_value(v) for k, v in record.items()}
+
+    @staticmethod
+    def read_file(path):
+        if path.lower().endswith('.csv'):
+            return BulkManagement.read_csv(path)
+        return BulkManagement.read_json_lines(path)
+
+    @staticmethod
+    def _convert_value(value):
+        """ The number a CSV value stands for, or the value itself unless it reads back the same as a number,
+        so '00123', '1_000', 'nan' and 'inf' stay strings """
+        for convert in (int, float):
+            try:
+                number = convert(value)
+            except (TypeError, ValueError):
+                continue
+            if (convert is int or math.isfinite(number)) and repr(number) == value:
+                return number
+        return value
+
+    @staticmethod
+    def _write(client, collection_link, row, document):
+        if isinstance(document, Exception):
+            return row, None, 0.0, 'Invalid document: {0}'.format(document)
+        try:
+            execute(client, 'CreateItem', collection_link, document)
+            document_cache.invalidate(collection_link + '/docs/' + str(document.get('id')))
+            headers = client.last_response_headers or {}
+            return row, 201, float(headers.get('x-ms-request-charge', 0)), None
+        except errors.HTTPFailure as e:
+            return row, e.status_code, float(e.headers.get('x-ms-request-charge', 0)), str(e)
+        except Exception as e:
+            # eg. a document that cannot be serialized, only its row fails
+            return row, None, 0.0, '{0}: {1}'.format(type(e).__name__, e)
+
+    @staticmethod
+    def _report(batch_number, futures, started, summary):
+        results = [f.result() for f in futures]
+        elapsed = time.time() - started
+        written = sum(1 for r in results if r[3] is None)
+        failed = [(r[0], r[1], r[3]) for r in results if r[3] is not None]
+        charge = sum(r[2] for r in results)
+
+        summary['written'] += written
+        summary['failed'].extend(failed)
+        summary['request_charge'] += charge
+        print('Batch {0}: {1} written, {2} failed, {3:.1f} docs/s, {4:.2f} RUs'.format(
+            batch_number, written, len(failed), len(results) / elapsed if elapsed else 0.0, charge))
+
+    @staticmethod
+    def import_documents(client, collection_link, documents, max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE):
+        """ Writes an iterable of (row number, document) with at most max_in_flight CreateItem calls running at once.
+        Returns a summary with the number of written documents, the failed rows and the total request charge. """
+        summary = {'written': 0, 'failed': [], 'request_charge': 0.0, 'elapsed': 0.0}
+        slots = threading.BoundedSemaphore(max_in_flight)
+        pending = deque()
+        started = time.time()
+        documents = iter(documents)
+
+        def release(_):
+            slots.release()
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            batch_number = 0
+            while True:
+                batch = list(islice(documents, batch_size))
+                if not batch:
+                    break
+                batch_number += 1
+                futures = []
+                batch_started = time.time()
+                for row, document in batch:
+                    # reading from the file stops while every slot is busy, so memory stays bounded
+                    slots.acquire()
+                    future = executor.submit(BulkManagement._write, client, collection_link, row, document)
+                    future.add_done_callback(release)
+                    futures.append(future)
+                pending.append((batch_number, futures, batch_started))
+
+                while pending and all(f.done() for f in pending[0][1]):
+                    BulkManagement._report(*pending.popleft(), summary)
+
+            while pending:
+                BulkManagement._report(*pending.popleft(), summary)
+
+        summary['elapsed'] = time.time() - started
+        return summary
+
+    @staticmethod
+    def import_file(client, db, coll, path, max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE):
+        if not (DatabaseManagement.find_database(client, db) and CollectionManagement.find_Container(client, db, coll)):
+            print("Invalid DB or Collection")
+            return None
+
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        print('Importing documents from \'{0}\' with {1} writes in flight'.format(path, max_in_flight))
+        summary = BulkManagement.import_documents(client, collection_link, BulkManagement.read_file(path),
+                                                  max_in_flight, batch_size)
+
+        elapsed = summary['elapsed']
+        print('Imported {0} documents in {1:.1f}s ({2:.1f} docs/s), {3:.2f} RUs consumed'.format(
+            summary['written'], elapsed, summary['written'] / elapsed if elapsed else 0.0, summary['request_charge']))
+        if summary['failed']:
+            print('{0} rows failed:'.format(len(summary['failed'])))
+            for row, status_code, message in summary['failed']:
+                print('Row {0}: status {1} - {2}'.format(row, status_code, message.splitlines()[0] if message else ''))
+        return summary
+
+    @staticmethod
+    def _partition_key_path(routing_map):
+        return routing_map.definition['paths'][0].strip('/').split('/') if routing_map.partitioned else None
+
+    @staticmethod
+    def _operation(path, index, entry):
+        """ Returns (index, operation, id, partition key, document) of one bulk operation, raises ValueError
+        when entry is not a valid (operation, item) pair """
+        try:
+            operation, item = entry
+        except (TypeError, ValueError):
+            raise ValueError('A bulk operation is an (operation, item) pair')
+        if operation not in BULK_OPERATIONS:
+            raise ValueError('Unknown bulk operation \'{0}\', use one of {1}'.format(operation, ', '.join(BULK_OPERATIONS)))
+        if operation == 'delete':
+            # an id, or an (id, partition key) pair for a partitioned collection
+            if isinstance(item, tuple) and len(item) != 2:
+                raise ValueError('A delete takes an id or an (id, partition key) pair')
+            doc_id, partition_key = item if isinstance(item, tuple) else (item, None)
+            return index, operation, doc_id, partition_key, None
+        if not isinstance(item, dict):
+            raise ValueError('\'{0}\' takes a document, not {1}'.format(operation, type(item).__name__))
+        partition_key = None
+        if path is not None:
+            partition_key = item
+            for step in path:
+                partition_key = partition_key.get(step) if isinstance(partition_key, dict) else None
+        return index, operation, item.get('id'), partition_key, item
+
+    @staticmethod
+    def _apply(client, collection_link, path, operation):
+        index, name, doc_id, partition_key, document = operation
+        doc_link = collection_link + '/docs/' + str(doc_id)
+        options = {} if path is None else {'partitionKey': partition_key}
+        try:
+            if name == 'upsert':
+                execute(client, 'UpsertItem', collection_link, document, options)
+            elif name == 'replace':
+                execute(client, 'ReplaceItem', doc_link, document, options)
+            else:
+                execute(client, 'DeleteItem', doc_link, options)
+            document_cache.invalidate(doc_link)
+            headers = client.last_response_headers or {}
+            return index, name, doc_id, 204 if name == 'delete' else 200, float(headers.get('x-ms-request-charge', 0)), None
+        except errors.HTTPFailure as e:
+            if e.status_code == 404:
+                document_cache.invalidate(doc_link)
+            return index, name, doc_id, e.status_code, float(e.headers.get('x-ms-request-charge', 0)), str(e)
+        except Exception as e:
+            # eg. a document that cannot be serialized, only its operation fails
+            return index, name, doc_id, None, 0.0, '{0}: {1}'.format(type(e).__name__, e)
+
+    @staticmethod
+    def _apply_group(client, collection_link, path, group):
+        return [BulkManagement._apply(client, collection_link, path, operation) for operation in group]
+
+    @staticmethod
+    def bulk(client, collection_link, operations, max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE,
+             group_size=GROUP_SIZE):
+        """ Runs an iterable of (operation, item) pairs, operation being 'upsert' or 'replace' with a document
+        or 'delete' with an id or (id, partition key). Yields (index, operation, id, status code, request charge,
+        error) for every operation as its group completes, error is None for the ones that succeeded. An
+        operation that is not valid, or that fails without a response from the service, has no status code.
+
+        Up to batch_size operations are read at a time and grouped by partition key range, groups of at most
+        group_size operations run concurrently, max_in_flight at once. """
+        routing_map = routing.get(client, collection_link)
+        path = BulkManagement._partition_key_path(routing_map)
+        operations = enumerate(operations)
+        slots = threading.BoundedSemaphore(max_in_flight)
+
+        def release(_):
+            slots.release()
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            pending = deque()
+            while True:
+                batch = []
+                read = 0
+                for index, entry in islice(operations, batch_size):
+                    read += 1
+                    try:
+                        batch.append(BulkManagement._operation(path, index, entry))
+                    except ValueError as e:
+                        # nothing is sent for it, the other operations still run
+                        yield index, None, None, None, 0.0, str(e)
+                if not read:
+                    break
+
+                groups = OrderedDict()
+                for operation in batch:
+                    key = None
+                    if path is not None and not isinstance(operation[3], (dict, list)):
+                        key = routing_map.range_for(operation[3])['id']
+                    # an object or array is no partition key, the service rejects those operations one by one
+                    groups.setdefault(key, []).append(operation)
+                for group in groups.values():
+                    for start in range(0, len(group), group_size):
+                        # reading operations stops while every slot is busy, so memory stays bounded
+                        slots.acquire()
+                        future = executor.submit(BulkManagement._apply_group, client, collection_link, path,
+                                                 group[start:start + group_size])
+                        future.add_done_callback(release)
+                        pending.append(future)
+
+                while pending and pending[0].done():
+                    for result in pending.popleft().result():
+                        yield result
+
+            while pending:
+                for result in pending.popleft().result():
+                    yield result
+
+    @staticmethod
+    def _run_bulk(client, db, coll, operations, max_in_flight, batch_size, group_size):
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        summary = {'succeeded': 0, 'failed': [], 'request_charge': 0.0, 'elapsed': 0.0}
+        started = time.time()
+        for index, operation, doc_id, status_code, charge, error in BulkManagement.bulk(
+                client, collection_link, operations, max_in_flight, batch_size, group_size):
+            summary['request_charge'] += charge
+            if error is None:
+                summary['succeeded'] += 1
+            else:
+                summary['failed'].append((index, doc_id, status_code, error))
+        summary['elapsed'] = time.time() - started
+
+        elapsed = summary['elapsed']
+        print('{0} operations succeeded and {1} failed in {2:.1f}s ({3:.1f} ops/s), {4:.2f} RUs consumed'.format(
+            summary['succeeded'], len(summary['failed']), elapsed,
+            (summary['succeeded'] + len(summary['failed'])) / elapsed if elapsed else 0.0, summary['request_charge']))
+        return summary
+
+    @staticmethod
+    def upsert_documents(client, db, coll, documents, max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE,
+                         group_size=GROUP_SIZE):
+        """ Creates or replaces every document. Returns a summary with the failed (index, id, status, error). """
+        return BulkManagement._run_bulk(client, db, coll, (('upsert', d) for d in documents),
+                                        max_in_flight, batch_size, group_size)
+
+    @staticmethod
+    def replace_documents(client, db, coll, documents, max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE,
+                          group_size=GROUP_SIZE):
+        """ Replaces every document, those that do not exist fail with 404 """
+        return BulkManagement._run_bulk(client, db, coll, (('replace', d) for d in documents),
+                                        max_in_flight, batch_size, group_size)
+
+    @staticmethod
+    def delete_documents(client, db, coll, ids, max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE,
+                         group_size=GROUP_SIZE):
+        """ Deletes the documents of ids, or of (id, partition key) pairs for a partitioned collection """
+        return BulkManagement._run_bulk(client, db, coll, (('delete', i) for i in ids),
+                                        max_in_flight, batch_size, group_size)
@@ -0,0 +1,368 @@
+import argparse
+import json
+import shlex
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import azure.cosmos.errors as errors
+
+import shared.config as cfg
+from DBManagement import DatabaseManagement
+from AggregationManagement import AggregationManagement
+from CollectionManagement import CollectionManagement
+from DocumentManagement import DocumentManagement
+from IndexingManagement import IndexAdvisor
+from MigrationManagement import MigrationManagement
+from ProvisioningManagement import ProvisioningManagement
+from StatisticsManagement import StatisticsManagement
+from shared.client import ClientFactory, client_factory
+from shared.metrics import percentile
+from shared.workload import QueryWorkload
+
+# ----------------------------------------------------------------------------------------------------------
+# Command line - the operations of ProgramMenu.py (menu items 1-12) without the interactive prompts, and
+# provisioning from a spec (ProvisioningManagement.py)
+#
+#   $ python CLI.py list-databases
+#   $ python CLI.py create-collection --db pysamples --coll data --json
+#   $ python CLI.py read-document --db pysamples --coll data --id SalesOrder1 --id SalesOrder2
+#   $ python CLI.py provision testenv.json --dry-run
+#
+# With --json a command prints one JSON object: its result, whether it succeeded, how long it took and
+# what the management class printed while it ran.
+#
+# batch runs a file of commands, one per line in the same syntax (blank lines and lines starting with #
+# are skipped), on a pool of --workers threads and ends with a summary of the timings:
+#
+#   $ cat nightly.txt
+#   create-database --db nightly
+#   create-collection --db nightly --coll orders
+#   read-documents --db pysamples --coll data --limit 100
+#   $ python CLI.py batch nightly.txt --workers 8 --json
+#
+# The commands of a batch run concurrently and in no particular order, commands that depend on each other
+# (eg. creating a collection in a database created by the batch) belong in separate batches. The exit code
+# is 1 when any command failed: it raised an error, returned None or False (eg. "Invalid DB or Collection"),
+# or returned a summary whose 'failed' is not empty.
+# ----------------------------------------------------------------------------------------------------------
+
+DATABASE_ID = cfg.settings['database_id']
+COLLECTION_ID = cfg.settings['collection_id']
+WORKERS = cfg.settings['cli_workers']
+
+
+class _Output:
+    """ Stands in for sys.stdout, so that what each command prints is kept apart from the commands
+    running on other threads. Threads that capture nothing write to the real stdout. """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.lines = []
+
+    def captured(self):
+        text = ''.join(self._local.__dict__.pop('lines', []))
+        return [line for line in text.splitlines() if line.strip()]
+
+    def write(self, text):
+        lines = getattr(self._local, 'lines', None)
+        if lines is None:
+            return self.stdout.write(text)
+        lines.append(text)
+        return len(text)
+
+    def flush(self):
+        self.stdout.flush()
+
+
+def _ids(values):
+    # --id can be repeated and every value can hold a comma separated list
+    return [i.strip() for value in values for i in value.split(',') if i.strip()]
+
+
+def _read_documents(client, args):
+    if not (DatabaseManagement.find_database(client, args.db) and CollectionManagement.find_Container(client, args.db, args.coll)):
+        print("Invalid DB or Collection")
+        return None
+    ids = []
+    continuation = None
+    for documents, continuation in DocumentManagement.ReadDocumentPages(client, args.db, args.coll, args.page_size,
+                                                                        args.continuation, args.limit):
+        for doc in documents:
+            print('Document Id: {0}'.format(doc.get('id')))
+            ids.append(doc.get('id'))
+    return {'ids': ids, 'continuation': continuation}
+
+
+def _advise_indexing(client, args):
+    advisor = IndexAdvisor(client, args.db, args.coll, QueryWorkload.read(args.workload))
+    proposal = advisor.propose(exclude_unused=not args.keep_unused)
+    advisor.print_report(proposal)
+    if args.apply:
+        advisor.apply(proposal['policy'])
+    return proposal
+
+
+def _collection_stats(client, args):
+    stats = StatisticsManagement.collect(client, args.db, args.coll, exact=args.exact)
+    StatisticsManagement.print_report(stats)
+    return stats
+
+
+def _copy_collection(client, args):
+    # a target on another account gets a client of its own, closed when the copy is done
+    factory = ClientFactory(args.target_host, args.target_key or cfg.settings['master_key']) if args.target_host else None
+    try:
+        summary = MigrationManagement.copy(client, args.db, args.coll, args.target_db, args.target_coll,
+                                           target_client=factory.lazy() if factory else None,
+                                           transform=MigrationManagement.sales_order_v2 if args.transform else None,
+                                           source_ru_per_second=args.source_ru, target_ru_per_second=args.target_ru)
+    finally:
+        if factory:
+            factory.close()
+    if summary['failed']:
+        raise RuntimeError('{0} documents could not be written, run the command again to retry them'.format(
+            summary['failed']))
+    return summary
+
+
+def _aggregate(client, args):
+    # --aggregate name=sum(field), or just sum(field) which is then also its name
+    aggregates = {}
+    for value in args.aggregate:
+        name, _, aggregate = value.rpartition('=')
+        aggregates[name.strip() or aggregate.strip()] = aggregate
+    result = AggregationManagement.aggregate(client, args.db, args.coll, aggregates, group_by=args.group_by,
+                                             where=args.where)
+    for row in (result if args.group_by else [result]):
+        print(', '.join('{0}: {1}'.format(k, v) for k, v in row.items()))
+    return result
+
+
+def _read_document(client, args):
+    ids = _ids(args.id)
+    if len(ids) == 1:
+        return DocumentManagement.ReadDocument(client, args.db, args.coll, ids[0])
+    return DocumentManagement.ReadDocumentsById(client, args.db, args.coll, ids)
+
+
+# command: (menu item, help, arguments, function(client, args))
+COMMANDS = {
+    'list-databases': (1, 'List all databases on an account', (),
+                       lambda client, args: DatabaseManagement.list_databases(client)),
+    'list-collections': (2, 'List all collections in a database', ('db',),
+                         lambda client, args: CollectionManagement.list_Containers(client, args.db)),
+    'get-database': (3, 'Get a database by id', ('db',),
+                     lambda client, args: DatabaseManagement.find_database(client, args.db)),
+    'get-collection': (4, 'Get a collection by id', ('db', 'coll'),
+                       lambda client, args: CollectionManagement.find_Container(client, args.db, args.coll)),
+    'change-throughput': (5, 'Get & change collection offer throughput by 100', ('db', 'coll'),
+                          lambda client, args: CollectionManagement.manage_offer_throughput(client, args.db, args.coll)),
+    'create-database': (6, 'Create a database', ('db',),
+                        lambda client, args: DatabaseManagement.create_database(client, args.db)),
+    'create-collection': (7, 'Create a collection', ('db', 'coll'),
+                          lambda client, args: CollectionManagement.create_Container(client, args.db, args.coll)),
+    'create-documents': (8, 'Create documents', ('db', 'coll'),
+                         lambda client, args: DocumentManagement.CreateDocuments(client, args.db, args.coll)),
+    'read-document': (9, 'Read specific documents by id', ('db', 'coll', 'id'), _read_document),
+    'read-documents': (10, 'Read all documents in a collection', ('db', 'coll', 'paging'), _read_documents),
+    'delete-database': (11, 'Delete a database by id', ('db',),
+                        lambda client, args: DatabaseManagement.delete_database(client, args.db)),
+    'delete-collection': (12, 'Delete a collection by id', ('db', 'coll'),
+                          lambda client, args: CollectionManagement.delete_Container(client, args.db, args.coll)),
+    'provision': (None, 'Create or update the databases and collections of a spec', ('spec', 'prune'),
+                  lambda client, args: ProvisioningManagement.provision(
+                      client, ProvisioningManagement.load_spec(args.spec), args.prune, args.dry_run)),
+    'teardown': (None, 'Delete the collections of a spec, and its databases left empty', ('spec',),
+                 lambda client, args: ProvisioningManagement.teardown(
+                     client, ProvisioningManagement.load_spec(args.spec), args.dry_run)),
+    'advise-indexing': (None, 'Propose an indexing policy from a recorded query workload', ('db', 'coll', 'workload'),
+                        _advise_indexing),
+    'collection-stats': (None, 'Report the size, partition key skew and largest properties of a collection',
+                         ('db', 'coll', 'exact'), _collection_stats),
+    'copy-collection': (None, 'Copy the documents of a collection to another one, resuming an interrupted copy',
+                        ('db', 'coll', 'target'), _copy_collection),
+    'aggregate': (None, 'Count, sum, average, min or max documents on the server, optionally per group',
+                  ('db', 'coll', 'aggregate'), _aggregate),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Run the Azure Cosmos management operations from the command line')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    for name, (item, description, arguments, _) in COMMANDS.items():
+        command = subparsers.add_parser(name, help='{0} (menu {1})'.format(description, item) if item else description)
+        if 'db' in arguments:
+            command.add_argument('--db', default=DATABASE_ID, help='database id, default {0}'.format(DATABASE_ID))
+        if 'coll' in arguments:
+            command.add_argument('--coll', default=COLLECTION_ID, help='collection id, default {0}'.format(COLLECTION_ID))
+        if 'id' in arguments:
+            command.add_argument('--id', action='append', default=[], required=True,
+                                 help='document id, repeat it or separate ids with commas')
+        if 'paging' in arguments:
+            command.add_argument('--limit', type=int, help='stop after this many documents')
+            command.add_argument('--page-size', type=int, default=cfg.settings['page_size'])
+            command.add_argument('--continuation', help='resume a read that stopped at --limit')
+        if 'spec' in arguments:
+            command.add_argument('spec', help='JSON file with the databases and collections')
+            command.add_argument('--dry-run', action='store_true', help='print the changes without applying them')
+        if 'workload' in arguments:
+            command.add_argument('--workload', required=True, help='query workload saved by query_workload.write')
+            command.add_argument('--keep-unused', action='store_true',
+                                 help='keep indexing the properties no query uses')
+            command.add_argument('--apply', action='store_true', help='replace the indexing policy with the proposal')
+        if 'exact' in arguments:
+            command.add_argument('--exact', action='store_true',
+                                 help='scan every partition key range in parallel instead of sampling')
+        if 'target' in arguments:
+            command.add_argument('--target-db', required=True, help='database id of the target')
+            command.add_argument('--target-coll', required=True, help='collection id of the target')
+            command.add_argument('--target-host', help='endpoint of the target account, default the source account')
+            command.add_argument('--target-key', help='master key of the target account')
+            command.add_argument('--source-ru', type=float, help='RU/s the reads of the source may use')
+            command.add_argument('--target-ru', type=float, help='RU/s the writes to the target may use')
+            command.add_argument('--transform', choices=['sales-order-v2'],
+                                 help='reshape V1 sales orders as V2 ones on the way')
+        if 'aggregate' in arguments:
+            command.add_argument('--aggregate', action='append', required=True,
+                                 help='name=count, name=sum(field), avg, min or max, repeat it for several')
+            command.add_argument('--group-by', action='append', default=[], help='field to group by, can be repeated')
+            command.add_argument('--where', help='condition on the documents c, eg. "c.total_due > 1000"')
+        if 'prune' in arguments:
+            command.add_argument('--prune', action='store_true',
+                                 help='delete the collections of the spec\'s databases that it does not list')
+        command.add_argument('--json', action='store_true', help='print the result as JSON')
+
+    batch = subparsers.add_parser('batch', help='Run a file of commands concurrently')
+    batch.add_argument('path', help='file with one command per line')
+    batch.add_argument('--workers', type=int, default=WORKERS, help='commands run at once, default {0}'.format(WORKERS))
+    batch.add_argument('--json', action='store_true', help='print every result and the summary as JSON')
+    return parser
+
+
+def run_command(client, args, output):
+    """ Runs one parsed command and returns its result as a dictionary """
+    output.capture()
+    started = time.perf_counter()
+    result = {'command': args.command, 'ok': True}
+    try:
+        value = result['result'] = COMMANDS[args.command][3](client, args)
+        # the management classes print what went wrong and return None or False
+        if value is None or value is False:
+            result.update(ok=False, error='the command did not succeed, see its output')
+        elif isinstance(value, dict) and value.get('failed'):
+            failed = value['failed']
+            result.update(ok=False, error='{0} of its operations failed'.format(
+                len(failed) if isinstance(failed, list) else failed))
+    except errors.HTTPFailure as e:
+        result.update(ok=False, error='{0}: {1}'.format(e.status_code, str(e).splitlines()[0] if str(e) else ''))
+    except Exception as e:
+        result.update(ok=False, error='{0}: {1}'.format(type(e).__name__, e))
+    result['elapsed'] = time.perf_counter() - started
+    result['output'] = output.captured()
+    return result
+
+
+def _read_batch(parser, path):
+    commands = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            words = shlex.split(line)
+            if words[0] == 'batch':
+                parser.error('line {0}: a batch cannot run another batch'.format(number))
+            try:
+                commands.append((number, line, parser.parse_args(words)))
+            except SystemExit:
+                parser.error('line {0}: invalid command \'{1}\''.format(number, line))
+    return commands
+
+
+def summarize(results, elapsed):
+    """ Counts and timings of a batch, in total and per command """
+    timings = {}
+    for result in results:
+        timings.setdefault(result['command'], []).append(result['elapsed'])
+    return {
+        'commands': len(results),
+        'succeeded': sum(1 for r in results if r['ok']),
+        'failed': sum(1 for r in results if not r['ok']),
+        'elapsed': elapsed,
+        'command_time': sum(r['elapsed'] for r in results),
+        'by_command': {
+            command: {'count': len(values), 'mean': sum(values) / len(values), 'p50': percentile(values, 50),
+                      'p95': percentile(values, 95), 'max': max(values)}
+            for command, values in sorted(timings.items())
+        }
+    }
+
+
+def run_batch(client, parser, args, output):
+    commands = _read_batch(parser, args.path)
+    results = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run_command, client, command, output): (number, line)
+                   for number, line, command in commands}
+        for future in as_completed(futures):
+            number, line = futures[future]
+            result = future.result()
+            result.update(line=number, text=line)
+            results.append(result)
+            if args.json:
+                output.stdout.write(json.dumps(result, default=str) + '\n')
+            else:
+                output.stdout.write('{0:<6} {1:>8.3f}s  line {2}: {3}{4}\n'.format(
+                    'ok' if result['ok'] else 'FAILED', result['elapsed'], number, line,
+                    '' if result['ok'] else ' - ' + result['error']))
+
+    summary = summarize(results, time.perf_counter() - started)
+    if args.json:
+        output.stdout.write(json.dumps({'summary': summary}) + '\n')
+    else:
+        output.stdout.write('{0} commands, {1} succeeded, {2} failed in {3:.2f}s ({4:.2f}s of command time)\n'.format(
+            summary['commands'], summary['succeeded'], summary['failed'], summary['elapsed'], summary['command_time']))
+        for command, timing in summary['by_command'].items():
+            output.stdout.write('  {0:<20} {1:>5} x  mean {2:.3f}s  p50 {3:.3f}s  p95 {4:.3f}s  max {5:.3f}s\n'.format(
+                command, timing['count'], timing['mean'], timing['p50'], timing['p95'], timing['max']))
+    return summary['failed'] == 0
+
+
+def main(argv=None, client=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    output = _Output(sys.stdout)
+    sys.stdout = output
+    created = client is None
+    try:
+        if created:
+            # created by the first command that sends a request
+            client = client_factory.lazy()
+        if args.command == 'batch':
+            return 0 if run_batch(client, parser, args, output) else 1
+
+        result = run_command(client, args, output)
+        if args.json:
+            output.stdout.write(json.dumps(result, default=str) + '\n')
+        else:
+            for line in result['output']:
+                output.stdout.write(line + '\n')
+            if not result['ok']:
+                output.stdout.write('Failed - {0}\n'.format(result['error']))
+        return 0 if result['ok'] else 1
+    finally:
+        sys.stdout = output.stdout
+        if created:
+            client_factory.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
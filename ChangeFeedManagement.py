@@ -0,0 +1,156 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import azure.cosmos.errors as errors
+
+import shared.config as cfg
+from DocumentManagement import DocumentManagement
+from QueryManagement import QueryManagement
+from shared.checkpoint import checkpoint_store
+from shared.routing import routing
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - reads the documents created or changed in a collection from its change feed
+#
+#   def sync(documents, range_id):
+#       for document in documents:
+#           print(document['id'])
+#
+#   consumer = ChangeFeedConsumer(client, 'pysamples', 'data', sync, checkpoint_store('changefeed.json'))
+#   consumer.run_once()                 # reads everything changed since the last checkpoint
+#   consumer.start()                    # or keeps polling every 'change_feed_poll_interval' seconds
+#   ...
+#   consumer.close()
+#
+# Every partition key range has its own feed. The ranges are read in parallel, by up to max_workers
+# threads, a page at a time. handler(documents, range_id) is called with each page and once it returns the
+# continuation of the range is saved to the checkpoint store (shared/checkpoint.py), so after a restart
+# the consumer resumes where it stopped instead of rescanning the collection.
+#
+# Without a checkpoint a range is read from the changes made from now on, or from the beginning with
+# start_from_beginning=True. When a range splits while it is read, its children carry on from its continuation,
+# and after a restart children resume from the checkpoint of their parent.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# The change feed holds the latest version of every created or replaced document, deletes do not show up
+# in it. A page whose handler raised is read again on the next run, so handlers should be idempotent.
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_WORKERS = cfg.settings['change_feed_max_workers']
+PAGE_SIZE = cfg.settings['page_size']
+POLL_INTERVAL = cfg.settings['change_feed_poll_interval']
+CHECKPOINTS = cfg.settings['change_feed_checkpoints']
+
+
+class ChangeFeedConsumer:
+
+    def __init__(self, client, db, coll, handler, store=None, max_workers=MAX_WORKERS, page_size=PAGE_SIZE,
+                 start_from_beginning=False):
+        self.client = client
+        self.collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        self.handler = handler
+        self.store = store or checkpoint_store(CHECKPOINTS)
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.start_from_beginning = start_from_beginning
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _continuation(partition_range, checkpoints):
+        if partition_range['id'] in checkpoints:
+            return checkpoints[partition_range['id']]
+        # a range created by a split picks up where its closest parent stopped
+        for parent in reversed(partition_range.get('parents') or []):
+            if parent in checkpoints:
+                return checkpoints[parent]
+        return None
+
+    def _process(self, range_id, continuation):
+        """ Reads the feed of one range until it is caught up and returns the number of changed documents """
+        changed = 0
+        while not self._stopped.is_set():
+            try:
+                documents, next_continuation = DocumentManagement._fetch_changes(
+                    self.client, self.collection_link, range_id, continuation, self.page_size, self.start_from_beginning)
+            except errors.HTTPFailure as e:
+                if e.status_code == 410:
+                    # the range has split, its children carry on from its continuation
+                    children = routing.children(self.client, self.collection_link, range_id)
+                    print('Partition key range \'{0}\' has split into {1}'.format(
+                        range_id, ', '.join('\'{0}\''.format(child['id']) for child in children)))
+                    return changed + sum(self._process(child['id'], continuation) for child in children)
+                raise
+
+            if documents:
+                self.handler(documents, range_id)
+                changed += len(documents)
+            if next_continuation and next_continuation != continuation:
+                self.store.save(self.collection_link, range_id, next_continuation)
+                continuation = next_continuation
+            if not documents:
+                return changed
+        return changed
+
+    def run_once(self):
+        """ Reads the changes of every range since its checkpoint. Returns { range id: changed documents }. """
+        started = time.perf_counter()
+        ranges = QueryManagement.read_partition_key_ranges(self.client, self.collection_link)
+        checkpoints = self.store.load(self.collection_link)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(r['id'], executor.submit(self._process, r['id'], self._continuation(r, checkpoints)))
+                       for r in ranges]
+            changed = {range_id: future.result() for range_id, future in futures}
+
+        # once every range has a checkpoint of its own those of ranges that have split are no longer needed.
+        # The ranges are looked up again, a split found while reading has refreshed them.
+        ranges = QueryManagement.read_partition_key_ranges(self.client, self.collection_link)
+        checkpoints = self.store.load(self.collection_link)
+        if all(r['id'] in checkpoints for r in ranges):
+            current = set(r['id'] for r in ranges)
+            for range_id in checkpoints:
+                if range_id not in current:
+                    self.store.delete(self.collection_link, range_id)
+
+        print('Read {0} changed documents from {1} partition key ranges of \'{2}\' in {3:.2f}s'.format(
+            sum(changed.values()), len(ranges), self.collection_link, time.perf_counter() - started))
+        return changed
+
+    def run(self, interval=POLL_INTERVAL):
+        """ Polls the change feed every interval seconds until stop() is called """
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except errors.HTTPFailure as e:
+                # the checkpoints are where the last successful page left them, the next poll retries from there
+                print('Reading the change feed of \'{0}\' failed ({1}), retrying in {2}s'.format(
+                    self.collection_link, e.status_code, interval))
+            except Exception as e:
+                # a handler that raised, its page is read again on the next poll
+                print('Processing the change feed of \'{0}\' failed ({1}: {2}), retrying in {3}s'.format(
+                    self.collection_link, type(e).__name__, e, interval))
+            self._stopped.wait(interval)
+
+    def start(self, interval=POLL_INTERVAL):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
@@ -1,9 +1,9 @@
-import azure.cosmos.documents as documents
-import azure.cosmos.cosmos_client as cosmos_client
 import azure.cosmos.errors as errors
 
 import shared.config as cfg
 from DBManagement import DatabaseManagement
+from shared.cache import document_cache, metadata_cache
+from shared.throttling import execute
 
 
 # ----------------------------------------------------------------------------------------------------------
@@ -54,17 +54,22 @@ class CollectionManagement:
     def find_Container(client, db, id):
         print('Query for specific Collection')
         db_link = 'dbs/' + db
-        collections = list(client.QueryContainers(
-            db_link,
-            {
-                "query": "SELECT * FROM r WHERE r.id=@id",
-                "parameters": [
-                    { "name":"@id", "value": id }
-                ]
-            }
-        ))
+        collection_link = db_link + '/colls/{0}'.format(id)
+        found = metadata_cache.get(collection_link)
+        if found is None:
+            collections = execute(client, 'QueryContainers',
+                db_link,
+                {
+                    "query": "SELECT * FROM r WHERE r.id=@id",
+                    "parameters": [
+                        { "name":"@id", "value": id }
+                    ]
+                }
+            )
+            found = len(collections) > 0
+            metadata_cache.put(collection_link, found)
 
-        if len(collections) > 0:
+        if found:
             print('Collection with id \'{0}\' was found'.format(id))
             return True
         else:
@@ -73,43 +78,52 @@ class CollectionManagement:
     
     
     @staticmethod
-    def create_Container(client, db, id):
+    def create_Container(client, db, id, definition=None):
         """ The most basic Create of collection will create a collection with 400 RUs throughput and default automatic indexing policy          
          Our code will create a collection with custom index policy, custom offer throughput and unique keys     
+         unless a definition (indexingPolicy, partitionKey, uniqueKeyPolicy, offerThroughput, ...) is given
          """
 
         print("Create Collection - With custom index policy, custom offer throughput and unique keys")
         
         try:
-            coll = {            
-                "id": id,    
-                "indexingPolicy": {
-                    "indexingMode": "lazy",
-                    "automatic": False
-                },
-                "offerThroughput": 400,
-                "uniqueKeyPolicy": {
-                    "uniqueKeys": [{
-                        'paths': ['/field1/field2', '/field3']
-                    }]
+            if definition is not None:
+                coll = dict(definition, id=id)
+            else:
+                coll = {            
+                    "id": id,    
+                    "indexingPolicy": {
+                        "indexingMode": "lazy",
+                        "automatic": False
+                    },
+                    "offerThroughput": 400,
+                    "uniqueKeyPolicy": {
+                        "uniqueKeys": [{
+                            'paths': ['/field1/field2', '/field3']
+                        }]
+                    }
                 }
-            }
+            options = {'offerThroughput': coll.pop('offerThroughput')} if 'offerThroughput' in coll else None
             if DatabaseManagement.find_database(client, db):
                 db_link = 'dbs/' + db
             else:
                 return
-            collection = client.CreateContainer(db_link, coll)
-            unique_key_paths = collection['uniqueKeyPolicy']['uniqueKeys'][0]['paths']
+            collection = execute(client, 'CreateContainer', db_link, coll, options)
+            metadata_cache.invalidate(db_link + '/colls/{0}'.format(id))
             print('Collection with id \'{0}\' created'.format(collection['id']))
             print('IndexPolicy Mode - \'{0}\''.format(collection['indexingPolicy']['indexingMode']))
             print('IndexPolicy Automatic - \'{0}\''.format(collection['indexingPolicy']['automatic']))
            
             print('Collection with id \'{0}\' created'.format(collection['id']))
-            print('Unique Key Paths - \'{0}\', \'{1}\''.format(unique_key_paths[0], unique_key_paths[1]))
+            for unique_key in collection.get('uniqueKeyPolicy', {}).get('uniqueKeys', []):
+                print('Unique Key Paths - {0}'.format(', '.join('\'{0}\''.format(p) for p in unique_key['paths'])))
+            return collection
             
         except errors.HTTPFailure as e:
             if e.status_code == 409:
-               print('A collection with id \'{0}\' already exists'.format(collection['id']))
+               # a cached "not found" of the collection is out of date
+               metadata_cache.invalidate('dbs/' + db + '/colls/{0}'.format(id))
+               print('A collection with id \'{0}\' already exists'.format(id))
             else: 
                 raise errors.HTTPFailure(e.status_code) 
         
@@ -126,17 +140,23 @@ class CollectionManagement:
         try:
             # read the collection, so we can get its _self
             collection_link = 'dbs/'+ db +'/colls/{0}'.format(id)
-            collection = client.ReadContainer(collection_link)
+            collection = execute(client, 'ReadContainer', collection_link)
             # print('collection name \'{0}\''.format(collection))
 
             # now use its _self to query for Offers
-            offer = list(client.QueryOffers('SELECT * FROM c WHERE c.resource = \'{0}\''.format(collection['_self'])))[0]
+            offer = execute(client, 'QueryOffers', {
+                "query": "SELECT * FROM c WHERE c.resource = @resource",
+                "parameters": [
+                    { "name":"@resource", "value": collection['_self'] }
+                ]
+            })[0]
             
             print('Found Offer \'{0}\' for Collection \'{1}\' and its throughput is \'{2}\''.format(offer['id'], collection['_self'], offer['content']['offerThroughput']))
 
         except errors.HTTPFailure as e:
             if e.status_code == 404:
                 print('A collection with id \'{0}\' does not exist'.format(id))
+                return None
             else: 
                 raise errors.HTTPFailure(e.status_code)
 
@@ -148,10 +168,25 @@ class CollectionManagement:
         
         #The following code shows how you can change Collection's throughput
         offer['content']['offerThroughput'] += 100
-        offer = client.ReplaceOffer(offer['_self'], offer)
+        offer = execute(client, 'ReplaceOffer', offer['_self'], offer)
 
         print('Replaced Offer. Offer Throughput is now \'{0}\''.format(offer['content']['offerThroughput']))
+        return offer
                                 
+    @staticmethod
+    def read_offers(client, collections):
+        """ Returns the offers of the given collections (dictionaries with a '_self') by their _self,
+        looked up with a single QueryOffers instead of one query per collection """
+        resources = [collection['_self'] for collection in collections]
+        if not resources:
+            return {}
+        names = ['@r{0}'.format(i) for i in range(len(resources))]
+        offers = execute(client, 'QueryOffers', {
+            "query": "SELECT * FROM c WHERE c.resource IN ({0})".format(', '.join(names)),
+            "parameters": [{ "name": name, "value": resource } for name, resource in zip(names, resources)]
+        })
+        return {offer['resource']: offer for offer in offers}
+
     @staticmethod
     def read_Container(client, db, id):
         print("\nGet a Collection by id")
@@ -163,15 +198,16 @@ class CollectionManagement:
             # Eg. The link for collection with an id of Bar in database Foo would be dbs/Foo/colls/Bar
             db_link = 'dbs/' + db
             collection_link = db_link + '/colls/{0}'.format(id)
-            collection = client.ReadContainer(collection_link)
+            collection = execute(client, 'ReadContainer', collection_link)
             print('Collection with id \'{0}\' was found, it\'s _self is {1}'.format(collection['id'], collection['_self']))
+            return collection
             
         except errors.HTTPFailure as e:
             if e.status_code == 404:
                print('A collection with id \'{0}\' does not exist'.format(id))
+               return None
             else: 
                 raise errors.HTTPFailure(e.status_code)    
-        return True
 
     @staticmethod
     def list_Containers(client, db):
@@ -179,12 +215,13 @@ class CollectionManagement:
             if  DatabaseManagement.find_database(client, db):
                 print("\nList all collections in database \'{0}\'".format(db))               
                 db_link = 'dbs/' + db
-                collections = list(client.ReadContainers(db_link))            
+                collections = execute(client, 'ReadContainers', db_link)            
                 if not collections:
                     print("\'{0}\' has no collections".format(db))
-                    return
+                    return []
                 for collection in collections:
                     print(collection['id'])          
+                return [collection['id'] for collection in collections]
             else:
                 print("\'{0}\' not found".format(db))
         except errors.HTTPFailure as e:
@@ -197,17 +234,21 @@ class CollectionManagement:
         print("\nDelete Collection")
         
         try:
-            if DatabaseManagement.find_database(client, db) and CollectionManagement.find_Container(client, id):
+            if DatabaseManagement.find_database(client, db) and CollectionManagement.find_Container(client, db, id):
                 db_link = 'dbs/' + db
                 collection_link = db_link + '/colls/{0}'.format(id)
-                client.DeleteContainer(collection_link)
+                execute(client, 'DeleteContainer', collection_link)
+                metadata_cache.invalidate(collection_link)
+                document_cache.invalidate(collection_link)
                 print('Collection with id \'{0}\' was deleted'.format(id))
+                return True
             else:
-                return
+                return False
 
 
         except errors.HTTPFailure as e:
             if e.status_code == 404:
+               metadata_cache.invalidate('dbs/' + db + '/colls/{0}'.format(id))
                print('A collection with id \'{0}\' does not exist'.format(id))
             else: 
                 raise errors.HTTPFailure(e.status_code)   
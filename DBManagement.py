@@ -1,8 +1,8 @@
-import azure.cosmos.documents as documents
-import azure.cosmos.cosmos_client as cosmos_client
 import azure.cosmos.errors as errors
 
 import shared.config as cfg
+from shared.cache import document_cache, metadata_cache
+from shared.throttling import execute
 
 # ----------------------------------------------------------------------------------------------------------
 # Prerequistes - 
@@ -38,14 +38,20 @@ class DatabaseManagement:
     def find_database(client, id):
         print('Query for Database')
 
-        databases = list(client.QueryDatabases({
-            "query": "SELECT * FROM r WHERE r.id=@id",
-            "parameters": [
-                { "name":"@id", "value": id }
-            ]
-        }))
-
-        if len(databases) > 0:
+        # the answer is cached by link, so repeated existence checks do not cost a query each
+        database_link = 'dbs/' + id
+        found = metadata_cache.get(database_link)
+        if found is None:
+            databases = execute(client, 'QueryDatabases', {
+                "query": "SELECT * FROM r WHERE r.id=@id",
+                "parameters": [
+                    { "name":"@id", "value": id }
+                ]
+            })
+            found = len(databases) > 0
+            metadata_cache.put(database_link, found)
+
+        if found:
             print('Database with id \'{0}\' was found'.format(id))
             return True
         else:
@@ -57,11 +63,15 @@ class DatabaseManagement:
         print("\n2. Create Database")
         
         try:
-            client.CreateDatabase({"id": id})
+            database = execute(client, 'CreateDatabase', {"id": id})
+            metadata_cache.invalidate('dbs/' + id)
             print('Database with id \'{0}\' created'.format(id))
+            return database
 
         except errors.HTTPFailure as e:
             if e.status_code == 409:
+               # a cached "not found" of the database is out of date
+               metadata_cache.invalidate('dbs/' + id)
                print('A database with id \'{0}\' already exists'.format(id))
             else: 
                 raise errors.HTTPFailure(e.status_code)               
@@ -77,8 +87,9 @@ class DatabaseManagement:
             # Eg. The link for database with an id of Foo would be dbs/Foo
             database_link = 'dbs/' + id
 
-            database = client.ReadDatabase(database_link)
+            database = execute(client, 'ReadDatabase', database_link)
             print('Database with id \'{0}\' was found, it\'s _self is {1}'.format(id, database['_self']))
+            return database
 
         except errors.HTTPFailure as e:
             if e.status_code == 404:
@@ -92,13 +103,14 @@ class DatabaseManagement:
         
         print('Databases:')
         
-        databases = list(client.ReadDatabases())
+        databases = execute(client, 'ReadDatabases')
         
         if not databases:
-            return
+            return []
 
         for database in databases:
             print(database['id'])          
+        return [database['id'] for database in databases]
 
     @staticmethod
     def delete_database(client, id):
@@ -106,13 +118,18 @@ class DatabaseManagement:
         
         try:
            database_link = 'dbs/' + id
-           client.DeleteDatabase(database_link)
+           execute(client, 'DeleteDatabase', database_link)
+           metadata_cache.invalidate(database_link)
+           document_cache.invalidate(database_link)
 
            print('Database with id \'{0}\' was deleted'.format(id))
+           return True
 
         except errors.HTTPFailure as e:
             if e.status_code == 404:
+               metadata_cache.invalidate('dbs/' + id)
                print('A database with id \'{0}\' does not exist'.format(id))
+               return False
             else: 
                 raise errors.HTTPFailure(e.status_code)
 
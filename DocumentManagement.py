@@ -1,11 +1,17 @@
-import azure.cosmos.documents as documents
-import azure.cosmos.cosmos_client as cosmos_client
 import azure.cosmos.errors as errors
+import copy
 import datetime
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import shared.config as cfg
 from DBManagement import DatabaseManagement
 from CollectionManagement import CollectionManagement
+from shared.cache import document_cache, metadata_cache
+from shared.routing import Undefined, partition_key_of, routing
+from shared.throttling import execute, request_charge, run
+from shared.workload import query_workload
 
 # ----------------------------------------------------------------------------------------------------------
 # Prerequistes - 
@@ -20,9 +26,15 @@ from CollectionManagement import CollectionManagement
 #
 # Create Documents(CreateDocuments)
 #
-# Read document by id (ReadDocument)
+# Read document by id (ReadDocument), optionally from a cache revalidated with If-None-Match (_read_item)
 #
-# Read all documents in a collection(ReadDocument)
+# Read many documents by id at once (read_many)
+#
+# Read all documents in a collection(ReadDocuments)
+#
+# Stream the documents of a collection page by page, resumable from a continuation token (ReadDocumentPages)
+#
+# Read the changes of one partition key range from the change feed (_fetch_changes, see ChangeFeedManagement.py)
 #
 
 # ----------------------------------------------------------------------------------------------------------
@@ -31,6 +43,10 @@ HOST = cfg.settings['host']
 MASTER_KEY = cfg.settings['master_key']
 DATABASE_ID = cfg.settings['database_id']
 COLLECTION_ID = cfg.settings['collection_id']
+PAGE_SIZE = cfg.settings['page_size']
+READ_MANY_POINT_READS = cfg.settings['read_many_point_reads']
+READ_MANY_QUERY_SIZE = cfg.settings['read_many_query_size']
+READ_MANY_CONCURRENCY = cfg.settings['read_many_concurrency']
 
 # database_link = 'dbs/' + DATABASE_ID
 # collection_link = database_link + '/colls/' + COLLECTION_ID
@@ -49,22 +65,26 @@ class DocumentManagement:
                 # Create a SalesOrder object. This object has nested properties and various types including numbers, DateTimes and strings.
                 # This can be saved as JSON as is without converting into rows/columns.
                 sales_order = DocumentManagement.GetSalesOrder("SalesOrder1")
-                client.CreateItem(collection_link, sales_order)
+                created = execute(client, 'CreateItem', collection_link, sales_order)
+                document_cache.invalidate(collection_link + '/docs/' + sales_order['id'])
                 print("creating document salesorde2")
                 # As your app evolves, let's say your object has a new schema. You can insert SalesOrderV2 objects without any 
                 # changes to the database tier.
                 # sales_order2 = DocumentManagement.GetSalesOrderV2("SalesOrder2")
-                # client.CreateItem(collection_link, sales_order2)
+                # execute(client, 'CreateItem', collection_link, sales_order2)
+                return created
             else:
                 print("Invalid DB or Collection")
         except errors.HTTPFailure as e:
             if e.status_code == 404:
-                print('A collection with id \'{0}\' does not exist'.format(id))
+                # the cached existence check is stale, the next call has to query again
+                metadata_cache.invalidate('dbs/' + db + '/colls/{0}'.format(coll))
+                print('A collection with id \'{0}\' does not exist'.format(coll))
             else: 
                 raise errors.HTTPFailure(e.status_code)   
 
     @staticmethod
-    def ReadDocument(client, db, coll, doc_id):
+    def ReadDocument(client, db, coll, doc_id, partition_key=None):
         try:
             if DatabaseManagement.find_database(client, db) and CollectionManagement.find_Container(client, db, coll):
                 db_link = 'dbs/' + db
@@ -74,42 +94,304 @@ class DocumentManagement:
                 # Note that Reads require a partition key to be spcified. This can be skipped if your collection is not
                 # partitioned i.e. does not have a partition key definition during creation.
                 doc_link = collection_link + '/docs/' + doc_id
-                response = client.ReadItem(doc_link)
+                response = DocumentManagement._read_item(client, doc_link, partition_key)
 
                 print('Document read by Id {0}'.format(doc_id))
                 print('Account Number: {0}'.format(response.get('account_number')))
+                return response
             else:
                 print("Invalid DB or Collection")
         except errors.HTTPFailure as e:
             if e.status_code == 404:
-                 print('A collection with id \'{0}\' does not exist'.format(id))
+                 metadata_cache.invalidate('dbs/' + db + '/colls/{0}'.format(coll))
+                 print('A collection with id \'{0}\' does not exist'.format(coll))
             else: 
                 raise errors.HTTPFailure(e.status_code) 
 
     @staticmethod
-    def ReadDocuments(client, db, coll):
+    def _read_item(client, doc_link, partition_key=None):
+        """ Point reads a document. With the document cache enabled a cached copy is revalidated with
+        If-None-Match, and while it is unchanged the server's 304 stands in for the full read. """
+        options = {} if partition_key is None else {'partitionKey': partition_key}
+        if not document_cache.enabled:
+            return execute(client, 'ReadItem', doc_link, options)
+
+        cached = document_cache.get(doc_link, partition_key)
+        if cached is not None:
+            options['accessCondition'] = {'type': 'IfNoneMatch', 'condition': cached['_etag']}
+        try:
+            document = execute(client, 'ReadItem', doc_link, options)
+        except errors.HTTPFailure as e:
+            if e.status_code == 404:
+                document_cache.invalidate(doc_link)
+            raise
+
+        if document is None and cached is not None:
+            # 304 Not Modified
+            document_cache.record(True)
+            return copy.deepcopy(cached)
+        document_cache.record(False)
+        document_cache.put(doc_link, document, partition_key)
+        return document
+
+    @staticmethod
+    def _point_read(client, collection_link, doc_id, partition_key):
+        try:
+            return [DocumentManagement._read_item(client, collection_link + '/docs/' + doc_id, partition_key)]
+        except errors.HTTPFailure as e:
+            if e.status_code == 404:
+                return []
+            raise
+
+    @staticmethod
+    def _query_ids(client, collection_link, doc_ids, partition_key, range_id=None):
+        """ Reads doc_ids with one IN query, within a partition key, a partition key range or across partitions """
+        names = ['@id{0}'.format(i) for i in range(len(doc_ids))]
+        query = {
+            "query": "SELECT * FROM c WHERE c.id IN ({0})".format(', '.join(names)),
+            "parameters": [{ "name": name, "value": doc_id } for name, doc_id in zip(names, doc_ids)]
+        }
+        options = {'maxItemCount': len(doc_ids)}
+        if partition_key is not None:
+            options['partitionKey'] = partition_key
+        elif range_id is None:
+            options['enableCrossPartitionQuery'] = True
+        documents = []
+        while True:
+            page, headers = DocumentManagement._fetch_page(client, collection_link, query, options, range_id)
+            documents.extend(page)
+            options['continuation'] = headers.get('x-ms-continuation')
+            if not options['continuation']:
+                return documents
+
+    @staticmethod
+    def _query_range(client, collection_link, keys, range_id, definition):
+        """ Reads (id, partition key) pairs of many partition keys that share a partition key range with IN
+        queries sent to that range. Returns [(group, document)]. """
+        wanted = set((doc_id, json.dumps(partition_key)) for doc_id, partition_key in keys)
+        ids = list(OrderedDict.fromkeys(doc_id for doc_id, _ in keys))
+        documents = []
+        try:
+            for i in range(0, len(ids), READ_MANY_QUERY_SIZE):
+                documents.extend(DocumentManagement._query_ids(client, collection_link, ids[i:i + READ_MANY_QUERY_SIZE],
+                                                               None, range_id))
+        except errors.HTTPFailure as e:
+            if e.status_code != 410:
+                raise
+            # the range has split since it was looked up, the ids are read by partition key instead
+            documents = []
+            for partition_key in set(json.dumps(partition_key) for _, partition_key in keys):
+                documents.extend(DocumentManagement._query_ids(
+                    client, collection_link, [doc_id for doc_id, pk in keys if json.dumps(pk) == partition_key],
+                    json.loads(partition_key)))
+        found = []
+        for document in documents:
+            partition_key = partition_key_of(document, definition)
+            if partition_key is Undefined:
+                continue
+            group = json.dumps(partition_key)
+            # the same id can exist under another partition key of the range
+            if (document['id'], group) in wanted:
+                found.append((group, document))
+        return found
+
+    @staticmethod
+    def read_many(client, db, coll, items, max_concurrency=READ_MANY_CONCURRENCY):
+        """ Reads many documents at once. items are ids, or (id, partition key) pairs for a partitioned collection.
+
+        The ids are grouped by partition key. A small group is read with concurrent point reads, a larger one
+        with 'SELECT * FROM c WHERE c.id IN (...)' queries of up to READ_MANY_QUERY_SIZE ids, which cost one
+        round trip instead of one per id. Small groups whose partition keys hash to the same partition key range
+        (shared/routing.py) are read together, with IN queries sent to that range.
+
+        Returns (documents, missing): documents follows the order of items with None for every id that was
+        not found, and missing lists those ids. """
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        keys = [item if isinstance(item, tuple) else (item, None) for item in items]
+
+        groups = OrderedDict()
+        for doc_id, partition_key in keys:
+            ids = groups.setdefault(json.dumps(partition_key), (partition_key, OrderedDict()))[1]
+            ids[doc_id] = True
+
+        point_reads = []
+        ranges = OrderedDict()
+        routing_map = None
+        if len(groups) > 1 and any(partition_key is not None for partition_key, _ in groups.values()):
+            routing_map = routing.get(client, collection_link)
+
+        found = {}
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = []
+            for group, (partition_key, ids) in groups.items():
+                ids = list(ids)
+                if len(ids) > READ_MANY_POINT_READS:
+                    for i in range(0, len(ids), READ_MANY_QUERY_SIZE):
+                        futures.append((group, executor.submit(DocumentManagement._query_ids, client, collection_link,
+                                                               ids[i:i + READ_MANY_QUERY_SIZE], partition_key)))
+                elif partition_key is not None and routing_map is not None and routing_map.partitioned:
+                    range_id = routing_map.range_for(partition_key)['id']
+                    ranges.setdefault(range_id, []).extend((doc_id, partition_key) for doc_id in ids)
+                else:
+                    point_reads.extend((doc_id, partition_key) for doc_id in ids)
+
+            for range_id, range_keys in ranges.items():
+                if len(range_keys) <= READ_MANY_POINT_READS:
+                    point_reads.extend(range_keys)
+                else:
+                    futures.append((None, executor.submit(DocumentManagement._query_range, client, collection_link,
+                                                          range_keys, range_id, routing_map.definition)))
+            for doc_id, partition_key in point_reads:
+                futures.append((json.dumps(partition_key), executor.submit(
+                    DocumentManagement._point_read, client, collection_link, doc_id, partition_key)))
+
+            for group, future in futures:
+                if group is None:
+                    for document_group, document in future.result():
+                        found[(document['id'], document_group)] = document
+                    continue
+                for document in future.result():
+                    found[(document['id'], group)] = document
+
+        documents = [found.get((doc_id, json.dumps(partition_key))) for doc_id, partition_key in keys]
+        missing = [doc_id for (doc_id, partition_key), document in zip(keys, documents) if document is None]
+        return documents, missing
+
+    @staticmethod
+    def ReadDocumentsById(client, db, coll, doc_ids):
+        try:
+            if DatabaseManagement.find_database(client, db) and CollectionManagement.find_Container(client, db, coll):
+                print('\nReading {0} documents by Id\n'.format(len(doc_ids)))
+                documents, missing = DocumentManagement.read_many(client, db, coll, doc_ids)
+                for doc_id, document in zip(doc_ids, documents):
+                    if document is not None:
+                        print('Document read by Id {0}, Account Number: {1}'.format(doc_id, document.get('account_number')))
+                for doc_id in missing:
+                    print('No document with id \'{0}\' was found'.format(doc_id))
+                return documents
+            else:
+                print("Invalid DB or Collection")
+        except errors.HTTPFailure as e:
+            if e.status_code == 404:
+                 metadata_cache.invalidate('dbs/' + db + '/colls/{0}'.format(coll))
+                 print('A collection with id \'{0}\' does not exist'.format(coll))
+            else: 
+                raise errors.HTTPFailure(e.status_code) 
+
+    @staticmethod
+    def _fetch_page(client, collection_link, query=None, options=None, partition_key_range_id=None):
+        """ Runs one round trip of a read feed (query None) or a query and returns (documents, response headers).
+        Unlike ReadItems/QueryItems iterables, this honours options['continuation'], so a scan can be resumed. """
+        # the SDK's link helpers are imported on first use, they pull in most of the SDK
+        import azure.cosmos.base as base
+        path = base.GetPathFromLink(collection_link, 'docs')
+        collection_id = base.GetResourceIdOrFullNameFromLink(collection_link)
+        operation = 'ReadItems' if query is None else 'QueryItems'
+        options = options or {}
+        recording = query is not None and query_workload.enabled
+        if recording:
+            # the server's query metrics tell how many documents it had to read to find the results
+            options = dict(options, populateQueryMetrics=True)
+        try:
+            documents, headers = run(client, operation, collection_link, client.QueryFeed,
+                                     path, collection_id, query, options, partition_key_range_id)
+        except errors.HTTPFailure as e:
+            if e.status_code == 410 and partition_key_range_id is not None:
+                # the range has split, the cached ranges of the collection are out of date
+                routing.invalidate(client, collection_link)
+            raise
+        if recording:
+            query_workload.record(collection_link, query, not options.get('continuation'), len(documents),
+                                  request_charge(headers), headers)
+        return documents, headers or {}
+
+    @staticmethod
+    def _fetch_changes(client, collection_link, partition_key_range_id, continuation=None, page_size=PAGE_SIZE,
+                       start_from_beginning=False):
+        """ Reads one page of the change feed of a partition key range and returns (documents, continuation).
+        The continuation (the ETag of the response) resumes the feed after these documents. Without one, the
+        feed starts at the beginning or, unless start_from_beginning, with the changes made from now on. """
+        options = {'partitionKeyRangeId': partition_key_range_id, 'maxItemCount': page_size}
+        if continuation:
+            options['continuation'] = continuation
+        elif start_from_beginning:
+            options['startFromBeginning'] = True
+
+        def fetch():
+            # a new iterable per attempt, a throttled fetch_next_block would leave the old one without a continuation
+            return client.QueryItemsChangeFeed(collection_link, dict(options)).fetch_next_block()
+
+        try:
+            documents = run(client, 'QueryItemsChangeFeed', collection_link, fetch)
+        except errors.HTTPFailure as e:
+            if e.status_code == 410:
+                routing.invalidate(client, collection_link)
+            raise
+        return documents, (client.last_response_headers or {}).get('etag') or continuation
+
+    @staticmethod
+    def ReadDocumentPages(client, db, coll, page_size=PAGE_SIZE, continuation=None, limit=None):
+        """ Yields (documents, continuation) one page at a time. Passing a continuation returned earlier
+        resumes the scan after that page, a continuation of None means the collection has been read completely.
+        At most limit documents are returned when a limit is given. """
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        returned = 0
+        while limit is None or returned < limit:
+            # the last page is requested with a smaller page size, so it never has to be cut and
+            # its continuation token stays valid for resuming the scan
+            options = {'maxItemCount': page_size if limit is None else min(page_size, limit - returned)}
+            if continuation:
+                options['continuation'] = continuation
+            documents, headers = DocumentManagement._fetch_page(client, collection_link, None, options)
+            continuation = headers.get('x-ms-continuation')
+            returned += len(documents)
+            if documents or not continuation:
+                yield documents, continuation
+            if not continuation:
+                return
+
+    @staticmethod
+    def ReadDocuments(client, db, coll, page_size=PAGE_SIZE, continuation=None, limit=None):
         try:
             if DatabaseManagement.find_database(client, db) and CollectionManagement.find_Container(client, db, coll):
-                db_link = 'dbs/' + db
-                collection_link = db_link + '/colls/{0}'.format(coll)
                 print('\nReading all documents in a collection\n')
 
                 # NOTE: Use MaxItemCount on Options to control how many documents come back per trip to the server
                 #       Important to handle throttles whenever you are doing operations such as this that might
                 #       result in a 429 (throttled request)
-                documentlist = list(client.ReadItems(collection_link, {'maxItemCount':10}))
-                
-                print('Found {0} documents'.format(documentlist.__len__()))
-                
-                for doc in documentlist:
-                    print('Document Id: {0}'.format(doc.get('id')))
+                # Documents are printed page by page as they arrive, only one page is held in memory.
+                count = 0
+                for documents, continuation in DocumentManagement.ReadDocumentPages(client, db, coll, page_size,
+                                                                                    continuation, limit):
+                    for doc in documents:
+                        print('Document Id: {0}'.format(doc.get('id')))
+                    count += len(documents)
+
+                print('Found {0} documents'.format(count))
+                if continuation:
+                    print('Stopped before the end of the collection, resume with continuation {0}'.format(continuation))
+                return continuation
             else:
                 print("Invalid DB or Collection")
         except errors.HTTPFailure as e:
             if e.status_code == 404:
-                 print('A collection with id \'{0}\' does not exist'.format(id))
+                 metadata_cache.invalidate('dbs/' + db + '/colls/{0}'.format(coll))
+                 print('A collection with id \'{0}\' does not exist'.format(coll))
             else: 
-                raise errors.HTTPFailure(e.status_code) 
+                raise errors.HTTPFailure(e.status_code)
+
+    @staticmethod
+    def read_columns(client, db, coll, fields, partition_key=None, page_size=PAGE_SIZE):
+        """ Reads fields (property names or dotted paths, items.0.unit_price is the unit price of the first item)
+        of every document, or of the documents of one partition key, into a ColumnarResult (shared/columnar.py).
+        Only those fields are sent back by the server. """
+        # imported here, QueryManagement is built on this module
+        from QueryManagement import QueryManagement, _steps
+        projection = ', '.join('c{0} AS f{1}'.format(''.join('[{0}]'.format(json.dumps(step)) for step in _steps(field)), i)
+                               for i, field in enumerate(fields))
+        return QueryManagement.query_columns(client, db, coll, 'SELECT {0} FROM c'.format(projection),
+                                             ['f{0}'.format(i) for i in range(len(fields))], page_size=page_size,
+                                             partition_key=partition_key, names=fields)
 
     @staticmethod
     def GetSalesOrder(document_id):
@@ -0,0 +1,333 @@
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import shared.config as cfg
+from DocumentManagement import DocumentManagement
+from QueryManagement import QueryManagement, QueryPlan
+from shared.checkpoint import checkpoint_store
+from shared.throttling import request_charge
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - exports all the documents of a collection, or the results of a query, to files
+#
+#   ExportManagement.export(client, 'pysamples', 'data', 'snapshots/data')
+#       writes snapshots/data-00000.jsonl.gz, snapshots/data-00001.jsonl.gz, ...
+#
+#   ExportManagement.export(client, 'pysamples', 'data', 'snapshots/data', file_format='parquet',
+#                           query='SELECT * FROM c WHERE c.order_date > @since',
+#                           parameters=[{'name': '@since', 'value': '2020-01-01'}])
+#
+# Formats - JSON Lines compressed with gzip, zstd (needs the zstandard package) or not at all ('none'), or
+#    Parquet (needs pyarrow), compressed with snappy, gzip or zstd. In Parquet every top level property is
+#    a column and nested objects and arrays are stored as JSON text. The columns of a file are the properties
+#    of the first page written to it, a property whose values have different types in that page is stored as
+#    JSON text, and a later page with a property or type the file does not have starts the next file.
+#
+# Readers - every partition key range is read by its own task, up to max_workers at once. The pages they
+#    read go through a queue of at most buffer_pages pages to the single writer, so a slow disk holds the
+#    readers back instead of filling up memory.
+#
+# Rotation - a file is closed and the next one started once it holds max_file_bytes.
+#
+# Progress - when a file is closed, the continuation of every range up to the last page in the file is
+#    saved to the checkpoint store. An export that was interrupted is resumed by running it again with the
+#    same path_prefix: the files that were completed are kept, the one that was being written is written
+#    again from the saved continuations.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# The export is not a point in time snapshot, documents changed while it runs may or may not be included.
+# A query has to return its results per partition key range, so TOP, OFFSET/LIMIT and aggregates are not
+# supported. When the partition key ranges of the collection split between two runs, an interrupted
+# export cannot be resumed and has to be started over.
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_WORKERS = cfg.settings['export_max_workers']
+PAGE_SIZE = cfg.settings['page_size']
+BUFFER_PAGES = cfg.settings['export_buffer_pages']
+MAX_FILE_BYTES = cfg.settings['export_max_file_bytes']
+ROW_GROUP_SIZE = cfg.settings['export_row_group_size']
+CHECKPOINTS = cfg.settings['export_checkpoints']
+
+_EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst', 'none': '.jsonl'}
+
+
+class _JsonLinesWriter:
+
+    def __init__(self, path, compression):
+        self._file = open(path, 'wb')
+        if compression == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=self._file, mode='wb')
+        elif compression == 'zstd':
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._file)
+        else:
+            self._stream = self._file
+
+    def write(self, documents):
+        self._stream.write(''.join(json.dumps(d, separators=(',', ':')) + '\n' for d in documents).encode('utf-8'))
+
+    def size(self):
+        # the compressed bytes on disk so far, the compressor's internal buffer is not counted
+        return self._file.tell()
+
+    def close(self):
+        if self._stream is not self._file:
+            self._stream.close()
+        if not self._file.closed:
+            self._file.close()
+
+
+class _SchemaChanged(Exception):
+    pass
+
+
+class _ParquetWriter:
+
+    def __init__(self, path, compression, row_group_size=ROW_GROUP_SIZE):
+        self._file = open(path, 'wb')
+        self._compression = None if compression == 'none' else compression
+        self._row_group_size = row_group_size
+        self._writer = None
+        self._schema = None
+        self._tables = []
+        self._rows = 0
+        # the columns whose values did not share one type in the first documents, stored as JSON text
+        self._encoded = set()
+
+    def _row(self, document):
+        return {k: json.dumps(v) if isinstance(v, (dict, list)) or (k in self._encoded and v is not None) else v
+                for k, v in document.items()}
+
+    def _first_table(self, documents):
+        """ The columns of a new file are every property of any of its first documents, in the order they
+        first appear. A property whose values cannot be stored with one type is written as JSON text. """
+        rows = [self._row(d) for d in documents]
+        names = {}
+        for row in rows:
+            names.update(dict.fromkeys(row))
+        columns = {}
+        for name in names:
+            try:
+                columns[name] = pyarrow.array([row.get(name) for row in rows])
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OverflowError):
+                self._encoded.add(name)
+                columns[name] = pyarrow.array([None if d.get(name) is None else json.dumps(d[name])
+                                               for d in documents], pyarrow.string())
+        return pyarrow.table(columns)
+
+    def write(self, documents):
+        """ Raises _SchemaChanged, without writing any of them, when the documents do not fit the columns
+        of the file. The columns are taken from the first documents written. """
+        if self._schema is None:
+            table = self._first_table(documents)
+            self._schema = table.schema
+            self._writer = parquet.ParquetWriter(self._file, self._schema, compression=self._compression)
+        else:
+            names = set(self._schema.names)
+            if any(not names.issuperset(d) for d in documents):
+                raise _SchemaChanged()
+            try:
+                table = pyarrow.Table.from_pylist([self._row(d) for d in documents], schema=self._schema)
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OverflowError):
+                raise _SchemaChanged()
+        self._tables.append(table)
+        self._rows += len(documents)
+        if self._rows >= self._row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._tables:
+            self._writer.write_table(pyarrow.concat_tables(self._tables))
+        self._tables = []
+        self._rows = 0
+
+    def size(self):
+        return self._file.tell()
+
+    def close(self):
+        if self._writer is not None:
+            self._flush()
+            self._writer.close()
+        if not self._file.closed:
+            self._file.close()
+
+
+class ExportManagement:
+
+    @staticmethod
+    def _file_name(path_prefix, number, file_format, compression):
+        extension = '.parquet' if file_format == 'parquet' else _EXTENSIONS[compression]
+        return '{0}-{1:05d}{2}'.format(path_prefix, number, extension)
+
+    @staticmethod
+    def _writer(path, file_format, compression):
+        if file_format == 'parquet':
+            return _ParquetWriter(path, compression)
+        return _JsonLinesWriter(path, compression)
+
+    @staticmethod
+    def _check_format(file_format, compression):
+        if file_format not in ('jsonl', 'parquet'):
+            raise ValueError('Unknown format \'{0}\', use jsonl or parquet'.format(file_format))
+        if file_format == 'parquet':
+            if pyarrow is None:
+                raise ImportError('Exporting to Parquet needs pyarrow, pip install pyarrow')
+            if compression not in ('snappy', 'gzip', 'zstd', 'none'):
+                raise ValueError('Parquet files can be compressed with snappy, gzip, zstd or none')
+        else:
+            if compression not in _EXTENSIONS:
+                raise ValueError('JSON Lines files can be compressed with gzip, zstd or none')
+            if compression == 'zstd' and zstandard is None:
+                raise ImportError('zstd compression needs zstandard, pip install zstandard')
+
+    @staticmethod
+    def _read_range(client, collection_link, query, range_id, continuation, page_size, pages, stopped):
+        """ Puts (range id, documents, continuation, request charge) of every page of a range on pages """
+        while not stopped.is_set():
+            options = {'maxItemCount': page_size}
+            if continuation:
+                options['continuation'] = continuation
+            documents, headers = DocumentManagement._fetch_page(client, collection_link, query, options, range_id)
+            continuation = headers.get('x-ms-continuation')
+            item = (range_id, documents, continuation, request_charge(headers))
+            # waits for the writer while the buffer is full, unless the export was stopped
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if not continuation:
+                return
+
+    @staticmethod
+    def export(client, db, coll, path_prefix, file_format='jsonl', compression=None, query=None, parameters=None,
+               max_workers=MAX_WORKERS, page_size=PAGE_SIZE, buffer_pages=BUFFER_PAGES, max_file_bytes=MAX_FILE_BYTES,
+               store=None):
+        """ Exports the documents of a collection, or the results of query, to files named path_prefix-NNNNN.
+        Returns a summary with the files written, the number of documents and the total request charge. """
+        if compression is None:
+            compression = 'snappy' if file_format == 'parquet' else 'gzip'
+        ExportManagement._check_format(file_format, compression)
+        if query is not None:
+            plan = QueryPlan(query, parameters or [])
+            if plan.top is not None or plan.limit is not None:
+                raise ValueError('TOP and OFFSET/LIMIT cannot be applied per partition key range')
+            query = {'query': query, 'parameters': parameters or []}
+
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        store = store or checkpoint_store(CHECKPOINTS)
+        started = time.perf_counter()
+        range_ids = [r['id'] for r in QueryManagement.read_partition_key_ranges(client, collection_link)]
+
+        # { 'files': [...], 'documents': n, 'ranges': { range id: continuation, '' once read completely } }
+        saved = store.load(path_prefix).get('progress')
+        progress = json.loads(saved) if saved else None
+        if progress is not None and progress.get('complete'):
+            print('The export to \'{0}\' has already completed'.format(path_prefix))
+            return {'files': progress['files'], 'documents': progress['documents'], 'request_charge': 0.0,
+                    'elapsed': 0.0}
+        if progress is not None:
+            if sorted(progress['ranges']) != sorted(range_ids) or progress.get('query') != query:
+                raise ValueError('The export to \'{0}\' cannot be resumed, the query or the partition key ranges '
+                                 'of the collection have changed'.format(path_prefix))
+            print('Resuming the export to \'{0}\' after {1} files'.format(path_prefix, len(progress['files'])))
+        else:
+            progress = {'files': [], 'documents': 0, 'query': query, 'ranges': {r: None for r in range_ids}}
+
+        positions = dict(progress['ranges'])
+        remaining = [r for r in range_ids if positions[r] != '']
+        summary = {'files': list(progress['files']), 'documents': progress['documents'], 'request_charge': 0.0}
+        in_file = 0
+
+        def commit(complete=False):
+            progress.update(files=list(summary['files']), documents=summary['documents'], ranges=dict(positions),
+                            complete=complete)
+            store.save(path_prefix, 'progress', json.dumps(progress))
+
+        directory = os.path.dirname(path_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        pages = queue.Queue(maxsize=buffer_pages)
+        stopped = threading.Event()
+        writer = None
+        path = None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            readers = [executor.submit(ExportManagement._read_range, client, collection_link, query, range_id,
+                                       positions[range_id], page_size, pages, stopped) for range_id in remaining]
+            try:
+                finished = 0
+                while finished < len(remaining):
+                    try:
+                        range_id, documents, continuation, charge = pages.get(timeout=0.1)
+                    except queue.Empty:
+                        # a reader that failed puts nothing more on the queue, its exception is raised here
+                        for reader in readers:
+                            if reader.done() and reader.exception() is not None:
+                                raise reader.exception()
+                        continue
+
+                    summary['request_charge'] += charge
+                    while documents:
+                        if writer is None:
+                            path = ExportManagement._file_name(path_prefix, len(summary['files']), file_format,
+                                                               compression)
+                            writer = ExportManagement._writer(path, file_format, compression)
+                            in_file = 0
+                        try:
+                            writer.write(documents)
+                            in_file += len(documents)
+                            documents = None
+                        except _SchemaChanged:
+                            # the documents start the next file, the columns of this one do not fit them
+                            writer.close()
+                            summary['files'].append(path)
+                            summary['documents'] += in_file
+                            commit()
+                            writer = None
+
+                    positions[range_id] = continuation or ''
+                    if not continuation:
+                        finished += 1
+
+                    if writer is not None and writer.size() >= max_file_bytes:
+                        writer.close()
+                        summary['files'].append(path)
+                        summary['documents'] += in_file
+                        commit()
+                        print('Wrote \'{0}\', {1} documents exported'.format(path, summary['documents']))
+                        writer = None
+            except BaseException:
+                stopped.set()
+                raise
+            finally:
+                if writer is not None and stopped.is_set():
+                    writer.close()
+
+        if writer is not None:
+            writer.close()
+            summary['files'].append(path)
+            summary['documents'] += in_file
+        commit(complete=True)
+
+        summary['elapsed'] = time.perf_counter() - started
+        print('Exported {0} documents to {1} files in {2:.2f}s, request charge {3:.2f}'.format(
+            summary['documents'], len(summary['files']), summary['elapsed'], summary['request_charge']))
+        return summary
@@ -0,0 +1,80 @@
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+# ----------------------------------------------------------------------------------------------------------
+# Import profile - shows where the startup time of an entry point goes
+#
+# Every module is imported in a fresh interpreter with python -X importtime, and the modules and the
+# top level packages that took the longest to import are reported:
+#
+#   $ python ImportProfile.py                       # ProgramMenu and CLI
+#   $ python ImportProfile.py ExportManagement --top 10 --json
+#
+# The SDK and requests are only imported when the first client is created (shared/client.py), so they
+# should not show up here. When they do, a module imports them at the top again.
+# ----------------------------------------------------------------------------------------------------------
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$')
+
+
+def profile(module, repeat=3):
+    """ Returns { 'module', 'total', 'modules': [(name, self, cumulative)] } in seconds, the fastest of repeat runs """
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            raise RuntimeError('Importing {0} failed:\n{1}'.format(module, process.stderr))
+
+        lines = [m.groups() for m in map(_LINE.match, process.stderr.splitlines()) if m]
+        # the report lists a module after everything it imported, indented one deeper, so the module's own
+        # imports are the more indented lines right before it. The rest is interpreter startup (site).
+        end = max(i for i, (own, cumulative, indent, name) in enumerate(lines) if name == module and len(indent) == 1)
+        start = end
+        while start > 0 and len(lines[start - 1][2]) > 1:
+            start -= 1
+        modules = [(name, int(own) / 1e6, int(cumulative) / 1e6) for own, cumulative, indent, name in lines[start:end + 1]]
+        total = modules[-1][2]
+        if best is None or total < best['total']:
+            best = {'module': module, 'total': total, 'modules': modules}
+    return best
+
+
+def packages(modules):
+    """ Sums the self time of the modules per top level package """
+    totals = {}
+    for name, own, cumulative in modules:
+        package = name.split('.')[0]
+        if package == 'azure':
+            package = '.'.join(name.split('.')[:2])
+        totals[package] = totals.get(package, 0.0) + own
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def print_report(report, top):
+    print('{0}: {1:.1f} ms'.format(report['module'], report['total'] * 1000))
+    print('  {0:<44} {1:>10} {2:>12}'.format('slowest modules', 'self ms', 'cumulative'))
+    for name, own, cumulative in sorted(report['modules'], key=lambda m: -m[2])[:top]:
+        print('  {0:<44} {1:>10.1f} {2:>12.1f}'.format(name, own * 1000, cumulative * 1000))
+    print('  {0:<44} {1:>10}'.format('packages', 'self ms'))
+    for package, own in packages(report['modules'])[:top]:
+        print('  {0:<44} {1:>10.1f}'.format(package, own * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the import time of the entry points')
+    parser.add_argument('modules', nargs='*', default=['ProgramMenu', 'CLI'])
+    parser.add_argument('--top', type=int, default=15, help='modules and packages listed per entry point')
+    parser.add_argument('--repeat', type=int, default=3, help='imports per module, the fastest is reported')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    reports = [profile(module, args.repeat) for module in args.modules]
+    if args.json:
+        print(json.dumps([dict(r, packages=packages(r['modules'])) for r in reports], indent=2))
+    else:
+        for report in reports:
+            print_report(report, args.top)
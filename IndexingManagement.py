@@ -0,0 +1,325 @@
+import re
+
+import shared.config as cfg
+from DocumentManagement import DocumentManagement
+from shared.throttling import execute
+from shared.workload import query_workload
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - proposes an indexing policy for a collection from the queries recorded against it
+#
+#   query_workload.start()              # records the queries of QueryManagement, DocumentManagement, ...
+#   ... run the application ...
+#   advisor = IndexAdvisor(client, 'pysamples', 'data')
+#   proposal = advisor.propose()
+#   advisor.print_report(proposal)
+#   advisor.apply(proposal['policy'])   # ReplaceContainer with the proposed policy
+#
+# Every query shape recorded by shared/workload.py is parsed for the properties it filters on (split into
+# equality filters, and range filters and functions), sorts by and projects. The proposal indexes what is
+# filtered or sorted on and, with exclude_unused (the default), excludes everything else, which also takes
+# the properties that are only projected out of the index. Composite indexes are added for ORDER BY on
+# several properties, for equality filters followed by ORDER BY, and for filters on several properties.
+#
+# Estimates - for every shape the current policy does not serve, the request charge with the proposed
+#    policy is estimated: from the documents the server retrieved per result when query metrics were
+#    recorded, otherwise from the minimum charge of a page and a small charge per result. A sample of
+#    documents gives the index terms written per document under both policies, which is what writes pay for.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# The estimates are a rough model meant to rank changes, not a quote. Replacing the policy of a collection
+# starts an index transformation on the server, queries may return incomplete results until it is done.
+# transformation_progress() reports how far it has got.
+# ----------------------------------------------------------------------------------------------------------
+
+SAMPLE_SIZE = cfg.settings['index_advisor_sample_size']
+
+# the lowest charge of a query page, and roughly what a result read through the index adds to it
+_MIN_PAGE_CHARGE = 2.3
+_CHARGE_PER_RESULT = 0.1
+
+_SYSTEM_PROPERTIES = ('_rid', '_self', '_etag', '_ts', '_attachments')
+
+_SELECT = re.compile(r'^\s*SELECT\s+(?:VALUE\s+)?(?:DISTINCT\s+)?(?:TOP\s+\S+\s+)?(.*?)\s+FROM\b', re.IGNORECASE | re.DOTALL)
+_FROM = re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE)
+_JOIN = re.compile(r'''\bJOIN\s+(\w+)\s+IN\s+(\w+)((?:\.\w+|\[\s*(?:"[^"]*"|'[^']*')\s*\])+)''', re.IGNORECASE)
+_WHERE = re.compile(r'\bWHERE\b(.*?)(?=\bORDER\s+BY\b|\bGROUP\s+BY\b|\bOFFSET\b|$)', re.IGNORECASE | re.DOTALL)
+_ORDER_BY = re.compile(r'\bORDER\s+BY\b(.*?)(?=\bOFFSET\b|$)', re.IGNORECASE | re.DOTALL)
+_PROPERTY = re.compile(r'''\b(\w+)((?:\.\w+|\[\s*(?:"[^"]*"|'[^']*')\s*\])*)''')
+_STEP = re.compile(r'''\.(\w+)|\[\s*(?:"([^"]*)"|'([^']*)')\s*\]''')
+_OPERATOR_AFTER = re.compile(r'\s*(!=|<>|<=|>=|=|<|>|\bNOT\s+IN\b|\bIN\b|\bBETWEEN\b|\bLIKE\b)', re.IGNORECASE)
+_OPERATOR_BEFORE = re.compile(r'(!=|<>|<=|>=|=|<|>)\s*$')
+_FUNCTION_BEFORE = re.compile(r'(\w+)\s*\(\s*$')
+
+
+def _steps(text):
+    return [a or b or c for a, b, c in _STEP.findall(text)]
+
+
+def _aliases(query):
+    """ { alias: path steps } of the root alias and of the JOIN aliases, which stand for array elements """
+    match = _FROM.search(query)
+    aliases = {match.group(1): []} if match else {}
+    for alias, parent, steps in _JOIN.findall(query):
+        if parent in aliases:
+            aliases[alias] = aliases[parent] + _steps(steps) + ['[]']
+    return aliases
+
+
+def _properties(text, aliases):
+    """ Yields (steps, start, end) of every property of an alias in text, and of every JOIN alias on its own """
+    for match in _PROPERTY.finditer(text):
+        steps = aliases.get(match.group(1), []) + _steps(match.group(2))
+        if match.group(1) in aliases and steps:
+            yield steps, match.start(), match.end()
+
+
+def analyse(query):
+    """ The properties a query shape filters on, sorts by and projects:
+    { 'equality': [steps], 'range': [steps], 'order_by': [(steps, descending)], 'projected': [steps] } """
+    aliases = _aliases(query)
+    result = {'equality': [], 'range': [], 'order_by': [], 'projected': []}
+
+    match = _WHERE.search(query)
+    if match:
+        where = match.group(1)
+        for steps, start, end in _properties(where, aliases):
+            function = _FUNCTION_BEFORE.search(where[:start])
+            after = _OPERATOR_AFTER.match(where[end:])
+            before = _OPERATOR_BEFORE.search(where[:start])
+            if function and function.group(1).upper() == 'ARRAY_CONTAINS':
+                kind, steps = 'equality', steps + ['[]']
+            elif function:
+                kind = 'range'
+            elif after:
+                kind = 'equality' if after.group(1).upper() in ('=', 'IN') else 'range'
+            elif before:
+                kind = 'equality' if before.group(1) == '=' else 'range'
+            else:
+                kind = 'equality'
+            if steps not in result[kind]:
+                result[kind].append(steps)
+
+    match = _ORDER_BY.search(query)
+    if match:
+        for item in match.group(1).split(','):
+            properties = list(_properties(item, aliases))
+            if properties:
+                result['order_by'].append((properties[0][0], bool(re.search(r'\bDESC\b', item, re.IGNORECASE))))
+
+    match = _SELECT.search(query)
+    if match:
+        for steps, _, _ in _properties(match.group(1), aliases):
+            if steps not in result['projected']:
+                result['projected'].append(steps)
+    return result
+
+
+def _index_path(steps):
+    return '/' + '/'.join(steps) + '/?'
+
+
+def _composite_path(steps):
+    return '/' + '/'.join(steps)
+
+
+def _composites(analysis):
+    """ The composite indexes that serve a query shape, as tuples of (steps, descending) """
+    equality = [s for s in analysis['equality'] if '[]' not in s]
+    ranges = [s for s in analysis['range'] if '[]' not in s]
+    order_by = [(s, d) for s, d in analysis['order_by'] if '[]' not in s]
+    composites = []
+    if order_by:
+        ordered = [s for s, _ in order_by]
+        columns = [(s, order_by[0][1]) for s in equality if s not in ordered] + order_by
+        if len(columns) > 1:
+            composites.append(columns)
+    elif len(equality) + min(len(ranges), 1) > 1:
+        composites.append([(s, False) for s in equality] + [(s, False) for s in ranges[:1]])
+    # an index serves its exact reverse too, so every composite is kept starting in ascending order
+    return [tuple((tuple(s), d != columns[0][1]) for s, d in columns) for columns in composites]
+
+
+def _indexed(policy, path):
+    """ Whether policy indexes the index path (eg. /address/city/?): the most specific included or excluded
+    path that matches it decides, an excluded path wins a tie """
+    if (policy.get('indexingMode') or '').lower() == 'none' or policy.get('automatic') is False:
+        return False
+    best = None
+    for patterns, included in ((policy.get('includedPaths', []), True), (policy.get('excludedPaths', []), False)):
+        for pattern in patterns:
+            pattern = pattern['path']
+            if pattern.endswith('/?'):
+                matched = pattern == path
+            elif pattern.endswith('/*'):
+                matched = path.startswith(pattern[:-1])
+            else:
+                matched = False
+            if matched and (best is None or len(pattern) > best[0] or (len(pattern) == best[0] and not included)):
+                best = (len(pattern), included)
+    # a policy that leaves the root out altogether indexes everything
+    return True if best is None and not policy.get('includedPaths') else bool(best and best[1])
+
+
+def _has_composite(policy, composite):
+    wanted = [(_composite_path(s), d) for s, d in composite]
+    reverse = [(p, not d) for p, d in wanted]
+    for index in policy.get('compositeIndexes', []):
+        existing = [(c['path'], (c.get('order') or 'ascending').lower() == 'descending') for c in index]
+        if existing in (wanted, reverse):
+            return True
+    return False
+
+
+def _terms(document, prefix=()):
+    """ Yields the steps of every value of a document, array elements under [] """
+    if isinstance(document, dict):
+        for key, value in document.items():
+            if not prefix and key in _SYSTEM_PROPERTIES:
+                continue
+            yield from _terms(value, prefix + (key,))
+    elif isinstance(document, list):
+        for value in document:
+            yield from _terms(value, prefix + ('[]',))
+    else:
+        yield prefix
+
+
+def _steps_of(document, steps):
+    value = document
+    for step in steps:
+        if not isinstance(value, dict) or step not in value:
+            return False
+        value = value[step]
+    return True
+
+
+class IndexAdvisor:
+
+    def __init__(self, client, db, coll, workload=None):
+        self.client = client
+        self.collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        self.workload = workload or query_workload
+
+    def _policy(self):
+        return execute(self.client, 'ReadContainer', self.collection_link).get('indexingPolicy') or {}
+
+    @staticmethod
+    def _served(policy, analysis, composites):
+        paths = analysis['equality'] + analysis['range'] + [s for s, _ in analysis['order_by']]
+        return all(_indexed(policy, _index_path(s)) for s in paths) and \
+            all(_has_composite(policy, c) for c in composites)
+
+    @staticmethod
+    def _estimate(totals):
+        """ The request charge of a shape once the index serves it """
+        if totals.get('retrieved'):
+            estimate = totals['request_charge'] * max(totals['measured_results'], 1) / totals['retrieved']
+        else:
+            estimate = totals['results'] * _CHARGE_PER_RESULT
+        return min(totals['request_charge'], max(estimate, totals['pages'] * _MIN_PAGE_CHARGE))
+
+    def _sample(self, sample_size):
+        documents, _ = DocumentManagement._fetch_page(self.client, self.collection_link, None,
+                                                      {'maxItemCount': sample_size})
+        return documents[:sample_size]
+
+    @staticmethod
+    def _terms_per_document(policy, documents):
+        if not documents:
+            return 0.0
+        terms = 0
+        for document in documents:
+            terms += sum(1 for steps in set(_terms(document)) if _indexed(policy, _index_path(steps)))
+            terms += sum(1 for index in policy.get('compositeIndexes', [])
+                         if all(_steps_of(document, c['path'].strip('/').split('/')) for c in index))
+        return terms / len(documents)
+
+    def propose(self, exclude_unused=True, sample_size=SAMPLE_SIZE):
+        """ Returns { 'policy', 'shapes', 'request_charge', 'terms_per_document', 'projected_only' } """
+        current = self._policy()
+        shapes = []
+        indexed = {}
+        projected = set()
+        composites = {}
+        for _, text, totals in self.workload.shapes(self.collection_link):
+            analysis = analyse(text)
+            needed = _composites(analysis)
+            for steps in analysis['equality'] + analysis['range'] + [s for s, _ in analysis['order_by']]:
+                indexed[tuple(steps)] = indexed.get(tuple(steps), 0.0) + totals['request_charge']
+            projected.update(tuple(s) for s in analysis['projected'])
+            for composite in needed:
+                composites[composite] = composites.get(composite, 0.0) + totals['request_charge']
+            served = self._served(current, analysis, needed)
+            shapes.append({'shape': text, 'executions': totals['executions'],
+                           'request_charge': totals['request_charge'],
+                           'estimated_charge': totals['request_charge'] if served else self._estimate(totals),
+                           'served_by_current_policy': served})
+
+        # the properties the workload depends on most come first
+        paths = [_index_path(s) for s in sorted(indexed, key=lambda s: (-indexed[s], s))]
+        policy = {'indexingMode': 'consistent', 'automatic': True}
+        if exclude_unused:
+            policy['includedPaths'] = [{'path': p} for p in paths]
+            policy['excludedPaths'] = [{'path': '/*'}]
+        else:
+            policy['includedPaths'] = [{'path': '/*'}]
+            policy['excludedPaths'] = [{'path': '/"_etag"/?'}]
+        policy['compositeIndexes'] = [
+            [{'path': _composite_path(s), 'order': 'descending' if d else 'ascending'} for s, d in composite]
+            for composite in sorted(composites, key=lambda c: -composites[c])]
+
+        documents = self._sample(sample_size) if sample_size else []
+        current_charge = sum(s['request_charge'] for s in shapes)
+        proposed_charge = sum(s['estimated_charge'] for s in shapes)
+        return {
+            'policy': policy,
+            'shapes': shapes,
+            'request_charge': {'current': current_charge, 'proposed': proposed_charge,
+                               'saving': current_charge - proposed_charge},
+            'terms_per_document': {'current': self._terms_per_document(current, documents),
+                                   'proposed': self._terms_per_document(policy, documents),
+                                   'sampled': len(documents)},
+            'projected_only': sorted(_index_path(list(s)) for s in projected - set(indexed))
+        }
+
+    @staticmethod
+    def print_report(proposal):
+        print('{0:>10} {1:>12} {2:>12}  {3}'.format('executions', 'RU', 'estimated', 'query shape'))
+        for shape in proposal['shapes']:
+            print('{0:>10} {1:>12.2f} {2:>12.2f}  {3}{4}'.format(
+                shape['executions'], shape['request_charge'], shape['estimated_charge'], shape['shape'],
+                '' if shape['served_by_current_policy'] else '  (not served by the current policy)'))
+        charge = proposal['request_charge']
+        print('Request charge of the recorded queries {0:.2f} RU, with the proposed policy about {1:.2f} RU '
+              '({2:.0%} less)'.format(charge['current'], charge['proposed'],
+                                      charge['saving'] / charge['current'] if charge['current'] else 0))
+        terms = proposal['terms_per_document']
+        if terms['sampled']:
+            print('Index terms written per document {0:.1f}, with the proposed policy {1:.1f} ({2} documents sampled)'
+                  .format(terms['current'], terms['proposed'], terms['sampled']))
+        if proposal['projected_only']:
+            print('Only projected, not indexed: {0}'.format(', '.join(proposal['projected_only'])))
+        policy = proposal['policy']
+        print('Included paths: {0}'.format(', '.join(p['path'] for p in policy['includedPaths'])))
+        print('Excluded paths: {0}'.format(', '.join(p['path'] for p in policy['excludedPaths'])))
+        for index in policy['compositeIndexes']:
+            print('Composite index: {0}'.format(', '.join('{0} {1}'.format(c['path'], c['order']) for c in index)))
+
+    def apply(self, policy):
+        """ Replaces the indexing policy of the collection, keeping the rest of its definition """
+        collection = execute(self.client, 'ReadContainer', self.collection_link)
+        body = {k: collection[k] for k in ('id', 'partitionKey', 'uniqueKeyPolicy', 'conflictResolutionPolicy',
+                                           'defaultTtl') if k in collection}
+        body['indexingPolicy'] = policy
+        replaced = execute(self.client, 'ReplaceContainer', self.collection_link, body)
+        print('Replaced the indexing policy of \'{0}\', the index is rebuilt in the background'.format(
+            self.collection_link))
+        return replaced
+
+    def transformation_progress(self):
+        """ The percentage of the index transformation that is done, 100 when none is running """
+        execute(self.client, 'ReadContainer', self.collection_link, {'populateQuotaInfo': True})
+        headers = self.client.last_response_headers or {}
+        return int(headers.get('x-ms-documentdb-collection-index-transformation-progress', 100))
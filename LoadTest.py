@@ -0,0 +1,248 @@
+import argparse
+import azure.cosmos.errors as errors
+import contextlib
+import io
+import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import shared.config as cfg
+from DBManagement import DatabaseManagement
+from CollectionManagement import CollectionManagement
+from BulkManagement import BulkManagement
+from DocumentManagement import DocumentManagement
+from shared.client import client_factory
+from shared.fake_client import FakeCosmosClient
+from shared.generator import SalesOrderGenerator
+from shared.metrics import metrics, percentile
+from shared.routing import partition_key_of, routing
+from shared.throttling import execute
+
+# ----------------------------------------------------------------------------------------------------------
+# Load test - replays a mix of point reads, upserts and single partition queries of synthetic sales
+# orders (shared/generator.py) against a collection at a target rate, to size its throughput before
+# production traffic reaches it
+#
+#   $ python LoadTest.py --fake --rate 200 --duration 30 --mix read=0.7,write=0.2,query=0.1
+#   $ python LoadTest.py --db pysamples --coll data --preload 100000 --skew 1.1 --size 2048 --output run.json
+#
+# Requests are started on a fixed schedule (open loop), not when the previous one returns, and their
+# latency is measured from the time they were due. A collection that cannot keep up therefore shows up
+# as growing latency rather than as a lower request rate that hides the queueing. Requests that fall more
+# than load_test_max_backlog behind are dropped and counted.
+#
+# The report has the latency percentiles and the request charge per operation, and the request units
+# per second the mix consumed - the throughput the collection needs for it.
+# ----------------------------------------------------------------------------------------------------------
+
+DATABASE_ID = 'loadtest'
+COLLECTION_ID = 'orders'
+
+QUERY = 'SELECT TOP 10 * FROM c WHERE c.account_number = @account'
+
+
+def parse_mix(text):
+    """ 'read=0.7,write=0.2,query=0.1' as {'read': 0.7, 'write': 0.2, 'query': 0.1} """
+    mix = {}
+    for part in text.split(','):
+        name, _, share = part.partition('=')
+        if name.strip() not in ('read', 'write', 'query'):
+            raise ValueError('The mix has read, write and query shares, not {0}'.format(name.strip()))
+        mix[name.strip()] = float(share)
+    if sum(mix.values()) <= 0:
+        raise ValueError('The mix needs at least one operation with a positive share')
+    return mix
+
+
+class LoadTest:
+    """ Runs one load test against one collection """
+
+    def __init__(self, client, collection_link, generator, mix, seed=None):
+        self.client = client
+        self.collection_link = collection_link
+        self.generator = generator
+        self.operations = sorted(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.definition = routing.get(client, collection_link).definition
+        self._random = random.Random(seed)
+        self._written = []
+        self._orders = iter(generator)
+        self._lock = threading.Lock()
+        self._latencies = {name: [] for name in self.operations}
+        self._charges = Counter()
+        self._errors = {name: Counter() for name in self.operations}
+        # the request charge of the operation running on each worker thread
+        self._local = threading.local()
+
+    def preload(self, count):
+        with contextlib.redirect_stdout(io.StringIO()):
+            db, coll = self.collection_link.split('/')[1], self.collection_link.split('/')[3]
+            for batch in self.generator.batches(count):
+                BulkManagement.upsert_documents(self.client, db, coll, batch)
+                self._written.extend((d['id'], partition_key_of(d, self.definition)) for d in batch)
+
+    def _options(self, partition_key):
+        return {} if self.definition is None else {'partitionKey': partition_key}
+
+    def _read(self):
+        with self._lock:
+            written = self._random.choice(self._written) if self._written else None
+        if written is None:
+            return self._write()
+        doc_id, partition_key = written
+        DocumentManagement._read_item(self.client, self.collection_link + '/docs/' + doc_id,
+                                      partition_key if self.definition else None)
+
+    def _write(self):
+        with self._lock:
+            order = next(self._orders)
+        partition_key = partition_key_of(order, self.definition)
+        execute(self.client, 'UpsertItem', self.collection_link, order, self._options(partition_key))
+        with self._lock:
+            self._written.append((order['id'], partition_key))
+
+    def _query(self):
+        with self._lock:
+            account = self.generator.account()
+        options = dict(self._options(account), enableCrossPartitionQuery=self.definition is None)
+        execute(self.client, 'QueryItems', self.collection_link,
+                {'query': QUERY, 'parameters': [{'name': '@account', 'value': account}]}, options)
+
+    def _observe(self, operation, link, status_code, request_charge, latency):
+        # shared/metrics.py is told about every request on the thread that sent it, so each worker adds up
+        # the charges of its own operation, every page and retry included
+        self._local.charge = getattr(self._local, 'charge', 0.0) + request_charge
+
+    def _call(self, name, due):
+        self._local.charge = 0.0
+        try:
+            getattr(self, '_' + name)()
+            with self._lock:
+                self._latencies[name].append(time.perf_counter() - due)
+                self._charges[name] += self._local.charge
+        except errors.HTTPFailure as e:
+            with self._lock:
+                self._errors[name][e.status_code] += 1
+        except Exception as e:
+            # connection errors and timeouts count as errors too, by their type
+            with self._lock:
+                self._errors[name][type(e).__name__] += 1
+
+    def run(self, rate, duration, workers=None, max_backlog=None):
+        workers = workers or cfg.settings['load_test_workers']
+        max_backlog = max_backlog or cfg.settings['load_test_max_backlog']
+        outstanding = threading.Semaphore(max_backlog)
+        dropped = Counter()
+        interval = 1.0 / rate
+        started = time.perf_counter()
+        due = started
+
+        metrics.add_listener(self._observe)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while due < started + duration:
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    name = self._random.choices(self.operations, self.weights)[0]
+                    if outstanding.acquire(blocking=False):
+                        future = executor.submit(self._call, name, due)
+                        future.add_done_callback(lambda _: outstanding.release())
+                    else:
+                        dropped[name] += 1
+                    due += interval
+        finally:
+            metrics.remove_listener(self._observe)
+        elapsed = time.perf_counter() - started
+        return self._report(rate, elapsed, dropped)
+
+    def _report(self, rate, elapsed, dropped):
+        operations = []
+        for name in self.operations:
+            latencies = self._latencies[name]
+            operations.append({
+                'operation': name,
+                'count': len(latencies),
+                'errors': dict(self._errors[name]),
+                'dropped': dropped[name],
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'p999_ms': percentile(latencies, 99.9) * 1000,
+                'max_ms': max(latencies or [0.0]) * 1000,
+                'request_charge_per_op': self._charges[name] / len(latencies) if latencies else 0.0
+            })
+        every = [latency for name in self.operations for latency in self._latencies[name]]
+        completed = len(every)
+        return {
+            'target_rate': rate,
+            'achieved_rate': completed / elapsed if elapsed else 0.0,
+            'seconds': elapsed,
+            'request_units_per_second': sum(self._charges.values()) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(every, 50) * 1000,
+            'p99_ms': percentile(every, 99) * 1000,
+            'operations': operations
+        }
+
+
+def print_results(results):
+    print('{0:<8} {1:>8} {2:>7} {3:>8} {4:>9} {5:>9} {6:>9} {7:>9} {8:>9} {9:>8}'.format(
+        'op', 'count', 'errors', 'dropped', 'p50 ms', 'p95 ms', 'p99 ms', 'p99.9 ms', 'max ms', 'RU/op'))
+    print(96 * '-')
+    for r in results['operations']:
+        print('{0:<8} {1:>8} {2:>7} {3:>8} {4:>9.2f} {5:>9.2f} {6:>9.2f} {7:>9.2f} {8:>9.2f} {9:>8.2f}'.format(
+            r['operation'], r['count'], sum(r['errors'].values()), r['dropped'], r['p50_ms'], r['p95_ms'],
+            r['p99_ms'], r['p999_ms'], r['max_ms'], r['request_charge_per_op']))
+    print(96 * '-')
+    print('{0:.1f} ops/s of {1:.1f} targeted over {2:.1f}s, p50 {3:.2f} ms, p99 {4:.2f} ms, {5:.1f} RU/s'.format(
+        results['achieved_rate'], results['target_rate'], results['seconds'], results['p50_ms'], results['p99_ms'],
+        results['request_units_per_second']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a mixed sales order workload at a target rate')
+    parser.add_argument('--db', default=DATABASE_ID)
+    parser.add_argument('--coll', default=COLLECTION_ID)
+    parser.add_argument('--rate', type=float, default=100, help='operations per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--mix', default='read=0.7,write=0.2,query=0.1')
+    parser.add_argument('--workers', type=int, help='concurrent requests, default load_test_workers')
+    parser.add_argument('--preload', type=int, default=1000, help='orders upserted before the test')
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of the accounts, 0 for even')
+    parser.add_argument('--items', default='1-5', help='fewest-most order lines')
+    parser.add_argument('--size', type=int, help='pad the orders to about this many bytes')
+    parser.add_argument('--v2-share', type=float, default=0.5)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--fake', action='store_true', help='run against the in-memory FakeCosmosClient')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds added to every --fake request')
+    parser.add_argument('--partitions', type=int, default=4, help='partition key ranges of the --fake collection')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    fewest, _, most = args.items.partition('-')
+    generator = SalesOrderGenerator(accounts=args.accounts, skew=args.skew, items=(int(fewest), int(most or fewest)),
+                                    document_size=args.size, v2_share=args.v2_share, seed=args.seed,
+                                    id_prefix='LoadTest{0}-'.format(int(time.time())))
+    if args.fake:
+        client = FakeCosmosClient(latency=args.latency, partition_count=args.partitions, seed=args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            DatabaseManagement.create_database(client, args.db)
+            CollectionManagement.create_Container(client, args.db, args.coll)
+    else:
+        client = client_factory.lazy()
+
+    try:
+        test = LoadTest(client, 'dbs/{0}/colls/{1}'.format(args.db, args.coll), generator, parse_mix(args.mix), args.seed)
+        test.preload(args.preload)
+        results = test.run(args.rate, args.duration, args.workers)
+    finally:
+        client_factory.close()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
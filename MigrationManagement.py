@@ -0,0 +1,294 @@
+import azure.cosmos.errors as errors
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import shared.config as cfg
+from BulkManagement import BulkManagement
+from DocumentManagement import DocumentManagement
+from shared.checkpoint import checkpoint_store
+from shared.routing import routing
+from shared.throttling import request_charge, set_rate_limit
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - copies the documents of one collection to another, on the same or on another account, eg. to
+# move them to a collection with a different partition key or indexing policy
+#
+#   CollectionManagement.create_Container(client, 'pysamples', 'orders-by-po',
+#                                         {'id': 'orders-by-po', 'partitionKey': {'paths': ['/purchase_order_number'], 'kind': 'Hash'}})
+#   MigrationManagement.copy(client, 'pysamples', 'data', 'pysamples', 'orders-by-po',
+#                            transform=MigrationManagement.sales_order_v2,
+#                            source_ru_per_second=2000, target_ru_per_second=5000)
+#
+# Readers - every partition key range of the source is read by its own task, up to max_workers at once,
+#    and the next page of a range is requested while the current one is being written.
+#
+# Transform - transform(document) is called for every source document, without its system properties.
+#    It returns the document to write, a list of documents, or None to leave the document out.
+#
+# Writer - the documents of a page are upserted to the target grouped by the target's partition key
+#    ranges, up to max_in_flight groups at once over all the readers (BulkManagement). Throttled writes are
+#    retried, writes that still fail are counted and listed in the summary.
+#
+# Budgets - source_ru_per_second and target_ru_per_second pace the reads and the writes separately
+#    (shared/throttling.py), eg. to leave most of a production source's throughput to the application.
+#
+# Progress - once every document of a page has been written, the continuation of its range is saved to the
+#    checkpoint store with the documents counted up to it. A copy that was interrupted is resumed by running
+#    it again: every range carries on after its last saved page. A range that split in the meantime carries
+#    on in its children. Once a write of a range failed its position is no longer saved, so running the copy
+#    again retries the failed documents, and the copy is only marked complete when every write succeeded.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# Writes are upserts, so the pages that were written but not yet saved when a copy stopped are simply
+# written again when it resumes. That needs a transform that returns the same documents every time it
+# sees the same input. The copy is not a point in time snapshot, documents changed in the source while
+# it runs may or may not be copied. Create the target collection before the copy (CollectionManagement or
+# ProvisioningManagement).
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_WORKERS = cfg.settings['migration_max_workers']
+MAX_IN_FLIGHT = cfg.settings['migration_max_in_flight']
+GROUP_SIZE = cfg.settings['bulk_group_size']
+PAGE_SIZE = cfg.settings['page_size']
+CHECKPOINTS = cfg.settings['migration_checkpoints']
+
+_SYSTEM_PROPERTIES = ('_rid', '_self', '_etag', '_ts', '_attachments', '_lsn')
+
+# failed writes listed in the summary, the rest are only counted
+_MAX_FAILURES_LISTED = 100
+
+
+class MigrationManagement:
+
+    @staticmethod
+    def sales_order_v2(document, products=None):
+        """ Reshapes a V1 sales order (DocumentManagement.GetSalesOrder) as a V2 one (GetSalesOrderV2): the
+        order lines carry the product's code and name instead of its id, and the order gets the V2 fields.
+        products maps product ids to {'product_code', 'product_name'}. Other documents are left as they are. """
+        items = document.get('items')
+        if not isinstance(items, list) or not any(isinstance(i, dict) and 'product_id' in i for i in items):
+            return document
+        order = dict(document)
+        order.setdefault('due_date', None)
+        order.setdefault('shipped_date', None)
+        order.setdefault('discount_amt', 0.0)
+        order['items'] = []
+        for item in items:
+            if not isinstance(item, dict) or 'product_id' not in item:
+                order['items'].append(item)
+                continue
+            line = dict(item)
+            product_id = line.pop('product_id')
+            product = (products or {}).get(product_id) or {}
+            line['product_code'] = product.get('product_code', str(product_id))
+            line['product_name'] = product.get('product_name', 'Product {0}'.format(product_id))
+            line.setdefault('currency_symbol', '$')
+            line.setdefault('currecny_code', 'USD')
+            order['items'].append(line)
+        # the order of the properties of GetSalesOrderV2
+        first = ('id', 'account_number', 'purchase_order_number', 'order_date', 'due_date', 'shipped_date',
+                 'subtotal', 'tax_amount', 'freight', 'discount_amt', 'total_due', 'items')
+        reshaped = {k: order[k] for k in first if k in order}
+        reshaped.update((k, v) for k, v in order.items() if k not in first)
+        return reshaped
+
+    @staticmethod
+    def _transformed(documents, transform):
+        """ Returns the documents to write and the number of source documents the transform left out """
+        results = []
+        skipped = 0
+        for document in documents:
+            document = {k: v for k, v in document.items() if k not in _SYSTEM_PROPERTIES}
+            result = transform(document) if transform else document
+            if result is None:
+                skipped += 1
+                continue
+            results.extend(result if isinstance(result, list) else [result])
+        return results, skipped
+
+    @staticmethod
+    def _write(writer, target_client, target_link, target_map, documents, group_size):
+        """ Upserts documents grouped by the target's partition key ranges, returns the results of every write """
+        path = BulkManagement._partition_key_path(target_map)
+        groups = OrderedDict()
+        invalid = []
+        for index, document in enumerate(documents):
+            try:
+                operation = BulkManagement._operation(path, index, ('upsert', document))
+            except ValueError as e:
+                # eg. a transform that returned something other than a document
+                invalid.append((index, 'upsert', None, None, 0.0, str(e)))
+                continue
+            key = None
+            if path is not None and not isinstance(operation[3], (dict, list)):
+                key = target_map.range_for(operation[3])['id']
+            groups.setdefault(key, []).append(operation)
+        futures = [writer.submit(BulkManagement._apply_group, target_client, target_link, path,
+                                 group[start:start + group_size])
+                   for group in groups.values() for start in range(0, len(group), group_size)]
+        return invalid + [result for future in futures for result in future.result()]
+
+    @staticmethod
+    def _copy_range(job, range_id, continuation):
+        """ Copies one source range from continuation on, and its children when it splits while it is read """
+        def fetch(page_continuation):
+            options = {'maxItemCount': job['page_size']}
+            if page_continuation:
+                options['continuation'] = page_continuation
+            return DocumentManagement._fetch_page(job['source_client'], job['source_link'], None, options, range_id)
+
+        page = job['readers'].submit(fetch, continuation)
+        while page is not None:
+            try:
+                documents, headers = page.result()
+            except errors.HTTPFailure as e:
+                if e.status_code != 410:
+                    raise
+                # the range has split, its children carry on from the last page written
+                children = [r['id'] for r in routing.children(job['source_client'], job['source_link'], range_id)]
+                job['split'](range_id, children, continuation)
+                for child in children:
+                    MigrationManagement._copy_range(job, child, continuation)
+                return
+            next_continuation = headers.get('x-ms-continuation')
+            # the next page is read while this one is written
+            page = job['readers'].submit(fetch, next_continuation) if next_continuation else None
+
+            written, skipped = MigrationManagement._transformed(documents, job['transform'])
+            results = MigrationManagement._write(job['writer'], job['target_client'], job['target_link'],
+                                                 job['target_map'], written, job['group_size'])
+            job['page_done'](range_id, next_continuation, len(documents), skipped, request_charge(headers), results)
+            continuation = next_continuation
+
+    @staticmethod
+    def _positions(source_client, source_link, range_ids, saved):
+        """ Where every current range of the source carries on. Ranges saved before they split hand their
+        position to their children. """
+        if saved is None:
+            return {r: None for r in range_ids}
+        positions = {r: c for r, c in saved.items() if r in range_ids}
+        for range_id, continuation in saved.items():
+            if range_id not in range_ids:
+                for child in routing.children(source_client, source_link, range_id):
+                    positions.setdefault(child['id'], continuation)
+        for range_id in range_ids:
+            if range_id not in positions:
+                raise ValueError('The copy cannot be resumed, partition key range {0} of the source is neither '
+                                 'in the checkpoint nor the child of a range that is'.format(range_id))
+        return positions
+
+    @staticmethod
+    def copy(source_client, source_db, source_coll, target_db, target_coll, target_client=None, transform=None,
+             source_ru_per_second=None, target_ru_per_second=None, job_id=None, store=None, max_workers=MAX_WORKERS,
+             max_in_flight=MAX_IN_FLIGHT, page_size=PAGE_SIZE, group_size=GROUP_SIZE):
+        """ Copies every document of the source collection to the target collection, see the header of this
+        file. target_client defaults to source_client, a copy within one account. Returns a summary with the
+        documents read, written, left out by the transform and failed, and the request charge of each side. """
+        target_client = target_client or source_client
+        source_link = 'dbs/' + source_db + '/colls/{0}'.format(source_coll)
+        target_link = 'dbs/' + target_db + '/colls/{0}'.format(target_coll)
+        if target_client is source_client and source_link == target_link:
+            raise ValueError('The source and the target of a copy are the same collection')
+        job_id = job_id or 'copy:{0}->{1}'.format(source_link, target_link)
+        store = store or checkpoint_store(CHECKPOINTS)
+        started = time.perf_counter()
+
+        saved = store.load(job_id).get('progress')
+        progress = json.loads(saved) if saved else None
+        if progress is not None and progress.get('complete'):
+            print('The copy \'{0}\' has already completed'.format(job_id))
+            return dict(progress['summary'], source_request_charge=0.0, target_request_charge=0.0, elapsed=0.0)
+
+        range_ids = [r['id'] for r in routing.get(source_client, source_link).ranges]
+        positions = MigrationManagement._positions(source_client, source_link, range_ids,
+                                                   progress['ranges'] if progress else None)
+        # range id: [read, written, skipped] up to the page its position was saved at, and up to the last
+        # page done. A resumed range reads the pages after its saved position again, so it counts on from its
+        # saved figures. A range that split keeps its figures and its children count from 0.
+        saved_counts = progress.get('counts', {}) if progress else {}
+        counts = {r: list(counted) for r, counted in saved_counts.items()}
+        summary = {'read': sum(c[0] for c in counts.values()), 'written': sum(c[1] for c in counts.values()),
+                   'skipped': sum(c[2] for c in counts.values()), 'failed': 0, 'failures': []}
+        if progress is not None:
+            # the pages with failed writes are read again and retried
+            print('Resuming the copy \'{0}\' after {1} documents'.format(job_id, summary['read']))
+        charges = {'source': 0.0, 'target': 0.0}
+        # ranges with a failed write, their positions stay at the page before it
+        held = set()
+        lock = threading.Lock()
+
+        def commit(complete=False):
+            store.save(job_id, 'progress', json.dumps({'ranges': positions, 'counts': saved_counts, 'summary': summary,
+                                                       'complete': complete}))
+
+        def split(range_id, children, continuation):
+            with lock:
+                saved_position = positions.pop(range_id, continuation)
+                for child in children:
+                    positions[child] = saved_position if range_id in held else continuation
+                    if range_id in held:
+                        held.add(child)
+                commit()
+
+        def page_done(range_id, continuation, read, skipped, charge, results):
+            with lock:
+                counted = counts.setdefault(range_id, [0, 0, 0])
+                counted[0] += read
+                counted[2] += skipped
+                summary['read'] += read
+                summary['skipped'] += skipped
+                charges['source'] += charge
+                for index, operation, doc_id, status_code, write_charge, error in results:
+                    charges['target'] += write_charge
+                    if error is None:
+                        counted[1] += 1
+                        summary['written'] += 1
+                    else:
+                        summary['failed'] += 1
+                        held.add(range_id)
+                        if len(summary['failures']) < _MAX_FAILURES_LISTED:
+                            summary['failures'].append({'id': doc_id, 'status_code': status_code,
+                                                        'error': error.splitlines()[0] if error else ''})
+                if range_id not in held:
+                    positions[range_id] = continuation or ''
+                    saved_counts[range_id] = list(counted)
+                commit()
+
+        set_rate_limit(source_link, source_ru_per_second, source_client)
+        set_rate_limit(target_link, target_ru_per_second, target_client)
+        try:
+            job = {
+                'source_client': source_client, 'source_link': source_link,
+                'target_client': target_client, 'target_link': target_link,
+                'target_map': routing.get(target_client, target_link),
+                'transform': transform, 'page_size': page_size, 'group_size': group_size,
+                'split': split, 'page_done': page_done
+            }
+            remaining = [r for r in sorted(positions) if positions[r] != '']
+            with ThreadPoolExecutor(max_workers=max_workers) as ranges, \
+                    ThreadPoolExecutor(max_workers=max_workers) as readers, \
+                    ThreadPoolExecutor(max_workers=max_in_flight) as writer:
+                job.update(readers=readers, writer=writer)
+                copies = [ranges.submit(MigrationManagement._copy_range, job, r, positions[r]) for r in remaining]
+                wait(copies)
+                for copied in copies:
+                    copied.result()
+        finally:
+            set_rate_limit(source_link, None, source_client)
+            set_rate_limit(target_link, None, target_client)
+
+        with lock:
+            commit(complete=not summary['failed'])
+        elapsed = time.perf_counter() - started
+        print('Copied {0} documents to \'{1}\': {2} written, {3} left out, {4} failed in {5:.1f}s, request charge '
+              '{6:.2f} RU read and {7:.2f} RU written'.format(summary['read'], target_link, summary['written'],
+                                                              summary['skipped'], summary['failed'], elapsed,
+                                                              charges['source'], charges['target']))
+        if summary['failed']:
+            print('The copy \'{0}\' is not complete, run it again to retry the failed writes'.format(job_id))
+        return dict(summary, source_request_charge=charges['source'], target_request_charge=charges['target'],
+                    elapsed=elapsed)
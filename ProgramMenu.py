@@ -1,11 +1,13 @@
-import azure.cosmos.documents as documents
-import azure.cosmos.cosmos_client as cosmos_client
 import azure.cosmos.errors as errors
 
 import shared.config as cfg
 from DBManagement import DatabaseManagement
 from CollectionManagement import CollectionManagement
 from DocumentManagement import DocumentManagement
+from BulkManagement import BulkManagement
+from shared.cache import document_cache
+from shared.client import client_factory
+from shared.metrics import metrics
 
 # Create a custom menu for CosmosDB management 
 # Database CRUD operations
@@ -41,8 +43,9 @@ class IDisposable:
         return self.obj # bound to target
 
     def __exit__(self, exception_type, exception_val, trace):
-        # extra cleanup in here
-        self = None
+        # closes the pooled connections of the client
+        if hasattr(self.obj, 'close'):
+            self.obj.close()
     
 def print_menu():
         print(30 * "-" , "MENU" , 30 * "-")
@@ -58,19 +61,28 @@ def print_menu():
         print("10. Read all documents in a collection")
         print("11. Delete database by id")
         print("12. Delete collection by id")
+        print("13. Import documents from a JSON Lines or CSV file")
+        print("14. Show request unit and latency statistics")
 
-        print("13. Exit")
+        print("15. Exit")
         print(67 * "-")
 
 
 def run_sample():     
-        with IDisposable(cosmos_client.CosmosClient(HOST, {'masterKey': MASTER_KEY} )) as client:
+        with IDisposable(client_factory) as factory:
             try:         
+                # the client is created in the background while the menu is read, or on its first use
+                client = factory.lazy()
+                if cfg.settings['warm_up']:
+                    factory.warm_up(cfg.settings['warm_up_collections'])
+                else:
+                    factory.prefetch()
+
                 loop=True      
     
                 while loop:          ## While loop which will keep going until loop = False
                     print_menu()    ## Displays menu
-                    choice = int(input("Enter your choice [1-13]: "))
+                    choice = int(input("Enter your choice [1-15]: "))
                     
                     if choice == 1:     
                         print("Menu 1 has been selected")
@@ -141,8 +153,13 @@ def run_sample():
                         print("Menu 9 has been selected")
                         db_name = str(input("Please provide the database name: "))
                         coll_name = str(input("Please provide a collection name: "))
+                        doc_ids = str(input("Please provide one or more document ids separated by commas [SalesOrder1]: "))
+                        doc_ids = [doc_id.strip() for doc_id in doc_ids.split(',') if doc_id.strip()] or ['SalesOrder1']
                         if (len(db_name) != 0 and len(coll_name) != 0):
-                            DocumentManagement.ReadDocument(client, db_name, coll_name, 'SalesOrder1')
+                            if len(doc_ids) == 1:
+                                DocumentManagement.ReadDocument(client, db_name, coll_name, doc_ids[0])
+                            else:
+                                DocumentManagement.ReadDocumentsById(client, db_name, coll_name, doc_ids)
                         else:
                              print("Invalid database or collection name provided")
                     elif choice == 10:
@@ -169,7 +186,27 @@ def run_sample():
 
                          
                     elif choice == 13:
-                        print("Menu 13 has been selected, exiting...")
+                        print("Menu 13 has been selected")
+                        db_name = str(input("Please provide the database name: "))
+                        coll_name = str(input("Please provide a collection name: "))
+                        path = str(input("Please provide the path of a .jsonl or .csv file: "))
+                        if (len(db_name) != 0 and len(coll_name) != 0 and len(path) != 0):
+                            BulkManagement.import_file(client, db_name, coll_name, path)
+                        else:
+                             print("Invalid database, collection or file name provided")
+
+                    elif choice == 14:
+                        print("Menu 14 has been selected")
+                        print(metrics.to_json())
+                        if document_cache.enabled:
+                            print("Document cache: {0}".format(document_cache.stats()))
+                        path = str(input("Export to a file (.prom for Prometheus, anything else for JSON), empty to skip: "))
+                        if path:
+                            metrics.write(path)
+                            print("Statistics written to \'{0}\'".format(path))
+
+                    elif choice == 15:
+                        print("Menu 15 has been selected, exiting...")
                         ## You can add your code or functions here
                         loop = False # This will make the while loop to end as not value of loop is set to False
                         
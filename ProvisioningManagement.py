@@ -0,0 +1,266 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import azure.cosmos.errors as errors
+
+import shared.config as cfg
+from CollectionManagement import CollectionManagement
+from shared.cache import document_cache, metadata_cache
+from shared.throttling import execute
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - provisions databases and collections from a declarative spec
+#
+#   {
+#     "databases": [
+#       { "id": "testenv",
+#         "containers": [
+#           { "id": "orders", "partitionKey": { "paths": ["/account_number"], "kind": "Hash" },
+#             "offerThroughput": 1000, "defaultTtl": 86400,
+#             "indexingPolicy": { "indexingMode": "consistent", "automatic": true,
+#                                 "excludedPaths": [{ "path": "/items/*" }] } },
+#           { "id": "customers" }
+#         ] }
+#     ]
+#   }
+#
+#   spec = ProvisioningManagement.load_spec('testenv.json')
+#   ProvisioningManagement.provision(client, spec)             # creates or updates what differs
+#   ProvisioningManagement.provision(client, spec, dry_run=True)
+#   ProvisioningManagement.teardown(client, spec)
+#
+# The spec is compared with one ReadDatabases listing and one ReadContainers listing per database, and the
+# offers of the existing collections are read with a single QueryOffers. Only the differences are applied:
+#
+#   create_database, create_container      - missing databases and collections
+#   replace_container                      - an indexing policy or defaultTtl that differs from the spec
+#   replace_offer                          - an offerThroughput that differs from the spec
+#   delete_container                       - with prune=True, collections of the spec's databases it does not list
+#
+# The changes run in phases (databases, then collections, then deletes), and the changes of one phase run
+# concurrently, at most max_concurrency at once. Only the properties a spec gives are compared, so the
+# defaults the service fills in do not count as differences. The lists of an indexing policy have to match
+# exactly though (paths in any order), so a path removed from the spec is removed from the collection.
+#
+# teardown deletes the collections of the spec, and every database of the spec that is empty afterwards.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# The partition key and the unique keys of a collection cannot be changed once it exists. A spec that
+# changes them is rejected before anything is applied.
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_CONCURRENCY = cfg.settings['provisioning_max_concurrency']
+
+# properties of a collection definition the spec may set, besides its id and offerThroughput
+_REPLACEABLE = ('indexingPolicy', 'defaultTtl')
+_IMMUTABLE = ('partitionKey', 'uniqueKeyPolicy')
+
+_PHASES = ('create_database', 'create_container', 'replace_container', 'replace_offer', 'delete_container',
+           'delete_database')
+
+
+# lists whose items can come in any order
+_UNORDERED = ('includedPaths', 'excludedPaths', 'compositeIndexes', 'spatialIndexes', 'uniqueKeys')
+
+# the service adds this path to the excludedPaths of every indexing policy
+_SYSTEM_PATHS = ('/"_etag"/?',)
+
+
+def _matches(expected, actual, key=None):
+    """ True when actual is what expected gives. Properties of an object that expected leaves out are not
+    compared, lists have to hold the same items (in any order for the lists of _UNORDERED) and strings are
+    compared as they are. """
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(k in actual and _matches(v, actual[k], k) for k, v in expected.items())
+    if isinstance(expected, list):
+        if not isinstance(actual, list):
+            return False
+        if key == 'excludedPaths':
+            actual = [a for a in actual if not (isinstance(a, dict) and a.get('path') in _SYSTEM_PATHS)]
+        if len(expected) != len(actual):
+            return False
+        if key not in _UNORDERED:
+            return all(_matches(e, a) for e, a in zip(expected, actual))
+        remaining = list(actual)
+        for e in expected:
+            match = next((i for i, a in enumerate(remaining) if _matches(e, a)), None)
+            if match is None:
+                return False
+            del remaining[match]
+        return True
+    return expected == actual
+
+
+class ProvisioningManagement:
+
+    @staticmethod
+    def load_spec(path):
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+        for database in spec.get('databases', []):
+            if not database.get('id'):
+                raise ValueError('Every database of the spec needs an id')
+            for container in database.get('containers', []):
+                if not container.get('id'):
+                    raise ValueError('Every container of database \'{0}\' needs an id'.format(database['id']))
+        return spec
+
+    @staticmethod
+    def _list_containers(client, database_id):
+        return execute(client, 'ReadContainers', 'dbs/' + database_id)
+
+    @staticmethod
+    def _action(action, link, body=None, detail=''):
+        return {'action': action, 'link': link, 'body': body, 'detail': detail}
+
+    @staticmethod
+    def plan(client, spec, prune=False, max_concurrency=MAX_CONCURRENCY):
+        """ Returns the changes that bring the account in line with spec """
+        databases = set(d['id'] for d in execute(client, 'ReadDatabases'))
+        existing = [d['id'] for d in spec.get('databases', []) if d['id'] in databases]
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            listings = dict(zip(existing, executor.map(
+                lambda database_id: ProvisioningManagement._list_containers(client, database_id), existing)))
+
+        actions = []
+        conflicts = []
+        throughputs = []
+        for database in spec.get('databases', []):
+            db_link = 'dbs/' + database['id']
+            if database['id'] not in databases:
+                actions.append(ProvisioningManagement._action('create_database', db_link, {'id': database['id']}))
+            collections = {c['id']: c for c in listings.get(database['id'], [])}
+
+            for container in database.get('containers', []):
+                link = db_link + '/colls/' + container['id']
+                definition = {k: v for k, v in container.items() if k != 'offerThroughput'}
+                collection = collections.get(container['id'])
+                if collection is None:
+                    actions.append(ProvisioningManagement._action('create_container', link, definition,
+                                                                  container.get('offerThroughput') or ''))
+                    continue
+
+                for key in _IMMUTABLE:
+                    if key in container and not _matches(container[key], collection.get(key)):
+                        conflicts.append('{0}: {1} cannot be changed'.format(link, key))
+                changed = [key for key in _REPLACEABLE if key in container and not _matches(container[key], collection.get(key))]
+                if changed:
+                    body = {k: collection[k] for k in ('id', 'partitionKey', 'uniqueKeyPolicy', 'conflictResolutionPolicy',
+                                                       'indexingPolicy', 'defaultTtl') if k in collection}
+                    body.update((key, container[key]) for key in changed)
+                    actions.append(ProvisioningManagement._action('replace_container', link, body, ', '.join(changed)))
+                if container.get('offerThroughput'):
+                    throughputs.append((link, collection, container['offerThroughput']))
+
+            if prune:
+                listed = set(c['id'] for c in database.get('containers', []))
+                for collection_id in collections:
+                    if collection_id not in listed:
+                        actions.append(ProvisioningManagement._action('delete_container', db_link + '/colls/' + collection_id))
+
+        if conflicts:
+            raise ValueError('The spec cannot be applied:\n' + '\n'.join(conflicts))
+
+        # the offers of all existing collections with a throughput in the spec, in one query
+        offers = CollectionManagement.read_offers(client, [collection for _, collection, _ in throughputs])
+        for link, collection, throughput in throughputs:
+            offer = offers.get(collection['_self'])
+            if offer is not None and offer['content']['offerThroughput'] != throughput:
+                offer['content']['offerThroughput'] = throughput
+                actions.append(ProvisioningManagement._action('replace_offer', link, offer, throughput))
+        return actions
+
+    @staticmethod
+    def _apply(client, action):
+        started = time.perf_counter()
+        name, link, body = action['action'], action['link'], action['body']
+        try:
+            if name == 'create_database':
+                execute(client, 'CreateDatabase', body)
+                metadata_cache.invalidate(link)
+            elif name == 'create_container':
+                options = {'offerThroughput': action['detail']} if action['detail'] else {}
+                execute(client, 'CreateContainer', '/'.join(link.split('/')[:2]), body, options)
+                metadata_cache.invalidate(link)
+            elif name == 'replace_container':
+                execute(client, 'ReplaceContainer', link, body)
+            elif name == 'replace_offer':
+                execute(client, 'ReplaceOffer', body['_self'], body)
+            elif name == 'delete_container':
+                execute(client, 'DeleteContainer', link)
+                metadata_cache.invalidate(link)
+                document_cache.invalidate(link)
+            elif name == 'delete_database':
+                execute(client, 'DeleteDatabase', link)
+                metadata_cache.invalidate(link)
+                document_cache.invalidate(link)
+            error = None
+        except errors.HTTPFailure as e:
+            error = '{0}: {1}'.format(e.status_code, str(e).splitlines()[0] if str(e) else '')
+        return dict(action, body=None, ok=error is None, error=error, elapsed=time.perf_counter() - started)
+
+    @staticmethod
+    def apply(client, actions, max_concurrency=MAX_CONCURRENCY):
+        """ Applies the actions phase by phase, the actions of a phase concurrently. Returns their results. """
+        results = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for phase in _PHASES:
+                batch = [a for a in actions if a['action'] == phase]
+                for result in executor.map(lambda action: ProvisioningManagement._apply(client, action), batch):
+                    print('{0:<18} {1:<48} {2}{3}'.format(
+                        result['action'], result['link'], 'ok' if result['ok'] else 'FAILED - ' + result['error'],
+                        ' ({0})'.format(result['detail']) if result['detail'] else ''))
+                    results.append(result)
+        return results
+
+    @staticmethod
+    def _summary(actions, results, started, dry_run=False):
+        summary = {
+            'actions': len(actions),
+            'succeeded': sum(1 for r in results if r['ok']),
+            'failed': [r for r in results if not r['ok']],
+            'plan': [dict(a, body=None) for a in actions] if dry_run else None,
+            'elapsed': time.perf_counter() - started
+        }
+        print('{0} changes, {1} applied, {2} failed in {3:.2f}s'.format(
+            summary['actions'], summary['succeeded'], len(summary['failed']), summary['elapsed']))
+        return summary
+
+    @staticmethod
+    def provision(client, spec, prune=False, dry_run=False, max_concurrency=MAX_CONCURRENCY):
+        started = time.perf_counter()
+        actions = ProvisioningManagement.plan(client, spec, prune, max_concurrency)
+        if dry_run:
+            for action in actions:
+                print('{0:<18} {1:<48} {2}'.format(action['action'], action['link'], action['detail']))
+            return ProvisioningManagement._summary(actions, [], started, dry_run=True)
+        return ProvisioningManagement._summary(actions, ProvisioningManagement.apply(client, actions, max_concurrency),
+                                               started)
+
+    @staticmethod
+    def teardown(client, spec, dry_run=False, max_concurrency=MAX_CONCURRENCY):
+        """ Deletes the collections of spec, and the databases of spec left without collections """
+        started = time.perf_counter()
+        databases = set(d['id'] for d in execute(client, 'ReadDatabases'))
+        existing = [d for d in spec.get('databases', []) if d['id'] in databases]
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            listings = list(executor.map(lambda d: ProvisioningManagement._list_containers(client, d['id']), existing))
+
+        actions = []
+        for database, listing in zip(existing, listings):
+            db_link = 'dbs/' + database['id']
+            listed = set(c['id'] for c in database.get('containers', []))
+            collections = set(c['id'] for c in listing)
+            for collection_id in sorted(collections & listed):
+                actions.append(ProvisioningManagement._action('delete_container', db_link + '/colls/' + collection_id))
+            if not collections - listed:
+                actions.append(ProvisioningManagement._action('delete_database', db_link))
+
+        if dry_run:
+            for action in actions:
+                print('{0:<18} {1}'.format(action['action'], action['link']))
+            return ProvisioningManagement._summary(actions, [], started, dry_run=True)
+        return ProvisioningManagement._summary(actions, ProvisioningManagement.apply(client, actions, max_concurrency),
+                                               started)
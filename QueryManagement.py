@@ -0,0 +1,294 @@
+import functools
+import heapq
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import azure.cosmos.errors as errors
+
+import shared.config as cfg
+from DocumentManagement import DocumentManagement
+from shared.columnar import MISSING, ColumnarResult
+from shared.ordering import order_key
+from shared.routing import routing
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - demonstrates parallel SQL queries over the documents of a partitioned collection
+#
+# Query documents with parameterized SQL (query_documents)
+#
+#   for order in QueryManagement.query_documents(client, 'pysamples', 'data',
+#           'SELECT * FROM c WHERE c.total_due > @min ORDER BY c.order_date DESC OFFSET 0 LIMIT 100',
+#           [{'name': '@min', 'value': 1000}], max_degree_of_parallelism=8):
+#       print(order['id'])
+#
+# The query is sent to every partition key range on a thread pool, at most max_degree_of_parallelism
+# requests run at once and each range reads one page ahead. Results are streamed as the pages arrive:
+#
+#   ORDER BY       - every range returns its results sorted, they are merged with a k-way merge
+#   TOP n          - every range returns at most n results, the merged stream stops after n
+#   OFFSET x LIMIT y - every range is asked for OFFSET 0 LIMIT x + y, the merged stream skips x and takes y
+#
+# Keep selected fields of the results in compact columns instead of a dictionary per result (query_columns)
+#
+#   totals = QueryManagement.query_columns(client, 'pysamples', 'data', 'SELECT * FROM c WHERE c.total_due > 100',
+#                                          ['account_number', 'total_due']).group_sum('account_number', 'total_due')
+#
+# The partition key ranges come from the routing map of shared/routing.py. A range that splits while the
+# query runs answers 410 Gone, the map is refreshed and the range's children continue in its place.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# The ORDER BY properties have to be part of the results (SELECT * or listed in the projection), because
+# the results of the ranges are merged by those values, so SELECT VALUE cannot be combined with ORDER BY.
+# Aggregates and GROUP BY cannot be merged by concatenating rows (see AggregationManagement.py), and DISTINCT
+# would only remove the duplicates within each range, these are rejected here.
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_DEGREE_OF_PARALLELISM = cfg.settings['query_max_degree_of_parallelism']
+PAGE_SIZE = cfg.settings['page_size']
+
+_TOP = re.compile(r'^\s*SELECT\s+(?:VALUE\s+)?TOP\s+(\d+|@\w+)', re.IGNORECASE)
+_OFFSET_LIMIT = re.compile(r'\s+OFFSET\s+(\d+|@\w+)\s+LIMIT\s+(\d+|@\w+)\s*$', re.IGNORECASE)
+_ORDER_BY = re.compile(r'\s+ORDER\s+BY\s+(.+?)\s*$', re.IGNORECASE | re.DOTALL)
+_FROM_ALIAS = re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE)
+_AGGREGATE = re.compile(r'\b(COUNT|SUM|AVG|MIN|MAX)\s*\(|\bGROUP\s+BY\b', re.IGNORECASE)
+_DISTINCT = re.compile(r'^\s*SELECT(?:\s+VALUE|\s+TOP\s+(?:\d+|@\w+))*\s+DISTINCT\b', re.IGNORECASE)
+_VALUE = re.compile(r'^\s*SELECT(?:\s+DISTINCT|\s+TOP\s+(?:\d+|@\w+))*\s+VALUE\b', re.IGNORECASE)
+
+
+class QueryPlan:
+    """ How the results of the partition key ranges are combined, worked out from the query text """
+
+    def __init__(self, query, parameters):
+        values = {p['name']: p['value'] for p in parameters}
+
+        def number(token):
+            return int(values[token]) if token.startswith('@') else int(token)
+
+        if _AGGREGATE.search(query):
+            raise ValueError('Aggregates and GROUP BY are not supported by the parallel query executor')
+        if _DISTINCT.search(query):
+            raise ValueError('DISTINCT is not supported by the parallel query executor, the duplicates of '
+                             'different partition key ranges would be kept')
+
+        self.top = None
+        match = _TOP.search(query)
+        if match:
+            self.top = number(match.group(1))
+
+        self.offset = 0
+        self.limit = None
+        match = _OFFSET_LIMIT.search(query)
+        if match:
+            self.offset, self.limit = number(match.group(1)), number(match.group(2))
+            # every range has to return enough rows for the offset to be applied after the merge
+            query = query[:match.start()] + ' OFFSET 0 LIMIT {0}'.format(self.offset + self.limit)
+
+        self.order_by = []
+        match = _ORDER_BY.search(_OFFSET_LIMIT.sub('', query))
+        if match:
+            alias = _FROM_ALIAS.search(query).group(1)
+            for item in match.group(1).split(','):
+                words = item.split()
+                path = words[0]
+                if path.startswith(alias + '.'):
+                    path = path[len(alias) + 1:]
+                self.order_by.append((path.split('.'), len(words) > 1 and words[1].upper() == 'DESC'))
+            if _VALUE.search(query):
+                raise ValueError('SELECT VALUE cannot be merged by ORDER BY, select the ORDER BY properties instead')
+
+        self.query = {'query': query, 'parameters': parameters}
+
+    def compare(self, a, b):
+        for path, descending in self.order_by:
+            ka, kb = order_key(_resolve(a, path)), order_key(_resolve(b, path))
+            if ka != kb:
+                result = -1 if ka < kb else 1
+                return -result if descending else result
+        return 0
+
+
+def _resolve(document, path):
+    value = document
+    for step in path:
+        if not isinstance(value, dict) or step not in value:
+            raise ValueError('ORDER BY property \'{0}\' is not part of the query results'.format('.'.join(path)))
+        value = value[step]
+    return value
+
+
+def _steps(field):
+    """ The steps of a dotted path, a step of digits is an index into an array """
+    return [int(step) if step.isdecimal() else step for step in field.split('.')]
+
+
+def _field(document, path):
+    value = document
+    for step in path:
+        if isinstance(value, dict) and isinstance(step, str) and step in value:
+            value = value[step]
+        elif isinstance(value, list) and isinstance(step, int) and step < len(value):
+            value = value[step]
+        else:
+            return MISSING
+    return value
+
+
+class QueryManagement:
+
+    @staticmethod
+    def read_partition_key_ranges(client, collection_link):
+        # cached by shared/routing.py until a range splits
+        return routing.get(client, collection_link).ranges
+
+    @staticmethod
+    def _fetch(client, collection_link, query, range_id, continuation, page_size):
+        options = {'maxItemCount': page_size}
+        if continuation:
+            options['continuation'] = continuation
+        documents, headers = DocumentManagement._fetch_page(client, collection_link, query, options, range_id)
+        return documents, headers.get('x-ms-continuation')
+
+    @staticmethod
+    def _children(client, collection_link, range_id):
+        return [r['id'] for r in routing.children(client, collection_link, range_id)]
+
+    @staticmethod
+    def _unordered(executor, fetch, range_ids, children):
+        futures = {executor.submit(fetch, range_id, None): (range_id, None) for range_id in range_ids}
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    range_id, continuation = futures.pop(future)
+                    try:
+                        documents, next_continuation = future.result()
+                    except errors.HTTPFailure as e:
+                        if e.status_code != 410:
+                            raise
+                        # the range has split, its children carry on from where it stopped
+                        for child in children(range_id):
+                            futures[executor.submit(fetch, child, continuation)] = (child, continuation)
+                        continue
+                    # the next page of this range is requested before the current one is handed out
+                    if next_continuation:
+                        futures[executor.submit(fetch, range_id, next_continuation)] = (range_id, next_continuation)
+                    for document in documents:
+                        yield document
+        finally:
+            for future in futures:
+                future.cancel()
+
+    @staticmethod
+    def _range_stream(executor, fetch, range_id, children, key, continuation=None, future=None):
+        """ Yields the sorted results of one range, future being its first page when it was already requested """
+        if future is None:
+            future = executor.submit(fetch, range_id, continuation)
+        try:
+            while future is not None:
+                try:
+                    documents, next_continuation = future.result()
+                except errors.HTTPFailure as e:
+                    if e.status_code != 410:
+                        raise
+                    # the range has split, the sorted streams of its children take its place in the merge
+                    future = None
+                    child_ids = children(range_id)
+                    firsts = [executor.submit(fetch, child, continuation) for child in child_ids]
+                    streams = [QueryManagement._range_stream(executor, fetch, child, children, key, continuation, first)
+                               for child, first in zip(child_ids, firsts)]
+                    try:
+                        yield from heapq.merge(*streams, key=key)
+                    finally:
+                        for first in firsts:
+                            first.cancel()
+                    return
+                continuation = next_continuation
+                future = executor.submit(fetch, range_id, continuation) if continuation else None
+                for document in documents:
+                    yield document
+        finally:
+            if future is not None:
+                future.cancel()
+
+    @staticmethod
+    def query_documents(client, db, coll, query, parameters=None, max_degree_of_parallelism=MAX_DEGREE_OF_PARALLELISM,
+                        page_size=PAGE_SIZE, partition_key=None):
+        """ Yields the results of a parameterized SQL query. With a partition_key only that partition is queried,
+        otherwise the query runs on every partition key range in parallel and the results are merged. """
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+
+        if partition_key is not None:
+            # a single partition needs no merging, the server applies ORDER BY, TOP and OFFSET itself
+            continuation = None
+            while True:
+                options = {'maxItemCount': page_size, 'partitionKey': partition_key}
+                if continuation:
+                    options['continuation'] = continuation
+                documents, headers = DocumentManagement._fetch_page(
+                    client, collection_link, {'query': query, 'parameters': parameters or []}, options)
+                for document in documents:
+                    yield document
+                continuation = headers.get('x-ms-continuation')
+                if not continuation:
+                    return
+
+        plan = QueryPlan(query, parameters or [])
+        range_ids = [r['id'] for r in QueryManagement.read_partition_key_ranges(client, collection_link)]
+        fetch = functools.partial(QueryManagement._fetch, client, collection_link, plan.query, page_size=page_size)
+
+        children = functools.partial(QueryManagement._children, client, collection_link)
+
+        with ThreadPoolExecutor(max_workers=max_degree_of_parallelism) as executor:
+            firsts = []
+            if plan.order_by:
+                key = functools.cmp_to_key(plan.compare)
+                # the first page of every range is requested now, heapq.merge only starts a stream when it
+                # reaches it
+                firsts = [executor.submit(fetch, range_id, None) for range_id in range_ids]
+                streams = [QueryManagement._range_stream(executor, fetch, range_id, children, key, None, first)
+                           for range_id, first in zip(range_ids, firsts)]
+                results = heapq.merge(*streams, key=key)
+            else:
+                streams = []
+                results = QueryManagement._unordered(executor, fetch, range_ids, children)
+
+            take = plan.top
+            if plan.limit is not None:
+                take = plan.limit if take is None else min(take, plan.limit)
+            skip = plan.offset
+            try:
+                if take == 0:
+                    return
+                for document in results:
+                    if skip:
+                        skip -= 1
+                        continue
+                    yield document
+                    if take is not None:
+                        take -= 1
+                        if take == 0:
+                            break
+            finally:
+                # stops the page requests still queued when the caller has all it needs
+                for stream in streams:
+                    stream.close()
+                # a stream that was never started does not cancel its first page when it is closed
+                for first in firsts:
+                    first.cancel()
+                if hasattr(results, 'close'):
+                    results.close()
+
+    @staticmethod
+    def query_columns(client, db, coll, query, fields, parameters=None, max_degree_of_parallelism=MAX_DEGREE_OF_PARALLELISM,
+                      page_size=PAGE_SIZE, partition_key=None, names=None):
+        """ Runs a query like query_documents and keeps only fields of its results, property names or dotted
+        paths (items.0.unit_price), in a ColumnarResult (shared/columnar.py) whose fields are called names
+        (default fields). The results are added as their pages arrive, so only a page of them is held as
+        dictionaries. """
+        paths = [_steps(field) for field in fields]
+        result = ColumnarResult(names or fields)
+        for document in QueryManagement.query_documents(client, db, coll, query, parameters, max_degree_of_parallelism,
+                                                        page_size, partition_key):
+            result.append([_field(document, path) for path in paths])
+        return result
@@ -0,0 +1,415 @@
+import azure.cosmos.errors as errors
+import hashlib
+import heapq
+import json
+import math
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import shared.config as cfg
+from DocumentManagement import DocumentManagement
+from shared.routing import Undefined, partition_key_of, routing
+from shared.throttling import execute, request_charge
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - reports how big a collection is and how its data is shaped
+#
+#   stats = StatisticsManagement.collect(client, 'pysamples', 'data')               # sampled
+#   stats = StatisticsManagement.collect(client, 'pysamples', 'data', exact=True)   # exact
+#   StatisticsManagement.print_report(stats)
+#
+# The report has the number of documents and their size distribution, the number of distinct partition
+# keys, the hottest partition keys and partition key ranges by size with their share of the collection, and
+# the top level properties that take up the most space.
+#
+# Sampled - one streamed scan, a page at a time. Counts, sizes and ranges are totalled over every document.
+#    The properties are measured on a reservoir sample of sample_size documents, the distinct partition keys
+#    are estimated from the sketch_size smallest hashes of the keys and the hottest partition keys are kept
+#    by a Misra-Gries summary of sketch_size counters, whose counts are low by at most 1/sketch_size of the
+#    documents.
+#
+# Exact - every partition key range is scanned by its own task, up to max_workers at once, and the
+#    properties are measured on every document. The partition keys are counted with the same sketches as
+#    in a sampled scan, one per range: a partition key lives in exactly one range, so the ranges' hottest
+#    keys are merged as they are and their distinct keys are exact up to sketch_size.
+#
+# Either way memory does not grow with the size of the collection: the sampled scan holds a page and the
+# fixed size samples, the exact scan a page and the sketches of max_workers ranges.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# Sizes are of the documents' JSON, the service stores them in a binary format of about the same size.
+# Size percentiles are read from a histogram with buckets about 4% apart. A scan is charged like any read
+# of the whole collection, run it where the collection has the throughput to spare.
+# ----------------------------------------------------------------------------------------------------------
+
+SAMPLE_SIZE = cfg.settings['stats_sample_size']
+SKETCH_SIZE = cfg.settings['stats_sketch_size']
+TOP_PARTITIONS = cfg.settings['stats_top_partitions']
+MAX_WORKERS = cfg.settings['stats_max_workers']
+PAGE_SIZE = cfg.settings['page_size']
+
+# the most data a logical partition (one partition key value) can hold
+LOGICAL_PARTITION_LIMIT = 20 * 1024 ** 3
+
+_SYSTEM_PROPERTIES = ('_rid', '_self', '_etag', '_ts', '_attachments', '_lsn')
+
+# histogram buckets per doubling of the document size
+_BUCKETS_PER_DOUBLING = 16
+
+
+def _size(value):
+    return len(json.dumps(value, separators=(',', ':')))
+
+
+def _properties(document):
+    """ (name, bytes) of every top level property of a document, name and separators included """
+    return [(name, _size(name) + 2 + _size(value)) for name, value in document.items()
+            if name not in _SYSTEM_PROPERTIES]
+
+
+def _bucket(size):
+    return int(math.log2(max(size, 1)) * _BUCKETS_PER_DOUBLING)
+
+
+def _key_hash(partition_key):
+    text = '\x00undefined' if partition_key is Undefined else json.dumps(partition_key)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class _Sizes:
+    """ Count, bytes and histogram of document sizes """
+
+    def __init__(self):
+        self.documents = 0
+        self.bytes = 0
+        self.smallest = None
+        self.largest = 0
+        self.histogram = Counter()
+
+    def add(self, size):
+        self.documents += 1
+        self.bytes += size
+        self.smallest = size if self.smallest is None else min(self.smallest, size)
+        self.largest = max(self.largest, size)
+        self.histogram[_bucket(size)] += 1
+
+    def merge(self, other):
+        self.documents += other.documents
+        self.bytes += other.bytes
+        if other.smallest is not None:
+            self.smallest = other.smallest if self.smallest is None else min(self.smallest, other.smallest)
+        self.largest = max(self.largest, other.largest)
+        self.histogram.update(other.histogram)
+
+    def percentile(self, p):
+        if not self.documents:
+            return 0
+        rank = p / 100.0 * self.documents
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                upper = int(2 ** ((bucket + 1) / float(_BUCKETS_PER_DOUBLING)))
+                return max(self.smallest, min(upper, self.largest))
+        return self.largest
+
+    def summary(self):
+        return {
+            'min': self.smallest or 0,
+            'mean': self.bytes / float(self.documents) if self.documents else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.largest
+        }
+
+
+class _DistinctKeys:
+    """ Estimates the number of distinct partition keys from the k smallest of their hashes """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+        self._members = set()
+
+    def add(self, partition_key):
+        self._add(_key_hash(partition_key))
+
+    def merge(self, other):
+        for h in other._members:
+            self._add(h)
+
+    def _add(self, h):
+        if h in self._members:
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, -h)
+            self._members.add(h)
+        elif h < -self._heap[0]:
+            self._members.discard(-heapq.heapreplace(self._heap, -h))
+            self._members.add(h)
+
+    @property
+    def exact(self):
+        return len(self._heap) < self.k
+
+    def estimate(self):
+        if self.exact:
+            return len(self._heap)
+        return int((self.k - 1) * 2.0 ** 64 / -self._heap[0])
+
+
+class _HeavyHitters:
+    """ Misra-Gries summary of the documents and bytes per partition key """
+
+    def __init__(self, counters):
+        self.counters = counters
+        # partition key: [documents, documents seen while counted, bytes seen while counted]
+        self._counts = {}
+
+    def add(self, partition_key, size):
+        counted = self._counts.get(partition_key)
+        if counted is not None:
+            counted[0] += 1
+            counted[1] += 1
+            counted[2] += size
+        elif len(self._counts) < self.counters:
+            self._counts[partition_key] = [1, 1, size]
+        else:
+            for key in list(self._counts):
+                counted = self._counts[key]
+                counted[0] -= 1
+                if counted[0] == 0:
+                    del self._counts[key]
+
+    def top(self, n):
+        hottest = heapq.nlargest(n, self._counts.items(), key=lambda item: item[1][2] / item[1][1] * item[1][0])
+        return [(key, documents, int(size / float(seen) * documents)) for key, (documents, seen, size) in hottest]
+
+
+class StatisticsManagement:
+
+    @staticmethod
+    def _service_usage(client, collection_link):
+        """ The documents and bytes the service reports for the collection, None when it does not """
+        execute(client, 'ReadContainer', collection_link, {'populateQuotaInfo': True})
+        usage = (client.last_response_headers or {}).get('x-ms-resource-usage')
+        if not usage:
+            return None
+        values = dict(part.split('=', 1) for part in usage.split(';') if '=' in part)
+        return {'documents': int(values.get('documentsCount', 0)),
+                'bytes': int(values.get('documentsSize', 0)) * 1024}
+
+    @staticmethod
+    def _sampled(client, db, coll, routing_map, sample_size, sketch_size, top, page_size):
+        sizes = _Sizes()
+        ranges = {r['id']: [0, 0] for r in routing_map.ranges}
+        reservoir = []
+        distinct = _DistinctKeys(sketch_size)
+        hottest = _HeavyHitters(sketch_size)
+        rng = random.Random()
+        charge = 0.0
+
+        for documents, _ in DocumentManagement.ReadDocumentPages(client, db, coll, page_size):
+            charge += request_charge(client.last_response_headers)
+            for document in documents:
+                size = _size(document)
+                sizes.add(size)
+                # Algorithm R - the n-th document replaces a random one of the sample with probability k/n
+                if len(reservoir) < sample_size:
+                    reservoir.append(_properties(document))
+                else:
+                    slot = rng.randrange(sizes.documents)
+                    if slot < sample_size:
+                        reservoir[slot] = _properties(document)
+                if routing_map.partitioned:
+                    partition_key = partition_key_of(document, routing_map.definition)
+                    distinct.add(partition_key)
+                    hottest.add(partition_key, size)
+                    counted = ranges.setdefault(routing_map.range_for(partition_key)['id'], [0, 0])
+                else:
+                    counted = ranges.setdefault(routing_map.ranges[0]['id'], [0, 0])
+                counted[0] += 1
+                counted[1] += size
+
+        # the properties of the sample, scaled up to the whole collection
+        properties = {}
+        scale = sizes.documents / float(len(reservoir)) if reservoir else 0.0
+        for sampled in reservoir:
+            for name, size in sampled:
+                totals = properties.setdefault(name, [0, 0])
+                totals[0] += scale
+                totals[1] += size * scale
+        return {
+            'sizes': sizes,
+            'ranges': ranges,
+            'properties': properties,
+            'distinct': distinct.estimate() if routing_map.partitioned else None,
+            'estimated': not distinct.exact,
+            'hottest': hottest.top(top) if routing_map.partitioned else [],
+            'request_charge': charge
+        }
+
+    @staticmethod
+    def _scan_range(client, collection_link, routing_map, range_id, continuation, page_size, totals):
+        """ Totals the documents of one range, and of its children when it splits while it is read """
+        while True:
+            options = {'maxItemCount': page_size}
+            if continuation:
+                options['continuation'] = continuation
+            try:
+                documents, headers = DocumentManagement._fetch_page(client, collection_link, None, options, range_id)
+            except errors.HTTPFailure as e:
+                if e.status_code != 410:
+                    raise
+                # the range has split, its children carry on from where it stopped and share its totals, as
+                # the documents of a partition key can be on either side of the pages read so far
+                for child in routing.children(client, collection_link, range_id):
+                    StatisticsManagement._scan_range(client, collection_link, routing_map, child['id'], continuation,
+                                                     page_size, totals)
+                return
+            totals['request_charge'] += request_charge(headers)
+            for document in documents:
+                size = _size(document)
+                totals['sizes'].add(size)
+                for name, property_size in _properties(document):
+                    counted = totals['properties'].setdefault(name, [0, 0])
+                    counted[0] += 1
+                    counted[1] += property_size
+                if routing_map.partitioned:
+                    partition_key = partition_key_of(document, routing_map.definition)
+                    totals['distinct'].add(partition_key)
+                    totals['hottest'].add(partition_key, size)
+            continuation = headers.get('x-ms-continuation')
+            if not continuation:
+                return
+
+    @staticmethod
+    def _exact_range(client, collection_link, routing_map, range_id, sketch_size, top, page_size):
+        totals = {'sizes': _Sizes(), 'properties': {}, 'distinct': _DistinctKeys(sketch_size),
+                  'hottest': _HeavyHitters(sketch_size), 'request_charge': 0.0}
+        StatisticsManagement._scan_range(client, collection_link, routing_map, range_id, None, page_size, totals)
+        totals['hottest'] = totals['hottest'].top(top)
+        return totals
+
+    @staticmethod
+    def _exact(client, collection_link, routing_map, sketch_size, top, max_workers, page_size):
+        sizes = _Sizes()
+        ranges = {}
+        properties = {}
+        hottest = []
+        distinct = _DistinctKeys(sketch_size)
+        charge = 0.0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda r: (r['id'], StatisticsManagement._exact_range(
+                client, collection_link, routing_map, r['id'], sketch_size, top, page_size)), routing_map.ranges)
+            for range_id, totals in results:
+                sizes.merge(totals['sizes'])
+                ranges[range_id] = [totals['sizes'].documents, totals['sizes'].bytes]
+                for name, (documents, size) in totals['properties'].items():
+                    counted = properties.setdefault(name, [0, 0])
+                    counted[0] += documents
+                    counted[1] += size
+                hottest = heapq.nlargest(top, hottest + totals['hottest'], key=lambda item: item[2])
+                distinct.merge(totals['distinct'])
+                charge += totals['request_charge']
+        return {
+            'sizes': sizes,
+            'ranges': ranges,
+            'properties': properties,
+            'distinct': distinct.estimate() if routing_map.partitioned else None,
+            'estimated': not distinct.exact,
+            'hottest': hottest,
+            'request_charge': charge
+        }
+
+    @staticmethod
+    def collect(client, db, coll, exact=False, sample_size=SAMPLE_SIZE, sketch_size=SKETCH_SIZE, top=TOP_PARTITIONS,
+                max_workers=MAX_WORKERS, page_size=PAGE_SIZE):
+        """ Scans a collection and returns its statistics, see the header of this file """
+        collection_link = 'dbs/' + db + '/colls/{0}'.format(coll)
+        routing_map = routing.get(client, collection_link)
+        if exact:
+            found = StatisticsManagement._exact(client, collection_link, routing_map, sketch_size, top, max_workers,
+                                                page_size)
+        else:
+            found = StatisticsManagement._sampled(client, db, coll, routing_map, sample_size, sketch_size, top,
+                                                  page_size)
+
+        sizes = found['sizes']
+        documents = sizes.documents
+        total = sizes.bytes
+
+        def share(part, whole):
+            return part / float(whole) if whole else 0.0
+
+        hottest = []
+        for key, key_documents, key_bytes in found['hottest']:
+            hot = {'partition_key': None if key is Undefined else key, 'documents': key_documents, 'bytes': key_bytes,
+                   'share': share(key_bytes, total), 'of_partition_limit': share(key_bytes, LOGICAL_PARTITION_LIMIT)}
+            if key is Undefined:
+                hot['undefined'] = True
+            hottest.append(hot)
+
+        ranges = [{'id': range_id, 'documents': counted[0], 'bytes': counted[1], 'share': share(counted[1], total)}
+                  for range_id, counted in sorted(found['ranges'].items(), key=lambda item: -item[1][1])]
+        mean_range = total / float(len(ranges)) if ranges else 0.0
+
+        properties = [{'name': name, 'documents': int(counted[0]), 'bytes': int(counted[1]),
+                       'share': share(counted[1], total)}
+                      for name, counted in sorted(found['properties'].items(), key=lambda item: -item[1][1])]
+
+        return {
+            'collection': collection_link,
+            'mode': 'exact' if exact else 'sampled',
+            'documents': documents,
+            'bytes': total,
+            'size': sizes.summary(),
+            'partition_key': routing_map.definition['paths'][0] if routing_map.partitioned else None,
+            'partition_keys': {
+                'distinct': found['distinct'],
+                'estimated': found['estimated'],
+                'hottest': hottest
+            },
+            'ranges': ranges,
+            # how much more than an even share the fullest range holds, 1 when the data is spread evenly
+            'range_skew': share(ranges[0]['bytes'], mean_range) if ranges and mean_range else 0.0,
+            'properties': properties,
+            'service': StatisticsManagement._service_usage(client, collection_link),
+            'request_charge': found['request_charge']
+        }
+
+    @staticmethod
+    def print_report(stats):
+        print('Statistics of \'{0}\' ({1})'.format(stats['collection'], stats['mode']))
+        print('Documents {0}, {1} bytes'.format(stats['documents'], stats['bytes']))
+        size = stats['size']
+        print('Document size min {0}, mean {1:.0f}, p50 {2}, p90 {3}, p99 {4}, max {5} bytes'.format(
+            size['min'], size['mean'], size['p50'], size['p90'], size['p99'], size['max']))
+        if stats['service']:
+            print('The service reports {0} documents, {1} bytes'.format(stats['service']['documents'],
+                                                                      stats['service']['bytes']))
+
+        keys = stats['partition_keys']
+        if stats['partition_key']:
+            print('\nPartition key {0}: {1}{2} distinct values'.format(
+                stats['partition_key'], 'about ' if keys['estimated'] else '', keys['distinct']))
+            print('{0:>12} {1:>14} {2:>8} {3:>10}  {4}'.format('documents', 'bytes', 'share', 'of limit',
+                                                               'partition key'))
+            for hot in keys['hottest']:
+                print('{0:>12} {1:>14} {2:>8.1%} {3:>10.2%}  {4}'.format(
+                    hot['documents'], hot['bytes'], hot['share'], hot['of_partition_limit'],
+                    '(undefined)' if hot.get('undefined') else json.dumps(hot['partition_key'])))
+
+        print('\nPartition key ranges, the fullest holds {0:.2f}x an even share'.format(stats['range_skew']))
+        print('{0:>12} {1:>14} {2:>8}  {3}'.format('documents', 'bytes', 'share', 'range'))
+        for r in stats['ranges']:
+            print('{0:>12} {1:>14} {2:>8.1%}  {3}'.format(r['documents'], r['bytes'], r['share'], r['id']))
+
+        print('\nProperties by size')
+        print('{0:>12} {1:>14} {2:>8}  {3}'.format('documents', 'bytes', 'share', 'property'))
+        for p in stats['properties'][:20]:
+            print('{0:>12} {1:>14} {2:>8.1%}  {3}'.format(p['documents'], p['bytes'], p['share'], p['name']))
+        print('\nRequest charge {0:.2f} RU'.format(stats['request_charge']))
@@ -0,0 +1,230 @@
+import math
+import threading
+import time
+
+import shared.config as cfg
+from CollectionManagement import CollectionManagement
+from shared.metrics import metrics
+from shared.throttling import collection_link, execute
+
+# ----------------------------------------------------------------------------------------------------------
+# Sample - scales the offer throughput of collections with the load they actually see
+#
+#   controller = ThroughputController(client, ['dbs/pysamples/colls/data'], dry_run=True)
+#   controller.start()                      # evaluates every 'autoscale_interval' seconds on a thread
+#   ...
+#   controller.stop()
+#
+# The controller listens to shared/metrics.py, so it sees every request the management classes send,
+# including the throttled attempts. Once per interval it works out per collection:
+#
+#   ru_per_second  - request units consumed since the last evaluation
+#   utilization    - ru_per_second / provisioned throughput
+#   throttle_rate  - share of requests rejected with 429
+#
+# A collection is scaled up when utilization is above 'autoscale_scale_up_utilization' or the throttle rate
+# is above 'autoscale_max_throttle_rate', and scaled down when utilization is below
+# 'autoscale_scale_down_utilization' and nothing was throttled. Either way the new throughput brings the
+# utilization back to 'autoscale_target_utilization', in steps of 100 RU/s between the configured bounds.
+# The gap between the two thresholds is the hysteresis that keeps the offer from flapping, and after a
+# change the collection is left alone for a cooldown (longer for scaling down than for scaling up).
+#
+# The offers of all collections are read with one QueryOffers per evaluation. With dry_run the decisions
+# are printed and returned but no offer is replaced, and no cooldown starts. Collections with autoscale
+# throughput (offerAutopilotSettings) are scaled by the service and skipped. An evaluation that fails is
+# printed and the next one runs at the next interval.
+# ----------------------------------------------------------------------------------------------------------
+# Note -
+#
+# Only requests sent by this process are observed. When other clients share the collection, the
+# utilization is underestimated, although their throttling still shows up as 429s here.
+# ----------------------------------------------------------------------------------------------------------
+
+MIN_THROUGHPUT = cfg.settings['autoscale_min_throughput']
+MAX_THROUGHPUT = cfg.settings['autoscale_max_throughput']
+SCALE_UP_UTILIZATION = cfg.settings['autoscale_scale_up_utilization']
+SCALE_DOWN_UTILIZATION = cfg.settings['autoscale_scale_down_utilization']
+TARGET_UTILIZATION = cfg.settings['autoscale_target_utilization']
+MAX_THROTTLE_RATE = cfg.settings['autoscale_max_throttle_rate']
+SCALE_UP_COOLDOWN = cfg.settings['autoscale_scale_up_cooldown']
+SCALE_DOWN_COOLDOWN = cfg.settings['autoscale_scale_down_cooldown']
+INTERVAL = cfg.settings['autoscale_interval']
+
+# offers are provisioned in increments of 100 RU/s
+THROUGHPUT_STEP = 100
+
+# requests on the collection resource itself are not served from its provisioned throughput
+_METADATA_OPERATIONS = ('ReadContainer', 'ReplaceContainer', 'DeleteContainer', '_ReadPartitionKeyRanges')
+
+
+class _Window:
+    """ Requests observed for one collection since the last evaluation """
+
+    def __init__(self):
+        self.requests = 0
+        self.throttled = 0
+        self.request_charge = 0.0
+
+
+class ThroughputController:
+
+    def __init__(self, client, collection_links, min_throughput=MIN_THROUGHPUT, max_throughput=MAX_THROUGHPUT,
+                 scale_up_utilization=SCALE_UP_UTILIZATION, scale_down_utilization=SCALE_DOWN_UTILIZATION,
+                 target_utilization=TARGET_UTILIZATION, max_throttle_rate=MAX_THROTTLE_RATE,
+                 scale_up_cooldown=SCALE_UP_COOLDOWN, scale_down_cooldown=SCALE_DOWN_COOLDOWN, dry_run=False):
+        if not scale_down_utilization < target_utilization < scale_up_utilization:
+            raise ValueError('scale_down_utilization < target_utilization < scale_up_utilization is required')
+        if min_throughput > max_throughput:
+            raise ValueError('min_throughput is larger than max_throughput')
+
+        self.client = client
+        self.collection_links = [link.strip('/') for link in collection_links]
+        self.min_throughput = min_throughput
+        self.max_throughput = max_throughput
+        self.scale_up_utilization = scale_up_utilization
+        self.scale_down_utilization = scale_down_utilization
+        self.target_utilization = target_utilization
+        self.max_throttle_rate = max_throttle_rate
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.dry_run = dry_run
+
+        self._windows = {link: _Window() for link in self.collection_links}
+        self._window_started = time.monotonic()
+        self._last_change = {}
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        metrics.add_listener(self._observe)
+
+    def _observe(self, operation, link, status_code, request_charge, latency):
+        if operation in _METADATA_OPERATIONS:
+            return
+        link = collection_link(link or '')
+        with self._lock:
+            window = self._windows.get(link)
+            if window is None:
+                return
+            window.requests += 1
+            window.request_charge += request_charge
+            if status_code == 429:
+                window.throttled += 1
+
+    def _collection(self, link):
+        # the _self of a collection never changes, it is read once
+        collection = self._collections.get(link)
+        if collection is None:
+            collection = self._collections[link] = execute(self.client, 'ReadContainer', link)
+        return collection
+
+    def _target(self, throughput, ru_per_second, utilization, throttle_rate, now, last_change):
+        """ Returns (action, throughput) for one collection """
+        if utilization > self.scale_up_utilization or throttle_rate > self.max_throttle_rate:
+            action = 'scale up'
+            cooldown = self.scale_up_cooldown
+            # when throttled the consumption is capped by the current throughput, so grow by at least one step
+            target = max(throughput + THROUGHPUT_STEP, ru_per_second / self.target_utilization)
+        elif utilization < self.scale_down_utilization and throttle_rate == 0:
+            action = 'scale down'
+            cooldown = self.scale_down_cooldown
+            target = ru_per_second / self.target_utilization
+        else:
+            return 'hold', throughput
+
+        target = int(math.ceil(target / THROUGHPUT_STEP)) * THROUGHPUT_STEP
+        target = min(self.max_throughput, max(self.min_throughput, target))
+        if target == throughput:
+            return 'hold', throughput
+        if last_change is not None and now - last_change < cooldown:
+            return action + ' (cooling down)', throughput
+        return action, target
+
+    def evaluate(self):
+        """ Decides, and unless dry_run applies, the throughput of every collection. Returns the decisions. """
+        now = time.monotonic()
+        with self._lock:
+            windows = self._windows
+            elapsed = max(now - self._window_started, 1e-9)
+            self._windows = {link: _Window() for link in self.collection_links}
+            self._window_started = now
+
+        collections = [self._collection(link) for link in self.collection_links]
+        offers = CollectionManagement.read_offers(self.client, collections)
+
+        decisions = []
+        for link, collection in zip(self.collection_links, collections):
+            offer = offers.get(collection['_self'])
+            if offer is None:
+                print('No offer was found for collection \'{0}\''.format(link))
+                continue
+            if 'offerAutopilotSettings' in offer['content']:
+                print('Collection \'{0}\' has autoscale throughput, it is skipped'.format(link))
+                continue
+            window = windows[link]
+            throughput = offer['content']['offerThroughput']
+            ru_per_second = window.request_charge / elapsed
+            utilization = ru_per_second / throughput
+            throttle_rate = window.throttled / float(window.requests) if window.requests else 0.0
+
+            action, target = self._target(throughput, ru_per_second, utilization, throttle_rate,
+                                          now, self._last_change.get(link))
+            applied = False
+            if target != throughput and not self.dry_run:
+                offer['content']['offerThroughput'] = target
+                execute(self.client, 'ReplaceOffer', offer['_self'], offer)
+                self._last_change[link] = now
+                applied = True
+
+            decision = {
+                'collection': link,
+                'throughput': throughput,
+                'target': target,
+                'ru_per_second': round(ru_per_second, 2),
+                'utilization': round(utilization, 3),
+                'throttle_rate': round(throttle_rate, 3),
+                'action': action,
+                'applied': applied
+            }
+            decisions.append(decision)
+            change = ''
+            if target != throughput:
+                change = ' to {0} RU/s{1}'.format(target, ' (dry run)' if self.dry_run else '')
+            print('{0}: {1} RU/s at {2:.0%} utilization, {3:.1%} throttled - {4}{5}'.format(
+                link, throughput, utilization, throttle_rate, action, change))
+        return decisions
+
+    def run(self, interval=INTERVAL, rounds=None):
+        """ Evaluates every interval seconds until stop() is called or after rounds evaluations """
+        done = 0
+        while not self._stopped.wait(interval):
+            try:
+                self.evaluate()
+            except Exception as e:
+                # a failed evaluation, eg. a timeout reading the offers, must not stop the scaling
+                print('Evaluating the throughput failed, trying again in {0}s - {1}: {2}'.format(
+                    interval, type(e).__name__, e))
+            done += 1
+            if rounds is not None and done >= rounds:
+                return
+
+    def start(self, interval=INTERVAL):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        metrics.remove_listener(self._observe)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
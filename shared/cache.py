@@ -0,0 +1,141 @@
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import shared.config as cfg
+
+# ----------------------------------------------------------------------------------------------------------
+# Resource metadata cache
+#
+# find_database and find_Container each cost a full QueryDatabases/QueryContainers round trip. The
+# document operations run both of them before every data-plane call, so a point read used to cost three
+# requests. The answers are cached here by resource link (eg. dbs/Foo or dbs/Foo/colls/Bar).
+#
+# Entries expire after a TTL and the cache is bounded; once it is full the least recently used entry
+# is evicted. Create and delete operations invalidate the links they touch.
+#
+# Document cache
+#
+# Hot documents are read over and over. With 'document_cache_enabled' the point reads of DocumentManagement
+# keep the documents they read here, by document link, with their _etag. The next read of the same link
+# sends If-None-Match with that _etag, and while the document is unchanged the server answers 304 Not
+# Modified without a body, which costs a fraction of a full read. The cache is bounded by entries and by
+# the JSON size of the documents, least recently used documents are evicted first.
+# ----------------------------------------------------------------------------------------------------------
+
+
+class ResourceCache:
+    """ A thread safe TTL cache with least recently used eviction, keyed by resource link. """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, link):
+        """ Returns the cached value for link, or None when it is missing or expired. """
+        with self._lock:
+            entry = self._entries.get(link)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[link]
+                return None
+            self._entries.move_to_end(link)
+            return value
+
+    def put(self, link, value):
+        with self._lock:
+            self._entries[link] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(link)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, link):
+        """ Drops link and every resource below it, eg. dbs/Foo also drops dbs/Foo/colls/Bar """
+        prefix = link + '/'
+        with self._lock:
+            for key in [k for k in self._entries if k == link or k.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DocumentCache:
+    """ A thread safe least recently used cache of documents and their ETags, bounded by entries and bytes """
+
+    def __init__(self, max_entries, max_bytes, enabled=True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, link, partition_key=None):
+        """ Returns the cached document of link, or None. The document has to be revalidated with its _etag. """
+        with self._lock:
+            entry = self._entries.get(link)
+            if entry is None or entry[1] != partition_key:
+                return None
+            self._entries.move_to_end(link)
+            return entry[0]
+
+    def put(self, link, document, partition_key=None):
+        size = len(json.dumps(document))
+        with self._lock:
+            self._remove(link)
+            if size > self.max_bytes:
+                return
+            # a copy, so that callers changing the document they got back do not change the cache
+            self._entries[link] = (copy.deepcopy(document), partition_key, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][2]
+
+    def _remove(self, link):
+        entry = self._entries.pop(link, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def invalidate(self, link):
+        """ Drops link and every document below it, eg. dbs/Foo/colls/Bar drops all the documents of Bar """
+        prefix = link + '/'
+        with self._lock:
+            for key in [k for k in self._entries if k == link or k.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+metadata_cache = ResourceCache(cfg.settings['metadata_cache_ttl'], cfg.settings['metadata_cache_size'])
+document_cache = DocumentCache(cfg.settings['document_cache_max_entries'], cfg.settings['document_cache_max_bytes'],
+                               cfg.settings['document_cache_enabled'])
@@ -0,0 +1,99 @@
+import json
+import os
+import sqlite3
+import threading
+
+# ----------------------------------------------------------------------------------------------------------
+# Checkpoint stores - where long running jobs keep their progress so they can resume after a restart
+#
+# A checkpoint is a string value (eg. a continuation token) stored under a scope (eg. a collection link)
+# and a key (eg. a partition key range id):
+#
+#   store = checkpoint_store('changefeed.json')      # or 'changefeed.db' for SQLite
+#   store.save('dbs/pysamples/colls/data', '0', '"42"')
+#   store.load('dbs/pysamples/colls/data')           # {'0': '"42"'}
+#
+# FileCheckpointStore keeps every checkpoint in one JSON file and replaces the file atomically on each
+# save, so a crash never leaves it half written. SqliteCheckpointStore keeps them in a SQLite table,
+# which is cheaper when there are many keys or several processes share the store.
+# ----------------------------------------------------------------------------------------------------------
+
+
+class FileCheckpointStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._checkpoints = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._checkpoints = json.load(f)
+
+    def load(self, scope):
+        """ Returns { key: value } of scope """
+        with self._lock:
+            return dict(self._checkpoints.get(scope, {}))
+
+    def save(self, scope, key, value):
+        with self._lock:
+            self._checkpoints.setdefault(scope, {})[key] = value
+            self._write()
+
+    def delete(self, scope, key=None):
+        """ Removes key, or every checkpoint of scope when key is None """
+        with self._lock:
+            if key is None:
+                self._checkpoints.pop(scope, None)
+            else:
+                self._checkpoints.get(scope, {}).pop(key, None)
+            self._write()
+
+    def _write(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self._checkpoints, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def close(self):
+        pass
+
+
+class SqliteCheckpointStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS checkpoints ('
+                                     'scope TEXT NOT NULL, key TEXT NOT NULL, value TEXT, PRIMARY KEY (scope, key))')
+
+    def load(self, scope):
+        """ Returns { key: value } of scope """
+        with self._lock:
+            rows = self._connection.execute('SELECT key, value FROM checkpoints WHERE scope = ?', (scope,)).fetchall()
+        return dict(rows)
+
+    def save(self, scope, key, value):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO checkpoints (scope, key, value) VALUES (?, ?, ?)',
+                                     (scope, key, value))
+
+    def delete(self, scope, key=None):
+        """ Removes key, or every checkpoint of scope when key is None """
+        with self._lock, self._connection:
+            if key is None:
+                self._connection.execute('DELETE FROM checkpoints WHERE scope = ?', (scope,))
+            else:
+                self._connection.execute('DELETE FROM checkpoints WHERE scope = ? AND key = ?', (scope, key))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def checkpoint_store(path):
+    """ A SqliteCheckpointStore for a .db, .sqlite or .sqlite3 path, otherwise a FileCheckpointStore """
+    if os.path.splitext(path)[1].lower() in ('.db', '.sqlite', '.sqlite3'):
+        return SqliteCheckpointStore(path)
+    return FileCheckpointStore(path)
@@ -0,0 +1,121 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import shared.config as cfg
+from shared.cache import metadata_cache
+from shared.throttling import connection_policy, execute
+
+# ----------------------------------------------------------------------------------------------------------
+# Client lifecycle - one shared, pooled CosmosClient per process
+#
+#   factory = ClientFactory()
+#   client = factory.get()                      # created on first use, then shared
+#   factory.warm_up(['dbs/pysamples/colls/data'])
+#   ...
+#   factory.close()                             # closes the pooled connections
+#
+# The client is a ManagedCosmosClient (shared/managed_client.py), a CosmosClient whose HTTP connection pool
+# holds pool_size connections with TCP keep-alive. Its last_response_headers is kept per thread, so
+# concurrent requests on the shared client each see the headers (continuation, request charge) of their
+# own response.
+#
+# Startup - the SDK is only imported, and the client (which reads the database account) only created, when
+# the first request needs them. factory.lazy() hands out a stand-in that creates the client on first use,
+# and factory.prefetch() creates it on a background thread, eg. while an interactive user picks a command.
+#
+# warm_up opens the pooled connections ahead of the first request and resolves the metadata of the given
+# collections, so the first real request does not pay for the TLS handshake and the existence checks.
+# ----------------------------------------------------------------------------------------------------------
+
+HOST = cfg.settings['host']
+MASTER_KEY = cfg.settings['master_key']
+POOL_SIZE = cfg.settings['connection_pool_size']
+KEEP_ALIVE = cfg.settings['connection_keep_alive']
+
+
+class ClientFactory:
+    """ Creates the shared client on first use and closes it deterministically """
+
+    def __init__(self, host=HOST, master_key=MASTER_KEY, pool_size=POOL_SIZE, keep_alive=KEEP_ALIVE, policy=None):
+        self.host = host
+        self.master_key = master_key
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.policy = policy
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._client is None or self._client.closed:
+                from shared.managed_client import ManagedCosmosClient
+                self._client = ManagedCosmosClient(self.host, {'masterKey': self.master_key},
+                                                   self.policy or connection_policy(),
+                                                   pool_size=self.pool_size, keep_alive=self.keep_alive)
+            return self._client
+
+    def lazy(self):
+        """ Returns a stand-in for the client that creates it when it is first used """
+        return _LazyClient(self)
+
+    def prefetch(self):
+        """ Imports the SDK and creates the client on a background thread """
+        def create():
+            try:
+                self.get()
+            except Exception:
+                # the next get() tries again and raises the error where it can be handled
+                pass
+        threading.Thread(target=create, daemon=True).start()
+
+    def warm_up(self, collection_links=(), connections=None):
+        """ Opens up to connections pooled connections and resolves the metadata of collection_links """
+        client = self.get()
+        connections = connections or self.pool_size
+        started = time.perf_counter()
+
+        # concurrent requests each need their own connection, which then stays in the pool
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            list(executor.map(lambda _: client.GetDatabaseAccount(), range(connections)))
+
+        for link in collection_links:
+            execute(client, 'ReadContainer', link)
+            metadata_cache.put('/'.join(link.strip('/').split('/')[:2]), True)
+            metadata_cache.put(link.strip('/'), True)
+
+        print('Warm up opened {0} connections and resolved {1} collections in {2:.2f}s'.format(
+            connections, len(collection_links), time.perf_counter() - started))
+        return client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+
+class _LazyClient:
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory.get(), name)
+
+
+def __getattr__(name):
+    # ManagedCosmosClient used to live here, it is loaded on demand so importing this module stays cheap
+    if name == 'ManagedCosmosClient':
+        from shared.managed_client import ManagedCosmosClient
+        return ManagedCosmosClient
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+client_factory = ClientFactory()
@@ -0,0 +1,283 @@
+import math
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ----------------------------------------------------------------------------------------------------------
+# Columnar results - selected fields of many documents kept as one compact buffer per field
+#
+#   result = DocumentManagement.read_columns(client, 'pysamples', 'data', ['account_number', 'total_due'])
+#   result.group_sum('account_number', 'total_due')     # {'Account1': 985.018, ...}
+#   result.column('total_due')                          # array('d', [...]), or result.to_numpy('total_due')
+#
+# A list of documents costs a dictionary per document and an object per value, several hundred bytes for
+# a few fields. Here a numeric field is an array('d') of 8 bytes a value, and a string field is an
+# array('i') of 4 byte codes into its distinct values, each stored once (and interned), so repeated values
+# such as account numbers cost a code each. Numbers are kept as doubles, missing values are NaN and code -1.
+#
+# The first value of a field decides how it is kept. A value of another type further on (eg. 'n/a' in a
+# numeric field) is NaN or code -1 in the buffer and kept aside by its row, so the buffer stays compact and
+# the aggregations skip it, as Cosmos' do. A field whose first value is neither a number nor a string
+# (booleans, objects, arrays) is kept as a plain list. Aggregations use NumPy when it is installed
+# (bincount over the codes and values, without copying the buffers) and a single pass over the buffers
+# otherwise.
+# ----------------------------------------------------------------------------------------------------------
+
+MISSING = object()
+
+
+class _Numbers:
+
+    def __init__(self, count=0):
+        self.values = array('d', [math.nan]) * count
+        # { row: value } of the values that are not numbers
+        self.others = {}
+
+    @staticmethod
+    def accepts(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def append(self, value):
+        if value is MISSING or value is None:
+            value = math.nan
+        elif not self.accepts(value):
+            self.others[len(self.values)] = value
+            value = math.nan
+        self.values.append(value)
+
+    def get(self, index):
+        if index in self.others:
+            return self.others[index]
+        value = self.values[index]
+        return None if math.isnan(value) else value
+
+    def decoded(self):
+        values = [None if math.isnan(v) else v for v in self.values]
+        for index, value in self.others.items():
+            values[index] = value
+        return values
+
+    def nbytes(self):
+        return self.values.itemsize * len(self.values) + (sys.getsizeof(self.others) if self.others else 0)
+
+
+class _Strings:
+
+    def __init__(self, count=0):
+        self.codes = array('i', [-1]) * count
+        self.categories = []
+        self._index = {}
+        # { row: value } of the values that are not strings
+        self.others = {}
+
+    @staticmethod
+    def accepts(value):
+        return isinstance(value, str)
+
+    def append(self, value):
+        if value is MISSING or value is None:
+            self.codes.append(-1)
+            return
+        if not self.accepts(value):
+            self.others[len(self.codes)] = value
+            self.codes.append(-1)
+            return
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.categories)
+            self.categories.append(sys.intern(value))
+        self.codes.append(code)
+
+    def get(self, index):
+        if index in self.others:
+            return self.others[index]
+        code = self.codes[index]
+        return None if code < 0 else self.categories[code]
+
+    def decoded(self):
+        categories = self.categories
+        values = [None if code < 0 else categories[code] for code in self.codes]
+        for index, value in self.others.items():
+            values[index] = value
+        return values
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes) + sum(sys.getsizeof(c) for c in self.categories) + \
+            (sys.getsizeof(self.others) if self.others else 0)
+
+
+class _Objects:
+
+    def __init__(self, values=None):
+        self.values = values or []
+
+    @staticmethod
+    def accepts(value):
+        return True
+
+    def append(self, value):
+        self.values.append(None if value is MISSING else value)
+
+    def get(self, index):
+        return self.values[index]
+
+    def decoded(self):
+        return list(self.values)
+
+    def nbytes(self):
+        return sys.getsizeof(self.values)
+
+
+class ColumnarResult:
+    """ The values of fields of a sequence of rows, one buffer per field """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self._columns = {field: None for field in self.fields}
+        self._rows = 0
+
+    def append(self, values):
+        """ Adds a row, values in the order of fields, MISSING for a field the row does not have """
+        for field, value in zip(self.fields, values):
+            column = self._columns[field]
+            if value is not MISSING and value is not None:
+                if column is None:
+                    # the first value of the field decides how it is stored
+                    column = _Numbers(self._rows) if _Numbers.accepts(value) else \
+                        _Strings(self._rows) if _Strings.accepts(value) else _Objects([None] * self._rows)
+                    self._columns[field] = column
+            if column is not None:
+                column.append(value)
+        self._rows += 1
+
+    def __len__(self):
+        return self._rows
+
+    def _column(self, field):
+        if field not in self._columns:
+            raise KeyError('{0} is not one of the fields {1}'.format(field, ', '.join(self.fields)))
+        return self._columns[field] or _Objects([None] * self._rows)
+
+    def column(self, field):
+        """ The buffer of a field: an array('d') of numbers (NaN for the values that are not numbers), a list
+        of strings (decoded from the codes) or a list of other values """
+        column = self._column(field)
+        if isinstance(column, _Numbers):
+            return column.values
+        return column.decoded()
+
+    def codes(self, field):
+        """ (array('i') of codes, distinct values) of a string field """
+        column = self._column(field)
+        if not isinstance(column, _Strings):
+            raise TypeError('{0} is not a string field'.format(field))
+        return column.codes, column.categories
+
+    def to_numpy(self, field):
+        """ A numeric field as a NumPy array over the same memory (NaN for the values that are not numbers),
+        other fields as object arrays """
+        if numpy is None:
+            raise ImportError('to_numpy needs numpy, pip install numpy')
+        column = self._column(field)
+        if isinstance(column, _Numbers):
+            return numpy.frombuffer(column.values, dtype=numpy.float64)
+        return numpy.array(column.decoded(), dtype=object)
+
+    def rows(self):
+        """ Yields the rows as dictionaries, one at a time """
+        columns = [(field, self._column(field)) for field in self.fields]
+        for index in range(self._rows):
+            yield {field: column.get(index) for field, column in columns}
+
+    def nbytes(self):
+        """ Roughly the memory the buffers take """
+        return sum(column.nbytes() for column in self._columns.values() if column is not None)
+
+    def _numbers(self, field):
+        column = self._column(field)
+        if self._columns[field] is None:
+            # no row has the field
+            return _Numbers(self._rows)
+        if not isinstance(column, _Numbers):
+            raise TypeError('{0} is not a numeric field'.format(field))
+        return column
+
+    def sum(self, field):
+        """ The sum of the numbers of field, other values are skipped """
+        column = self._numbers(field)
+        if numpy is not None:
+            return float(numpy.nansum(numpy.frombuffer(column.values, dtype=numpy.float64)))
+        return math.fsum(v for v in column.values if not math.isnan(v))
+
+    def _groups(self, by):
+        """ (codes, keys) of the groups of every row, code -1 for rows without the field """
+        column = self._column(by)
+        if isinstance(column, _Strings) and not column.others:
+            return column.codes, column.categories
+        # numbers and other values are given their codes here
+        index = {}
+        keys = []
+        codes = array('i')
+        for value in column.decoded():
+            if value is None:
+                codes.append(-1)
+                continue
+            key = value if not isinstance(value, (dict, list)) else repr(value)
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(keys)
+                keys.append(value)
+            codes.append(code)
+        return codes, keys
+
+    def group_sum(self, by, field):
+        """ { value of by: sum of field } over the rows that have both fields """
+        values = self._numbers(field)
+        codes, keys = self._groups(by)
+        sums = self._bincount(codes, values.values, len(keys))
+        counts = self._bincount(codes, None, len(keys), values.values)
+        return {keys[i]: sums[i] for i in range(len(keys)) if counts[i]}
+
+    def group_count(self, by, field=None):
+        """ { value of by: number of rows that have by }, or that also have field """
+        codes, keys = self._groups(by)
+        present = None
+        if field is not None:
+            column = self._column(field)
+            present = column.values if isinstance(column, _Numbers) and not column.others else \
+                array('d', (math.nan if v is None else 0.0 for v in column.decoded()))
+        counts = self._bincount(codes, None, len(keys), present)
+        return {keys[i]: int(counts[i]) for i in range(len(keys)) if counts[i]}
+
+    @staticmethod
+    def _bincount(codes, weights, length, present=None):
+        """ Per code the sum of weights (or the number of rows), skipping code -1 and NaN weights, and the
+        rows where present is NaN """
+        mask_source = weights if weights is not None else present
+        if not length:
+            return []
+        if numpy is not None:
+            codes = numpy.frombuffer(codes, dtype=numpy.int32)
+            keep = codes >= 0
+            if mask_source is not None:
+                keep &= ~numpy.isnan(numpy.frombuffer(mask_source, dtype=numpy.float64))
+            selected = None if weights is None else numpy.frombuffer(weights, dtype=numpy.float64)[keep]
+            return numpy.bincount(codes[keep], weights=selected, minlength=length).tolist()
+        totals = [0.0 if weights is not None else 0] * length
+        if weights is not None:
+            for code, weight in zip(codes, weights):
+                if code >= 0 and weight == weight:
+                    totals[code] += weight
+        elif present is not None:
+            for code, flag in zip(codes, present):
+                if code >= 0 and flag == flag:
+                    totals[code] += 1
+        else:
+            for code in codes:
+                if code >= 0:
+                    totals[code] += 1
+        return totals
@@ -2,5 +2,114 @@ settings = {
     'host': '[YOUR ENDPOINT]',
     'master_key': '[YOUR KEY]',
     'database_id': 'pysamples',
-    'collection_id': 'data'
+    'collection_id': 'data',
+
+    # database/collection existence checks are cached for this many seconds
+    'metadata_cache_ttl': 300,
+    'metadata_cache_size': 1024,
+    # partition key definitions and ranges are cached for this many seconds, a split refreshes them sooner
+    'routing_map_ttl': 3600,
+
+    # bulk import: concurrent writes in flight and documents reported per batch
+    'bulk_max_in_flight': 16,
+    'bulk_batch_size': 500,
+    # bulk upsert/replace/delete send the operations of one partition key in groups of up to this many
+    'bulk_group_size': 100,
+
+    # documents requested per round trip when reading a collection
+    'page_size': 1000,
+
+    # throttled requests (429, 449, 503) are retried up to retry_max_attempts times, waiting for the
+    # server's retry-after or a jittered exponential backoff between retry_base_delay and retry_max_delay seconds
+    'retry_max_attempts': 9,
+    'retry_base_delay': 0.1,
+    'retry_max_delay': 10,
+
+    # requests to a collection are paced to a target RU/s, eg. { 'dbs/pysamples/colls/data': 350 }
+    'target_ru_per_second': {},
+
+    # requests the asyncio API keeps in flight at once
+    'async_max_concurrency': 64,
+
+    # commands CLI.py batch runs at once
+    'cli_workers': 8,
+
+    # partition key ranges a cross partition query reads at the same time
+    'query_max_degree_of_parallelism': 8,
+
+    # read_many uses point reads for up to read_many_point_reads ids of one partition key,
+    # and IN queries of up to read_many_query_size ids for more
+    'read_many_point_reads': 4,
+    'read_many_query_size': 100,
+    'read_many_concurrency': 16,
+
+    # HTTP connections kept open to the account, and whether to open them (and resolve the
+    # metadata of warm_up_collections, eg. ['dbs/pysamples/colls/data']) before the first request
+    'connection_pool_size': 32,
+    'connection_keep_alive': True,
+    'warm_up': False,
+    'warm_up_collections': [],
+
+    # the throughput controller keeps offers between autoscale_min/max_throughput RU/s. It scales up above
+    # scale_up_utilization (share of the throughput consumed) or max_throttle_rate (share of requests
+    # throttled), down below scale_down_utilization, aiming for target_utilization. Cooldowns are in seconds.
+    'autoscale_min_throughput': 400,
+    'autoscale_max_throughput': 10000,
+    'autoscale_scale_up_utilization': 0.8,
+    'autoscale_scale_down_utilization': 0.3,
+    'autoscale_target_utilization': 0.6,
+    'autoscale_max_throttle_rate': 0.01,
+    'autoscale_scale_up_cooldown': 60,
+    'autoscale_scale_down_cooldown': 600,
+    'autoscale_interval': 30,
+
+    # the change feed consumer reads up to change_feed_max_workers partition key ranges at once, polls every
+    # change_feed_poll_interval seconds and keeps its checkpoints in change_feed_checkpoints (.db for SQLite)
+    'change_feed_max_workers': 8,
+    'change_feed_poll_interval': 5,
+    'change_feed_checkpoints': 'changefeed.json',
+
+    # point reads keep documents in an in-process cache and revalidate them with If-None-Match
+    'document_cache_enabled': False,
+    'document_cache_max_entries': 10000,
+    'document_cache_max_bytes': 64 * 1024 * 1024,
+
+    # exports read up to export_max_workers partition key ranges at once, buffer at most export_buffer_pages
+    # pages for the writer, start a new file after export_max_file_bytes and write Parquet row groups of
+    # export_row_group_size documents. Their progress is kept in export_checkpoints (.db for SQLite)
+    'export_max_workers': 8,
+    'export_buffer_pages': 32,
+    'export_max_file_bytes': 256 * 1024 * 1024,
+    'export_row_group_size': 50000,
+    'export_checkpoints': 'exports.json',
+
+    # provisioning from a spec lists the containers of up to provisioning_max_concurrency databases, and
+    # applies up to that many changes, at once
+    'provisioning_max_concurrency': 8,
+
+    # queries are recorded by shape for the indexing advisor while query_workload_enabled, up to
+    # query_workload_max_shapes shapes. The advisor samples index_advisor_sample_size documents.
+    'query_workload_enabled': False,
+    'query_workload_max_shapes': 1000,
+    'index_advisor_sample_size': 100,
+
+    # load tests send requests from load_test_workers threads and drop the requests that fall more than
+    # load_test_max_backlog behind the target rate
+    'load_test_workers': 32,
+    'load_test_max_backlog': 1000,
+
+    # collection statistics measure the properties of stats_sample_size sampled documents and keep
+    # stats_sketch_size partition key hashes and counters. They list the stats_top_partitions hottest
+    # partition keys, exact statistics scan up to stats_max_workers partition key ranges at once.
+    'stats_sample_size': 1000,
+    'stats_sketch_size': 1024,
+    'stats_top_partitions': 10,
+    'stats_max_workers': 8,
+
+    # copies read up to migration_max_workers partition key ranges of the source at once and write up to
+    # migration_max_in_flight groups of documents to the target. Their progress is kept in
+    # migration_checkpoints (.db for SQLite)
+    'migration_max_workers': 8,
+    'migration_max_in_flight': 16,
+    'migration_checkpoints': 'migrations.json'
 }
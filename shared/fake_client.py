@@ -0,0 +1,461 @@
+import azure.cosmos.errors as errors
+import copy
+import json
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from shared.fake_sql import run_query
+from shared.routing import effective_partition_key, hash_bound, partition_key_of
+
+# ----------------------------------------------------------------------------------------------------------
+# An in-memory stand-in for azure.cosmos.cosmos_client.CosmosClient
+#
+# It implements the part of the client surface this project uses: databases, collections, offers,
+# documents, feeds and queries (through shared/fake_sql.py), the change feed and partition key ranges,
+# so every management operation can be run and measured without an Azure Cosmos account.
+#
+#   client = FakeCosmosClient(latency=0.002, throttle_rate=0.01, partition_count=4)
+#
+# latency        - seconds every request sleeps, to stand in for the network round trip
+# throttle_rate  - share of requests rejected with 429 (and x-ms-retry-after-ms) before they run
+#
+# Documents are placed in partition key ranges by their effective partition key (shared/routing.py), and
+# split_range(collection_link, range_id) splits a range in two: requests that still target it get 410 Gone.
+#
+# request_counts counts requests by operation, and last_response_headers carries an approximate
+# request charge based on the size of the documents read or written.
+# ----------------------------------------------------------------------------------------------------------
+
+
+class FakeQueryIterable:
+    """ Mirrors query_iterable.QueryIterable: lazy, read page by page with fetch_next_block """
+
+    def __init__(self, fetch, options):
+        self._fetch = fetch
+        self._options = dict(options or {})
+        self._continuation = self._options.get('continuation')
+        self._started = False
+
+    def fetch_next_block(self):
+        if self._started and not self._continuation:
+            return []
+        self._started = True
+        items, headers = self._fetch(dict(self._options, continuation=self._continuation))
+        self._continuation = headers.get('x-ms-continuation')
+        return items
+
+    def __iter__(self):
+        while True:
+            block = self.fetch_next_block()
+            for item in block:
+                yield item
+            if not self._continuation:
+                return
+
+
+class FakeCosmosClient:
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, partition_count=1, retry_after_ms=1, seed=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.partition_count = partition_count
+        self.retry_after_ms = retry_after_ms
+        self.request_counts = Counter()
+        self._local = threading.local()
+        self._random = random.Random(seed)
+        self._databases = OrderedDict()
+        self._offers = OrderedDict()
+        self._lock = threading.RLock()
+        self._lsn = 0
+
+    # like shared/client.ManagedCosmosClient the response headers are kept per thread
+
+    @property
+    def last_response_headers(self):
+        return getattr(self._local, 'headers', {})
+
+    @last_response_headers.setter
+    def last_response_headers(self, headers):
+        self._local.headers = headers
+
+    def close(self):
+        pass
+
+    # plumbing
+
+    def _request(self, operation):
+        with self._lock:
+            self.request_counts[operation] += 1
+            throttled = self.throttle_rate and self._random.random() < self.throttle_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            headers = {'x-ms-retry-after-ms': str(self.retry_after_ms), 'x-ms-request-charge': '0'}
+            self.last_response_headers = headers
+            raise errors.HTTPFailure(429, 'Request rate is large', headers)
+
+    def _respond(self, result, charge, continuation=None):
+        headers = {'x-ms-request-charge': str(round(charge, 2))}
+        if continuation:
+            headers['x-ms-continuation'] = continuation
+        self.last_response_headers = headers
+        return copy.deepcopy(result)
+
+    @staticmethod
+    def _fail(status_code, message):
+        raise errors.HTTPFailure(status_code, message, {'x-ms-request-charge': '1'})
+
+    @staticmethod
+    def _parts(link):
+        return link.strip('/').split('/')
+
+    @staticmethod
+    def _size_charge(documents, per_kb):
+        size = sum(len(json.dumps(doc)) for doc in documents)
+        return max(1.0, per_kb * size / 1024.0)
+
+    def _database(self, link):
+        parts = self._parts(link)
+        database = self._databases.get(parts[1]) if len(parts) >= 2 and parts[0] == 'dbs' else None
+        if database is None:
+            self._fail(404, 'Resource Not Found')
+        return database
+
+    def _container(self, link):
+        parts = self._parts(link)
+        container = self._database(link)['colls'].get(parts[3]) if len(parts) >= 4 else None
+        if container is None:
+            self._fail(404, 'Resource Not Found')
+        return container
+
+    def _page(self, items, options, charge):
+        start = int(options.get('continuation') or 0)
+        size = options.get('maxItemCount') or 100
+        if size < 0:
+            size = 1000
+        page = items[start:start + size]
+        end = start + len(page)
+        return self._respond(page, charge + self._size_charge(page, 1.0),
+                             str(end) if end < len(items) else None)
+
+    # databases
+
+    def CreateDatabase(self, database, options=None):
+        self._request('CreateDatabase')
+        with self._lock:
+            if database['id'] in self._databases:
+                self._fail(409, 'Resource with specified id already exists')
+            resource = dict(database, _rid=database['id'], _self='dbs/' + database['id'] + '/',
+                            _etag='"0"', _ts=int(time.time()))
+            self._databases[database['id']] = {'resource': resource, 'colls': OrderedDict()}
+        return self._respond(resource, 1)
+
+    def ReadDatabase(self, database_link, options=None):
+        self._request('ReadDatabase')
+        return self._respond(self._database(database_link)['resource'], 1)
+
+    def ReadDatabases(self, options=None):
+        return self.QueryDatabases('SELECT * FROM r', options)
+
+    def QueryDatabases(self, query, options=None):
+        def fetch(options):
+            self._request('QueryDatabases')
+            resources = [d['resource'] for d in list(self._databases.values())]
+            return self._page(run_query(query, resources), options, 2), self.last_response_headers
+        return FakeQueryIterable(fetch, options)
+
+    def DeleteDatabase(self, database_link, options=None):
+        self._request('DeleteDatabase')
+        with self._lock:
+            database = self._database(database_link)
+            for container in database['colls'].values():
+                self._offers.pop(container['offer']['_self'], None)
+            del self._databases[database['resource']['id']]
+        return self._respond(None, 1)
+
+    # collections
+
+    def CreateContainer(self, database_link, collection, options=None):
+        self._request('CreateContainer')
+        with self._lock:
+            database = self._database(database_link)
+            if collection['id'] in database['colls']:
+                self._fail(409, 'Resource with specified id already exists')
+            link = 'dbs/' + database['resource']['id'] + '/colls/' + collection['id']
+            resource = copy.deepcopy(collection)
+            throughput = resource.pop('offerThroughput', None) or (options or {}).get('offerThroughput') or 400
+            resource.setdefault('indexingPolicy', {'indexingMode': 'consistent', 'automatic': True})
+            resource.update(_rid=collection['id'], _self=link + '/', _etag='"0"', _ts=int(time.time()))
+            partition_count = self.partition_count if resource.get('partitionKey') else 1
+            offer = {'id': link, '_self': 'offers/' + link.replace('/', '_') + '/', 'resource': link + '/',
+                     'offerResourceId': collection['id'], 'offerVersion': 'V2',
+                     'content': {'offerThroughput': throughput}}
+            database['colls'][collection['id']] = {
+                'resource': resource, 'docs': OrderedDict(), 'offer': offer,
+                'ranges': self._ranges(partition_count), 'fractions': self._fractions(partition_count)
+            }
+            self._offers[offer['_self']] = offer
+        return self._respond(resource, 1)
+
+    def ReadContainer(self, collection_link, options=None):
+        self._request('ReadContainer')
+        return self._respond(self._container(collection_link)['resource'], 1)
+
+    def ReplaceContainer(self, collection_link, collection, options=None):
+        self._request('ReplaceContainer')
+        with self._lock:
+            container = self._container(collection_link)
+            resource = container['resource']
+            for key, value in collection.items():
+                if not key.startswith('_') and key != 'id':
+                    resource[key] = copy.deepcopy(value)
+        return self._respond(resource, 1)
+
+    def ReadContainers(self, database_link, options=None):
+        return self.QueryContainers(database_link, 'SELECT * FROM r', options)
+
+    def QueryContainers(self, database_link, query, options=None):
+        def fetch(options):
+            self._request('QueryContainers')
+            resources = [c['resource'] for c in list(self._database(database_link)['colls'].values())]
+            return self._page(run_query(query, resources), options, 2), self.last_response_headers
+        return FakeQueryIterable(fetch, options)
+
+    def DeleteContainer(self, collection_link, options=None):
+        self._request('DeleteContainer')
+        with self._lock:
+            container = self._container(collection_link)
+            self._offers.pop(container['offer']['_self'], None)
+            del self._database(collection_link)['colls'][self._parts(collection_link)[3]]
+        return self._respond(None, 1)
+
+    # offers
+
+    def ReadOffers(self, options=None):
+        return self.QueryOffers('SELECT * FROM r', options)
+
+    def QueryOffers(self, query, options=None):
+        def fetch(options):
+            self._request('QueryOffers')
+            return self._page(run_query(query, list(self._offers.values())), options, 2), self.last_response_headers
+        return FakeQueryIterable(fetch, options)
+
+    def ReplaceOffer(self, offer_link, offer):
+        self._request('ReplaceOffer')
+        with self._lock:
+            existing = self._offers.get(offer_link if offer_link.endswith('/') else offer_link + '/')
+            if existing is None:
+                self._fail(404, 'Resource Not Found')
+            existing['content'] = copy.deepcopy(offer['content'])
+        return self._respond(existing, 1)
+
+    # partition key ranges
+
+    @staticmethod
+    def _fractions(count):
+        # the share of the hash space of every range, to split it later
+        return {str(i): (i / count, (i + 1) / count) for i in range(count)}
+
+    @staticmethod
+    def _ranges(count):
+        return [{'id': str(i), 'minInclusive': hash_bound(i / count), 'maxExclusive': hash_bound((i + 1) / count),
+                 'parents': []} for i in range(count)]
+
+    def split_range(self, collection_link, range_id):
+        """ Splits a partition key range in two and returns the ids of the new ranges """
+        with self._lock:
+            container = self._container(collection_link)
+            index = next(i for i, r in enumerate(container['ranges']) if r['id'] == range_id)
+            parent = container['ranges'][index]
+            low, high = container['fractions'].pop(range_id)
+            next_id = max(int(r['id']) for r in container['ranges']) + 1
+            children = []
+            for i, (start, end) in enumerate(((low, (low + high) / 2), ((low + high) / 2, high))):
+                child_id = str(next_id + i)
+                container['fractions'][child_id] = (start, end)
+                children.append({'id': child_id, 'minInclusive': hash_bound(start), 'maxExclusive': hash_bound(end),
+                                 'parents': parent['parents'] + [range_id]})
+            container['ranges'][index:index + 1] = children
+        return [child['id'] for child in children]
+
+    @staticmethod
+    def _partition_key(container, document):
+        value = document
+        for step in container['resource']['partitionKey']['paths'][0].strip('/').split('/'):
+            value = value.get(step) if isinstance(value, dict) else None
+        return value
+
+    @staticmethod
+    def _in_partition(container, document, options):
+        if 'partitionKey' not in (options or {}) or not container['resource'].get('partitionKey'):
+            return True
+        return FakeCosmosClient._partition_key(container, document) == options['partitionKey']
+
+    @staticmethod
+    def _effective_partition_key(container, document):
+        definition = container['resource'].get('partitionKey')
+        return effective_partition_key(partition_key_of(document, definition), definition)
+
+    def _range_of(self, container, document):
+        key = self._effective_partition_key(container, document)
+        for partition_range in container['ranges']:
+            if partition_range['minInclusive'] <= key < partition_range['maxExclusive']:
+                return partition_range['id']
+        return container['ranges'][-1]['id']
+
+    def _ReadPartitionKeyRanges(self, collection_link, feed_options=None):
+        def fetch(options):
+            self._request('ReadPartitionKeyRanges')
+            return self._page(self._container(collection_link)['ranges'], options, 1), self.last_response_headers
+        return FakeQueryIterable(fetch, feed_options)
+
+    # documents
+
+    def _store(self, collection_link, document, operation, options, must_exist=None):
+        # the SDK serializes the body before it sends the request, so a document that is not JSON fails here
+        json.dumps(document)
+        self._request(operation)
+        if 'id' not in document:
+            self._fail(400, 'The input content is invalid because the required property, id, is missing')
+        with self._lock:
+            container = self._container(collection_link)
+            existing = container['docs'].get(document['id'])
+            if must_exist is True and existing is None:
+                self._fail(404, 'Resource Not Found')
+            if must_exist is False and existing is not None:
+                self._fail(409, 'Resource with specified id or name already exists')
+            self._check_condition(existing, options)
+            self._lsn += 1
+            stored = copy.deepcopy(document)
+            stored.update(_rid=document['id'], _self=collection_link.strip('/') + '/docs/' + document['id'] + '/',
+                          _etag='"{0}"'.format(self._lsn), _ts=int(time.time()), _lsn=self._lsn)
+            container['docs'].pop(document['id'], None)
+            container['docs'][document['id']] = stored
+        return self._respond(stored, self._size_charge([stored], 5.0))
+
+    @staticmethod
+    def _check_condition(existing, options):
+        condition = (options or {}).get('accessCondition')
+        if condition and condition['type'] == 'IfMatch' and (existing is None or existing['_etag'] != condition['condition']):
+            FakeCosmosClient._fail(412, 'Precondition Failed')
+
+    def CreateItem(self, database_or_Container_link, document, options=None):
+        return self._store(database_or_Container_link, document, 'CreateItem', options, must_exist=False)
+
+    def UpsertItem(self, database_or_Container_link, document, options=None):
+        return self._store(database_or_Container_link, document, 'UpsertItem', options)
+
+    def ReplaceItem(self, document_link, new_document, options=None):
+        parts = self._parts(document_link)
+        if new_document.get('id') != parts[5]:
+            self._fail(400, 'The id of the document does not match its link')
+        return self._store('/'.join(parts[:4]), new_document, 'ReplaceItem', options, must_exist=True)
+
+    def ReadItem(self, document_link, options=None):
+        self._request('ReadItem')
+        parts = self._parts(document_link)
+        container = self._container(document_link)
+        document = container['docs'].get(parts[5])
+        if document is None or not self._in_partition(container, document, options):
+            self._fail(404, 'Resource Not Found')
+        condition = (options or {}).get('accessCondition')
+        if condition and condition['type'] == 'IfNoneMatch' and condition['condition'] == document['_etag']:
+            # like the SDK, a 304 Not Modified comes back as an empty result
+            self.last_response_headers = {'x-ms-request-charge': '1', 'etag': document['_etag']}
+            return None
+        return self._respond(document, self._size_charge([document], 1.0))
+
+    def DeleteItem(self, document_link, options=None):
+        self._request('DeleteItem')
+        parts = self._parts(document_link)
+        with self._lock:
+            container = self._container(document_link)
+            existing = container['docs'].get(parts[5])
+            if existing is None:
+                self._fail(404, 'Resource Not Found')
+            self._check_condition(existing, options)
+            del container['docs'][parts[5]]
+        return self._respond(None, self._size_charge([existing], 5.0))
+
+    def _documents(self, collection_link, partition_key_range_id=None, options=None):
+        # under the lock, so that a range does not split between the check and the read
+        with self._lock:
+            container = self._container(collection_link)
+            documents = [d for d in list(container['docs'].values()) if self._in_partition(container, d, options)]
+            if partition_key_range_id is not None:
+                if all(r['id'] != partition_key_range_id for r in container['ranges']):
+                    self._fail(410, 'The partition key range is gone, it has split')
+                documents = [d for d in documents if self._range_of(container, d) == partition_key_range_id]
+        return documents
+
+    def _range_page(self, collection_link, documents, options):
+        # like the service, a range is read in effective partition key order and the continuation is the last
+        # position read, so the children of a range that split carry on from the continuation of their parent
+        container = self._container(collection_link)
+        keyed = sorted(((self._effective_partition_key(container, d), d['id']), d) for d in documents)
+        after = tuple(json.loads(options['continuation'])) if options.get('continuation') else None
+        if after is not None:
+            keyed = [(key, d) for key, d in keyed if key > after]
+        size = options.get('maxItemCount') or 100
+        if size < 0:
+            size = 1000
+        page = keyed[:size]
+        return self._respond([d for _, d in page], 1 + self._size_charge([d for _, d in page], 1.0),
+                             json.dumps(list(page[-1][0])) if len(keyed) > size else None)
+
+    def _range_query_page(self, collection_link, query, documents, options):
+        # the continuation of a query on a range is the key of its last result (ORDER BY values, effective
+        # partition key and id), so the children of a range that split carry on where their parent stopped
+        container = self._container(collection_link)
+        after = json.loads(options['continuation']) if options.get('continuation') else None
+        keyed = run_query(query, documents, lambda d: [self._effective_partition_key(container, d), d['id']], after)
+        size = options.get('maxItemCount') or 100
+        if size < 0:
+            size = 1000
+        page = keyed[:size]
+        results = [r for _, r in page]
+        return self._respond(results, 2.3 + 0.01 * len(documents) + self._size_charge(results, 1.0),
+                             json.dumps(page[-1][0]) if len(keyed) > size else None)
+
+    def QueryFeed(self, path, collection_id, query, options, partition_key_range_id=None):
+        self._request('ReadItems' if query is None else 'QueryItems')
+        documents = self._documents(collection_id, partition_key_range_id, options)
+        if query is None and partition_key_range_id is not None:
+            return self._range_page(collection_id, documents, options or {}), self.last_response_headers
+        if partition_key_range_id is not None:
+            return self._range_query_page(collection_id, query, documents, options or {}), self.last_response_headers
+        if query is None:
+            return self._page(documents, options or {}, 1), self.last_response_headers
+        results = run_query(query, documents)
+        return self._page(results, options or {}, 2.3 + 0.01 * len(documents)), self.last_response_headers
+
+    def QueryItemsChangeFeed(self, collection_link, options=None):
+        # the latest version of every document in _lsn order, the ETag of a response is the last _lsn it holds
+        def fetch(options):
+            self._request('QueryItemsChangeFeed')
+            with self._lock:
+                documents = self._documents(collection_link, options.get('partitionKeyRangeId'))
+                lsn = self._lsn
+            since = options.get('continuation')
+            if since:
+                since = int(since.strip('"'))
+            elif options.get('startFromBeginning'):
+                since = 0
+            else:
+                since = lsn
+            changes = sorted((d for d in documents if d['_lsn'] > since), key=lambda d: d['_lsn'])
+            page = changes[:options.get('maxItemCount') or 100]
+            self._respond(None, 1 + self._size_charge(page, 1.0) if page else 1)
+            self.last_response_headers['etag'] = '"{0}"'.format(page[-1]['_lsn'] if page else since)
+            return copy.deepcopy(page), self.last_response_headers
+        return FakeQueryIterable(fetch, options)
+
+    def ReadItems(self, collection_link, feed_options=None):
+        return self.QueryItems(collection_link, None, feed_options)
+
+    def QueryItems(self, database_or_Container_link, query, options=None, partition_key=None):
+        def fetch(options):
+            return self.QueryFeed(None, database_or_Container_link, query, options)
+        return FakeQueryIterable(fetch, options)
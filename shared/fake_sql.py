@@ -0,0 +1,451 @@
+import json
+import re
+
+# ----------------------------------------------------------------------------------------------------------
+# A small evaluator for the Cosmos SQL dialect used by shared/fake_client.py
+#
+# Supported - SELECT [VALUE] [TOP n] * | expressions [AS alias] FROM alias [WHERE ...] [GROUP BY ...]
+#             [ORDER BY ... [ASC|DESC]] [OFFSET n LIMIT m]
+#             comparisons (= != <> < <= > >=), AND, OR, NOT, IN (...), + - * /, condition ? a : b,
+#             @parameters, COUNT, SUM, AVG, MIN, MAX, IS_DEFINED, IS_NUMBER, ARRAY_LENGTH, ARRAY_CONTAINS,
+#             LOWER, UPPER
+#
+# As in Cosmos, a property that does not exist is undefined: comparisons with it are not true and
+# documents without an ORDER BY property are left out of the results. SUM and AVG are undefined when a
+# value they are given is not a number.
+# ----------------------------------------------------------------------------------------------------------
+
+UNDEFINED = type('Undefined', (), {'__repr__': lambda self: 'undefined', '__bool__': lambda self: False})()
+
+AGGREGATES = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<number>\d+(?:\.\d+)?)|
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|
+    (?P<param>@\w+)|
+    (?P<name>[A-Za-z_]\w*)|
+    (?P<op><>|!=|<=|>=|[=<>+\-*/(),.\[\]?:])
+)""", re.VERBOSE)
+
+_KEYWORDS = {'SELECT', 'VALUE', 'TOP', 'FROM', 'WHERE', 'GROUP', 'ORDER', 'BY', 'ASC', 'DESC', 'OFFSET', 'LIMIT',
+             'AND', 'OR', 'NOT', 'IN', 'AS', 'TRUE', 'FALSE', 'NULL'}
+
+
+class SqlError(Exception):
+    pass
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise SqlError('Unexpected character at {0}: {1}'.format(position, text[position:position + 20]))
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        elif kind == 'string':
+            value = value[1:-1].replace("\\'", "'").replace('\\"', '"')
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        tokens.append((kind, value))
+    return tokens
+
+
+def _compare(a, b, op):
+    if a is UNDEFINED or b is UNDEFINED:
+        return UNDEFINED
+    if op in ('=', '!=', '<>'):
+        equal = type(a) == type(b) and a == b or (_is_number(a) and _is_number(b) and a == b)
+        return equal if op == '=' else not equal
+    if not ((_is_number(a) and _is_number(b)) or (isinstance(a, str) and isinstance(b, str))):
+        return UNDEFINED
+    return {'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[op]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def sort_key(value):
+    """ Orders values like Cosmos does across types: undefined, null, booleans, numbers, strings """
+    if value is UNDEFINED:
+        return (0, 0)
+    if value is None:
+        return (1, 0)
+    if isinstance(value, bool):
+        return (2, value)
+    if _is_number(value):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+class _Parser:
+
+    def __init__(self, text, parameters):
+        self.tokens = _tokenize(text)
+        self.position = 0
+        self.parameters = parameters
+        self.aggregates = []
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return (None, None)
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return token
+        return None
+
+    def expect(self, kind, value=None):
+        token = self.accept(kind, value)
+        if token is None:
+            raise SqlError('Expected {0} but found {1}'.format(value or kind, self.peek()[1]))
+        return token
+
+    def parse(self):
+        query = {'top': None, 'value': False, 'select': None, 'where': None, 'group_by': [],
+                 'order_by': [], 'offset': None, 'limit': None}
+        self.expect('keyword', 'SELECT')
+        if self.accept('keyword', 'TOP'):
+            query['top'] = self.integer()
+        if self.accept('keyword', 'VALUE'):
+            query['value'] = True
+        if self.accept('op', '*'):
+            query['select'] = '*'
+        else:
+            query['select'] = []
+            while True:
+                expression, name = self.expression(), None
+                default = self.last_name if not self.last_aggregate else None
+                if self.accept('keyword', 'AS'):
+                    name = self.expect('name')[1]
+                elif self.peek()[0] == 'name':
+                    name = self.expect('name')[1]
+                query['select'].append((expression, name or default or '$' + str(len(query['select']) + 1)))
+                if not self.accept('op', ','):
+                    break
+        self.expect('keyword', 'FROM')
+        self.alias = self.expect('name')[1]
+        if self.accept('keyword', 'WHERE'):
+            query['where'] = self.expression()
+        if self.accept('keyword', 'GROUP'):
+            self.expect('keyword', 'BY')
+            query['group_by'].append(self.expression())
+            while self.accept('op', ','):
+                query['group_by'].append(self.expression())
+        if self.accept('keyword', 'ORDER'):
+            self.expect('keyword', 'BY')
+            while True:
+                expression = self.expression()
+                descending = bool(self.accept('keyword', 'DESC'))
+                if not descending:
+                    self.accept('keyword', 'ASC')
+                query['order_by'].append((expression, descending))
+                if not self.accept('op', ','):
+                    break
+        if self.accept('keyword', 'OFFSET'):
+            query['offset'] = self.integer()
+            self.expect('keyword', 'LIMIT')
+            query['limit'] = self.integer()
+        if self.peek()[0] is not None:
+            raise SqlError('Unexpected {0}'.format(self.peek()[1]))
+        query['aggregates'] = self.aggregates
+        return query
+
+    def integer(self):
+        token = self.accept('number')
+        if token:
+            return int(token[1])
+        return int(self.parameters[self.expect('param')[1]])
+
+    # expressions compile to functions of (document, aggregate values)
+
+    def expression(self):
+        self.last_name = None
+        self.last_aggregate = False
+        return self.conditional()
+
+    def conditional(self):
+        condition = self.disjunction()
+        if not self.accept('op', '?'):
+            return condition
+        when_true = self.conditional()
+        self.expect('op', ':')
+        when_false = self.conditional()
+        return lambda d: when_true(d) if condition(d) is True else when_false(d)
+
+    def disjunction(self):
+        left = self.conjunction()
+        while self.accept('keyword', 'OR'):
+            right = self.conjunction()
+            left = (lambda l, r: lambda d: l(d) is True or r(d) is True)(left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.accept('keyword', 'AND'):
+            right = self.negation()
+            left = (lambda l, r: lambda d: l(d) is True and r(d) is True)(left, right)
+        return left
+
+    def negation(self):
+        if self.accept('keyword', 'NOT'):
+            inner = self.negation()
+            return lambda d: (lambda v: UNDEFINED if v is UNDEFINED else not v)(inner(d))
+        return self.comparison()
+
+    def comparison(self):
+        left = self.additive()
+        token = self.peek()
+        if token[0] == 'op' and token[1] in ('=', '!=', '<>', '<', '<=', '>', '>='):
+            self.position += 1
+            right = self.additive()
+            return (lambda l, r, op: lambda d: _compare(l(d), r(d), op))(left, right, token[1])
+        negate = False
+        if token == ('keyword', 'NOT') and self.peek(1) == ('keyword', 'IN'):
+            self.position += 1
+            negate = True
+        if self.accept('keyword', 'IN'):
+            self.expect('op', '(')
+            values = [self.additive()]
+            while self.accept('op', ','):
+                values.append(self.additive())
+            self.expect('op', ')')
+
+            def contains(d, l=left, values=values):
+                value = l(d)
+                if value is UNDEFINED:
+                    return UNDEFINED
+                found = any(_compare(value, v(d), '=') is True for v in values)
+                return not found if negate else found
+            return contains
+        return left
+
+    def additive(self):
+        left = self.multiplicative()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('+', '-'):
+            op = self.expect('op')[1]
+            right = self.multiplicative()
+            left = (lambda l, r, op: lambda d: _arithmetic(l(d), r(d), op))(left, right, op)
+        return left
+
+    def multiplicative(self):
+        left = self.primary()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('*', '/'):
+            op = self.expect('op')[1]
+            right = self.primary()
+            left = (lambda l, r, op: lambda d: _arithmetic(l(d), r(d), op))(left, right, op)
+        return left
+
+    def primary(self):
+        kind, value = self.peek()
+        if kind in ('number', 'string'):
+            self.position += 1
+            return lambda d: value
+        if kind == 'param':
+            self.position += 1
+            if value not in self.parameters:
+                raise SqlError('Parameter {0} has no value'.format(value))
+            parameter = self.parameters[value]
+            return lambda d: parameter
+        if kind == 'keyword' and value in ('TRUE', 'FALSE', 'NULL'):
+            self.position += 1
+            constant = {'TRUE': True, 'FALSE': False, 'NULL': None}[value]
+            return lambda d: constant
+        if self.accept('op', '-'):
+            inner = self.primary()
+            return lambda d: _arithmetic(0, inner(d), '-')
+        if self.accept('op', '('):
+            inner = self.conditional()
+            self.expect('op', ')')
+            return inner
+        if kind == 'name' and self.peek(1) == ('op', '('):
+            return self.function()
+        if kind == 'name':
+            return self.path()
+        raise SqlError('Unexpected {0}'.format(value))
+
+    def path(self):
+        root = self.expect('name')[1]
+        steps = []
+        while True:
+            if self.accept('op', '.'):
+                steps.append(self.expect('name')[1])
+            elif self.accept('op', '['):
+                kind, value = self.peek()
+                self.position += 1
+                steps.append(value if kind in ('string', 'number') else self.parameters[value])
+                self.expect('op', ']')
+            else:
+                break
+        self.last_name = str(steps[-1]) if steps else root
+
+        def resolve(d):
+            value = d[0]
+            for step in steps:
+                if isinstance(value, dict) and isinstance(step, str) and step in value:
+                    value = value[step]
+                elif isinstance(value, list) and isinstance(step, int) and step < len(value):
+                    value = value[step]
+                else:
+                    return UNDEFINED
+            return value
+        return resolve
+
+    def function(self):
+        name = self.expect('name')[1].upper()
+        self.expect('op', '(')
+        arguments = []
+        if not self.accept('op', ')'):
+            arguments.append(self.conditional())
+            while self.accept('op', ','):
+                arguments.append(self.conditional())
+            self.expect('op', ')')
+        if name in AGGREGATES:
+            self.last_aggregate = True
+            aggregate = _Aggregate(name, arguments[0] if arguments else (lambda d: 1), len(self.aggregates))
+            self.aggregates.append(aggregate)
+            return aggregate
+        functions = {
+            'IS_DEFINED': lambda a: a is not UNDEFINED,
+            'IS_NUMBER': _is_number,
+            'ARRAY_LENGTH': lambda a: len(a) if isinstance(a, list) else UNDEFINED,
+            'ARRAY_CONTAINS': lambda a, b: isinstance(a, list) and b in a,
+            'LOWER': lambda a: a.lower() if isinstance(a, str) else UNDEFINED,
+            'UPPER': lambda a: a.upper() if isinstance(a, str) else UNDEFINED,
+        }
+        if name not in functions:
+            raise SqlError('Function {0} is not supported'.format(name))
+        function = functions[name]
+        return lambda d: function(*[a(d) for a in arguments])
+
+
+class _Aggregate:
+    """ An aggregate in a SELECT list. Called with (document, values) it returns its computed value. """
+
+    def __init__(self, name, argument, index):
+        self.name = name
+        self.argument = argument
+        self.index = index
+
+    def __call__(self, d):
+        return d[1][self.index] if d[1] is not None else UNDEFINED
+
+    def compute(self, documents):
+        values = [self.argument((doc, None)) for doc in documents]
+        values = [v for v in values if v is not UNDEFINED]
+        if self.name == 'COUNT':
+            return len(values)
+        numbers = [v for v in values if _is_number(v)]
+        if self.name in ('SUM', 'AVG') and len(numbers) < len(values):
+            return UNDEFINED
+        if self.name == 'SUM':
+            return sum(numbers)
+        if self.name == 'AVG':
+            return sum(numbers) / len(numbers) if numbers else UNDEFINED
+        comparable = sorted(values, key=sort_key)
+        if not comparable:
+            return UNDEFINED
+        return comparable[0] if self.name == 'MIN' else comparable[-1]
+
+
+def _arithmetic(a, b, op):
+    if not (_is_number(a) and _is_number(b)):
+        return UNDEFINED
+    if op == '/':
+        return a / b if b else UNDEFINED
+    return {'+': a + b, '-': a - b, '*': a * b}[op]
+
+
+def run_query(query, documents, position=None, after=None):
+    """ Runs query (a string or a {'query': ..., 'parameters': [...]} dict) over an iterable of documents.
+
+    With position(document), a key such as the document's place in its partition key range, the results are
+    returned as (key, result) pairs. The key orders the results the way the query does, the ORDER BY values
+    first and position to break ties. Only the results after the key after are returned, which is how the
+    service resumes a query from its continuation, also in the children of a range that split. """
+    if isinstance(query, dict):
+        text = query['query']
+        parameters = {p['name']: p['value'] for p in query.get('parameters', [])}
+    else:
+        text, parameters = query, {}
+    parsed = _Parser(text, parameters).parse()
+
+    rows = [doc for doc in documents if parsed['where'] is None or parsed['where']((doc, None)) is True]
+
+    if parsed['aggregates'] or parsed['group_by']:
+        results = _grouped(parsed, rows)
+        if position is None:
+            return results
+        return [([i], r) for i, r in enumerate(results) if after is None or i > after[0]]
+
+    if position is not None:
+        rows.sort(key=position)
+    for expression, descending in reversed(parsed['order_by']):
+        rows = [doc for doc in rows if expression((doc, None)) is not UNDEFINED]
+        rows.sort(key=lambda doc: sort_key(expression((doc, None))), reverse=descending)
+
+    if parsed['offset'] is not None:
+        rows = rows[parsed['offset']:parsed['offset'] + parsed['limit']]
+    if parsed['top'] is not None:
+        rows = rows[:parsed['top']]
+    if position is None:
+        return [_project(parsed, doc, None) for doc in rows]
+
+    directions = [descending for _, descending in parsed['order_by']] + [False]
+    results = []
+    for doc in rows:
+        # the JSON round trip makes the keys compare like the ones read back from a continuation
+        key = json.loads(json.dumps([sort_key(e((doc, None))) for e, _ in parsed['order_by']] + [position(doc)]))
+        if after is None or _follows(key, after, directions):
+            results.append((key, _project(parsed, doc, None)))
+    return results
+
+
+def _follows(key, after, directions):
+    for k, a, descending in zip(key, after, directions):
+        if k != a:
+            return (k < a) if descending else (k > a)
+    return False
+
+
+def _grouped(parsed, rows):
+    groups = {}
+    for doc in rows:
+        key = tuple(repr(g((doc, None))) for g in parsed['group_by'])
+        groups.setdefault(key, []).append(doc)
+    if not parsed['group_by'] and not groups:
+        groups[()] = []
+
+    results = []
+    for documents in groups.values():
+        values = [aggregate.compute(documents) for aggregate in parsed['aggregates']]
+        first = documents[0] if documents else {}
+        results.append(_project(parsed, first, values))
+    if parsed['top'] is not None:
+        results = results[:parsed['top']]
+    return results
+
+
+def _project(parsed, doc, values):
+    if parsed['select'] == '*':
+        return doc
+    if parsed['value']:
+        value = parsed['select'][0][0]((doc, values))
+        return None if value is UNDEFINED else value
+    result = {}
+    for expression, name in parsed['select']:
+        value = expression((doc, values))
+        if value is not UNDEFINED:
+            result[name] = value
+    return result
@@ -0,0 +1,151 @@
+import bisect
+import datetime
+import itertools
+import json
+import random
+import string
+
+# ----------------------------------------------------------------------------------------------------------
+# Synthetic sales orders - the V1 and V2 documents of DocumentManagement.GetSalesOrder/GetSalesOrderV2,
+# with realistic variation, made a batch at a time
+#
+#   generator = SalesOrderGenerator(accounts=10000, skew=1.1, items=(1, 12), document_size=2048, v2_share=0.5)
+#   for batch in generator.batches(count=1000000, batch_size=10000):
+#       BulkManagement.upsert_documents(client, 'pysamples', 'data', batch)
+#
+# accounts      - number of distinct account_number values, the partition key of the samples
+# skew          - Zipf exponent of the account of an order: 0 spreads the orders evenly over the accounts,
+#                 around 1 a few hot accounts get most of them, as with real customers
+# items         - (fewest, most) order lines per order
+# document_size - pads the orders with a notes property to about this many bytes of JSON
+# v2_share      - share of the orders in the V2 shape (denormalised product details, due/shipped dates)
+#
+# Like NumPy code a batch is built column by column: every property of the batch is drawn in one call
+# (random.choices over precomputed cumulative weights, catalogues of products and formatted dates) and the
+# columns are then zipped into documents, instead of drawing the properties of one order at a time.
+# The same seed gives the same documents.
+# ----------------------------------------------------------------------------------------------------------
+
+_EPOCH = datetime.date(2005, 1, 1)
+_DAYS = 3 * 365
+_TTL = 60 * 60 * 24 * 30
+
+
+class SalesOrderGenerator:
+
+    def __init__(self, accounts=1000, skew=0.0, items=(1, 5), document_size=None, v2_share=0.0, products=500,
+                 id_prefix='SalesOrder', start=0, seed=None):
+        if items[0] < 1 or items[1] < items[0]:
+            raise ValueError('items is (fewest, most) order lines, with 1 <= fewest <= most')
+        self.accounts = ['Account{0}'.format(n) for n in range(1, accounts + 1)]
+        self.items = items
+        self.document_size = document_size
+        self.v2_share = v2_share
+        self.id_prefix = id_prefix
+        self._next = start
+        self._random = random.Random(seed)
+        # Zipf weights by account rank, kept cumulative so every draw is a bisect
+        self._account_weights = list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, accounts + 1)))
+        self._dates = [(_EPOCH + datetime.timedelta(days=day)).strftime('%c') for day in range(_DAYS + 30)]
+        self._products = [{
+            'product_id': 100 + n,
+            'product_code': '{0}-{1:03d}'.format(string.ascii_uppercase[n % 26], n),
+            'product_name': 'Product {0}'.format(n + 1),
+            'unit_price': round(self._random.uniform(1.0, 500.0), 4)
+        } for n in range(products)]
+        self._filler = ''.join(self._random.choice(string.ascii_letters + ' ') for _ in range(65536))
+
+    def _draw_accounts(self, size):
+        total = self._account_weights[-1]
+        return [self.accounts[bisect.bisect_left(self._account_weights, self._random.random() * total)]
+                for _ in range(size)]
+
+    def account(self):
+        """ An account_number drawn as skewed as the accounts of the orders """
+        return self._draw_accounts(1)[0]
+
+    def _lines(self, count, v2):
+        rng = self._random
+        products = rng.choices(self._products, k=count)
+        quantities = rng.choices(range(1, 11), k=count)
+        lines = []
+        for product, quantity in zip(products, quantities):
+            line_price = round(product['unit_price'] * quantity, 4)
+            if v2:
+                lines.append({'order_qty': quantity, 'product_code': product['product_code'],
+                              'product_name': product['product_name'], 'currency_symbol': '$',
+                              'currecny_code': 'USD', 'unit_price': product['unit_price'], 'line_price': line_price})
+            else:
+                lines.append({'order_qty': quantity, 'product_id': product['product_id'],
+                              'unit_price': product['unit_price'], 'line_price': line_price})
+        return lines
+
+    def batch(self, size):
+        """ Returns the next size orders """
+        rng = self._random
+        ids = ['{0}{1}'.format(self.id_prefix, n) for n in range(self._next, self._next + size)]
+        self._next += size
+        accounts = self._draw_accounts(size)
+        counts = rng.choices(range(self.items[0], self.items[1] + 1), k=size)
+        days = rng.choices(range(_DAYS), k=size)
+        v2 = [x < self.v2_share for x in (rng.random() for _ in range(size))]
+        freight = [round(rng.uniform(5.0, 500.0), 4) for _ in range(size)]
+        purchase_orders = ['PO{0:011d}'.format(n) for n in rng.choices(range(10 ** 11), k=size)]
+
+        # the order lines of the whole batch are drawn at once and then cut up per order
+        v1_lines = self._lines(sum(c for c, is_v2 in zip(counts, v2) if not is_v2), False)
+        v2_lines = self._lines(sum(c for c, is_v2 in zip(counts, v2) if is_v2), True)
+        v1_at = v2_at = 0
+
+        orders = []
+        for doc_id, account, count, day, is_v2, freight_amount, purchase_order in zip(
+                ids, accounts, counts, days, v2, freight, purchase_orders):
+            if is_v2:
+                lines, v2_at = v2_lines[v2_at:v2_at + count], v2_at + count
+            else:
+                lines, v1_at = v1_lines[v1_at:v1_at + count], v1_at + count
+            subtotal = round(sum(line['line_price'] for line in lines), 4)
+            tax = round(subtotal * 0.08, 4)
+            order = {'id': doc_id, 'account_number': account, 'purchase_order_number': purchase_order,
+                     'order_date': self._dates[day]}
+            if is_v2:
+                discount = round(subtotal * 0.05, 4) if count > 5 else 0.0
+                order.update(due_date=self._dates[day + 10], shipped_date=self._dates[day + 4], subtotal=subtotal,
+                             tax_amount=tax, freight=freight_amount, discount_amt=discount,
+                             total_due=round(subtotal + tax + freight_amount - discount, 4))
+            else:
+                order.update(subtotal=subtotal, tax_amount=tax, freight=freight_amount,
+                             total_due=round(subtotal + tax + freight_amount, 4))
+            order['items'] = lines
+            order['ttl'] = _TTL
+            orders.append(order)
+
+        if self.document_size:
+            self._pad(orders)
+        return orders
+
+    def _pad(self, orders):
+        # the JSON size of an order is about a fixed part plus a part per order line, both measured on a
+        # few orders of the batch rather than serialising every one of them
+        sample = orders[:32]
+        per_line = sum(len(json.dumps(line)) + 2 for o in sample for line in o['items']) / \
+            max(1, sum(len(o['items']) for o in sample))
+        fixed = sum(len(json.dumps(o)) - per_line * len(o['items']) for o in sample) / len(sample)
+        # ', "notes": ""' adds 13 bytes around the filler
+        for order in orders:
+            missing = int(self.document_size - fixed - per_line * len(order['items']) - 13)
+            if missing > 0:
+                start = self._random.randrange(len(self._filler) - min(missing, len(self._filler)) + 1)
+                order['notes'] = self._filler[start:start + missing]
+
+    def batches(self, count, batch_size=10000):
+        """ Yields count orders in batches of up to batch_size """
+        while count > 0:
+            size = min(batch_size, count)
+            count -= size
+            yield self.batch(size)
+
+    def __iter__(self):
+        while True:
+            for order in self.batch(1000):
+                yield order
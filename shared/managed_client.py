@@ -0,0 +1,69 @@
+import azure.cosmos.cosmos_client as cosmos_client
+import azure.cosmos.documents as documents
+import socket
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+import shared.config as cfg
+
+# ----------------------------------------------------------------------------------------------------------
+# ManagedCosmosClient is a CosmosClient whose HTTP connection pool holds pool_size connections with TCP
+# keep-alive. The client's last_response_headers is kept per thread, so concurrent requests on the shared
+# client each see the headers (continuation, request charge) of their own response.
+#
+# Importing this module loads the SDK and requests, shared/client.py only imports it when the first client
+# is created.
+# ----------------------------------------------------------------------------------------------------------
+
+POOL_SIZE = cfg.settings['connection_pool_size']
+KEEP_ALIVE = cfg.settings['connection_keep_alive']
+
+
+class _PoolAdapter(HTTPAdapter):
+    """ An HTTPAdapter with pool_size connections per host and, optionally, TCP keep-alive probes """
+
+    def __init__(self, pool_size, keep_alive, max_retries=None):
+        self.keep_alive = keep_alive
+        if max_retries is None:
+            super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+        else:
+            super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keep_alive:
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
+
+
+class ManagedCosmosClient(cosmos_client.CosmosClient):
+
+    def __init__(self, url_connection, auth, connection_policy=None,
+                 consistency_level=documents.ConsistencyLevel.Session, pool_size=POOL_SIZE, keep_alive=KEEP_ALIVE):
+        self._local = threading.local()
+        self.closed = False
+        super().__init__(url_connection, auth, connection_policy, consistency_level)
+
+        adapter = _PoolAdapter(pool_size, keep_alive, self.connection_policy.ConnectionRetryConfiguration)
+        self._requests_session.mount('http://', adapter)
+        self._requests_session.mount('https://', adapter)
+
+    @property
+    def last_response_headers(self):
+        return getattr(self._local, 'headers', None)
+
+    @last_response_headers.setter
+    def last_response_headers(self, headers):
+        self._local.headers = headers
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._requests_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
@@ -0,0 +1,166 @@
+import json
+import threading
+from collections import deque
+
+# ----------------------------------------------------------------------------------------------------------
+# Request metrics - shared/throttling.run records every request made by the management classes
+#
+# Each request is recorded with its operation (eg. ReadItem), the resource it targeted, the status code,
+# the request charge (RUs) and the latency. Per operation and collection the totals, a latency histogram
+# and the p50/p95/p99 of the most recent requests are kept.
+#
+# metrics.snapshot() returns them as a dictionary (metrics.to_json() as JSON) and metrics.to_prometheus()
+# in the Prometheus text exposition format.
+# ----------------------------------------------------------------------------------------------------------
+
+# upper bounds in seconds of the Prometheus latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# percentiles are computed over this many of the most recent requests
+SAMPLE_SIZE = 2048
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+class OperationStats:
+    """ The totals of one operation on one resource """
+
+    def __init__(self):
+        self.count = 0
+        self.status_codes = {}
+        self.request_charge = 0.0
+        self.latency = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.latencies = deque(maxlen=SAMPLE_SIZE)
+        self.charges = deque(maxlen=SAMPLE_SIZE)
+
+    def add(self, status_code, request_charge, latency):
+        self.count += 1
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+        self.request_charge += request_charge
+        self.latency += latency
+        self.latencies.append(latency)
+        self.charges.append(request_charge)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+
+    def summary(self):
+        latencies = list(self.latencies)
+        charges = list(self.charges)
+        return {
+            'count': self.count,
+            'status_codes': {str(k): v for k, v in self.status_codes.items()},
+            'throttled': self.status_codes.get(429, 0),
+            'request_charge': round(self.request_charge, 2),
+            'latency': {
+                'mean': self.latency / self.count if self.count else 0.0,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99)
+            },
+            'request_charge_per_request': {
+                'p50': percentile(charges, 50),
+                'p95': percentile(charges, 95),
+                'p99': percentile(charges, 99)
+            }
+        }
+
+
+class Metrics:
+
+    def __init__(self):
+        self._stats = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def record(self, operation, link, status_code, request_charge, latency):
+        """ Records one request. link is the resource link the request targeted. """
+        resource = _resource(link)
+        with self._lock:
+            stats = self._stats.get((operation, resource))
+            if stats is None:
+                stats = self._stats[(operation, resource)] = OperationStats()
+            stats.add(status_code, request_charge, latency)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(operation, link, status_code, request_charge, latency)
+
+    def add_listener(self, listener):
+        """ listener(operation, link, status_code, request_charge, latency) is called for every request """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """ Returns { operation: { resource: summary } } """
+        with self._lock:
+            stats = [(operation, resource, s.summary()) for (operation, resource), s in self._stats.items()]
+        result = {}
+        for operation, resource, summary in sorted(stats):
+            result.setdefault(operation, {})[resource] = summary
+        return result
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        lines = [
+            '# HELP cosmos_requests_total Requests sent to Azure Cosmos.',
+            '# TYPE cosmos_requests_total counter'
+        ]
+        with self._lock:
+            stats = sorted(self._stats.items())
+            for (operation, resource), s in stats:
+                for status_code, count in sorted(s.status_codes.items(), key=lambda i: str(i[0])):
+                    lines.append('cosmos_requests_total{{{0},status="{1}"}} {2}'.format(
+                        _labels(operation, resource), status_code, count))
+
+            lines.append('# HELP cosmos_request_charge_total Request units consumed.')
+            lines.append('# TYPE cosmos_request_charge_total counter')
+            for (operation, resource), s in stats:
+                lines.append('cosmos_request_charge_total{{{0}}} {1}'.format(
+                    _labels(operation, resource), round(s.request_charge, 2)))
+
+            lines.append('# HELP cosmos_request_latency_seconds Request latency.')
+            lines.append('# TYPE cosmos_request_latency_seconds histogram')
+            for (operation, resource), s in stats:
+                labels = _labels(operation, resource)
+                for bound, count in zip(LATENCY_BUCKETS, s.buckets):
+                    lines.append('cosmos_request_latency_seconds_bucket{{{0},le="{1}"}} {2}'.format(labels, bound, count))
+                lines.append('cosmos_request_latency_seconds_bucket{{{0},le="+Inf"}} {1}'.format(labels, s.count))
+                lines.append('cosmos_request_latency_seconds_sum{{{0}}} {1}'.format(labels, s.latency))
+                lines.append('cosmos_request_latency_seconds_count{{{0}}} {1}'.format(labels, s.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """ Writes the Prometheus text format for a .prom file, otherwise the JSON snapshot """
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+
+def _resource(link):
+    # documents are aggregated per collection, so one metric series does not exist per document id
+    parts = (link or '').strip('/').split('/')
+    if len(parts) > 4 and parts[0] == 'dbs' and parts[2] == 'colls':
+        return '/'.join(parts[:4])
+    return '/'.join(parts)
+
+
+def _labels(operation, resource):
+    return 'operation="{0}",resource="{1}"'.format(operation, resource.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+metrics = Metrics()
@@ -0,0 +1,18 @@
+# ----------------------------------------------------------------------------------------------------------
+# Cosmos value order - how ORDER BY, MIN and MAX compare values of different types
+#
+#   sorted(values, key=order_key)
+#
+# Cosmos orders null before booleans, booleans before numbers and numbers before strings. The merges of
+# QueryManagement.py and AggregationManagement.py compare the results of the partition key ranges with it.
+# ----------------------------------------------------------------------------------------------------------
+
+
+def order_key(value):
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    return (3, str(value))
@@ -0,0 +1,283 @@
+import bisect
+import struct
+
+import shared.config as cfg
+from shared.cache import ResourceCache
+from shared.throttling import account_of, execute
+
+# ----------------------------------------------------------------------------------------------------------
+# Partition key routing - which partition key range holds a partition key, worked out on the client
+#
+# A collection's documents are spread over partition key ranges by the effective partition key (EPK) of
+# their partition key value: a hash of the value, hex encoded, that falls into exactly one range's
+# [minInclusive, maxExclusive). effective_partition_key computes it the way the service does, for hash
+# partitioning version 1 (32 bit MurmurHash3, the default) and version 2 (128 bit MurmurHash3).
+#
+#   routing_map = routing.get(client, 'dbs/pysamples/colls/data')
+#   routing_map.range_for('Account1')['id']           # the range of a partition key value
+#   routing_map.range_of(document)['id']              # the range of a document
+#
+# The partition key definition and the ranges of every collection are read once (ReadContainer and
+# ReadPartitionKeyRanges) and cached for 'routing_map_ttl' seconds, per account. A range that splits answers 410 Gone;
+# the requests that target ranges then call routing.invalidate, and routing.children returns the ranges
+# that replaced a split one.
+# ----------------------------------------------------------------------------------------------------------
+
+MAX_EPK = 'FF'
+
+# partition key component markers of the service's binary encoding
+_UNDEFINED, _NULL, _FALSE, _TRUE, _NUMBER, _STRING = 0x00, 0x01, 0x02, 0x03, 0x05, 0x08
+
+# version 1 hashes and encodes at most this many characters of a string
+_MAX_STRING_CHARS = 100
+_MAX_STRING_BYTES = 100
+
+_MASK_32 = 0xFFFFFFFF
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+class Undefined:
+    """ The partition key of a document that does not have the partition key property """
+
+
+def murmurhash3_32(data, seed=0):
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    h1 = seed
+    end = len(data) & ~3
+    for i in range(0, end, 4):
+        k1 = data[i] | data[i + 1] << 8 | data[i + 2] << 16 | data[i + 3] << 24
+        k1 = (k1 * c1) & _MASK_32
+        k1 = ((k1 << 15) | (k1 >> 17)) & _MASK_32
+        h1 ^= (k1 * c2) & _MASK_32
+        h1 = ((h1 << 13) | (h1 >> 19)) & _MASK_32
+        h1 = (h1 * 5 + 0xe6546b64) & _MASK_32
+
+    k1 = 0
+    tail = len(data) & 3
+    if tail == 3:
+        k1 ^= data[end + 2] << 16
+    if tail >= 2:
+        k1 ^= data[end + 1] << 8
+    if tail >= 1:
+        k1 ^= data[end]
+        k1 = (k1 * c1) & _MASK_32
+        k1 = ((k1 << 15) | (k1 >> 17)) & _MASK_32
+        h1 ^= (k1 * c2) & _MASK_32
+
+    h1 ^= len(data)
+    h1 ^= h1 >> 16
+    h1 = (h1 * 0x85ebca6b) & _MASK_32
+    h1 ^= h1 >> 13
+    h1 = (h1 * 0xc2b2ae35) & _MASK_32
+    return h1 ^ (h1 >> 16)
+
+
+def _rotl64(value, bits):
+    return ((value << bits) | (value >> (64 - bits))) & _MASK_64
+
+
+def _fmix64(k):
+    k ^= k >> 33
+    k = (k * 0xff51afd7ed558ccd) & _MASK_64
+    k ^= k >> 33
+    k = (k * 0xc4ceb9fe1a85ec53) & _MASK_64
+    return k ^ (k >> 33)
+
+
+def murmurhash3_128(data, seed=0):
+    """ The x64 variant, returns (h1, h2) """
+    c1, c2 = 0x87c37b91114253d5, 0x4cf5ad432745937f
+    h1 = h2 = seed
+    end = len(data) - len(data) % 16
+    for i in range(0, end, 16):
+        k1 = int.from_bytes(data[i:i + 8], 'little')
+        k2 = int.from_bytes(data[i + 8:i + 16], 'little')
+        h1 ^= (_rotl64((k1 * c1) & _MASK_64, 31) * c2) & _MASK_64
+        h1 = (_rotl64(h1, 27) + h2) & _MASK_64
+        h1 = (h1 * 5 + 0x52dce729) & _MASK_64
+        h2 ^= (_rotl64((k2 * c2) & _MASK_64, 33) * c1) & _MASK_64
+        h2 = (_rotl64(h2, 31) + h1) & _MASK_64
+        h2 = (h2 * 5 + 0x38495ab5) & _MASK_64
+
+    tail = data[end:]
+    if len(tail) > 8:
+        k2 = int.from_bytes(tail[8:], 'little')
+        h2 ^= (_rotl64((k2 * c2) & _MASK_64, 33) * c1) & _MASK_64
+    if tail:
+        k1 = int.from_bytes(tail[:8], 'little')
+        h1 ^= (_rotl64((k1 * c1) & _MASK_64, 31) * c2) & _MASK_64
+
+    h1 ^= len(data)
+    h2 ^= len(data)
+    h1 = (h1 + h2) & _MASK_64
+    h2 = (h2 + h1) & _MASK_64
+    h1, h2 = _fmix64(h1), _fmix64(h2)
+    h1 = (h1 + h2) & _MASK_64
+    return h1, (h2 + h1) & _MASK_64
+
+
+def _write_for_hashing(value, buffer, string_terminator):
+    if value is Undefined:
+        buffer.append(_UNDEFINED)
+    elif value is None:
+        buffer.append(_NULL)
+    elif value is True or value is False:
+        buffer.append(_TRUE if value else _FALSE)
+    elif isinstance(value, (int, float)):
+        buffer.append(_NUMBER)
+        buffer.extend(struct.pack('<d', float(value)))
+    elif isinstance(value, str):
+        buffer.append(_STRING)
+        buffer.extend(value.encode('utf-8'))
+        buffer.append(string_terminator)
+    else:
+        raise TypeError('A partition key is a string, number, boolean or null, not {0}'.format(type(value).__name__))
+
+
+def _write_for_binary_encoding(value, buffer):
+    if isinstance(value, str):
+        buffer.append(_STRING)
+        encoded = value.encode('utf-8')
+        short = len(encoded) <= _MAX_STRING_BYTES
+        # every byte is shifted up by one, so that the terminating 0 sorts before any character
+        for byte in encoded[:len(encoded) if short else _MAX_STRING_BYTES + 1]:
+            buffer.append(byte + 1 if byte < 0xFF else byte)
+        if short:
+            buffer.append(0x00)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        buffer.append(_NUMBER)
+        payload = struct.unpack('<Q', struct.pack('<d', float(value)))[0]
+        # flipped so that the encoded doubles sort in numeric order
+        payload = payload ^ 0x8000000000000000 if payload < 0x8000000000000000 else (~payload + 1) & _MASK_64
+        buffer.append(payload >> 56)
+        payload = (payload << 8) & _MASK_64
+        byte = 0
+        first = True
+        while first or payload:
+            if not first:
+                buffer.append(byte)
+            first = False
+            # 7 bits per byte, the low bit marks the bytes that are followed by another one
+            byte = ((payload >> 56) | 0x01) & 0xFF
+            payload = (payload << 7) & _MASK_64
+        buffer.append(byte & 0xFE)
+    else:
+        _write_for_hashing(value, buffer, 0x00)
+
+
+def effective_partition_key(value, definition):
+    """ The EPK of a partition key value under a collection's partition key definition, a hex string """
+    if not definition or not definition.get('paths'):
+        return ''
+    components = [value]
+
+    if definition.get('version', 1) == 2:
+        buffer = bytearray()
+        for component in components:
+            _write_for_hashing(component, buffer, 0xFF)
+        h1, h2 = murmurhash3_128(bytes(buffer))
+        hashed = bytearray(h1.to_bytes(8, 'little') + h2.to_bytes(8, 'little'))
+        hashed.reverse()
+        # the top bits are cleared so that every EPK sorts below the maximum, FF
+        hashed[0] &= 0x3F
+        return hashed.hex().upper()
+
+    components = [c[:_MAX_STRING_CHARS] if isinstance(c, str) else c for c in components]
+    buffer = bytearray()
+    for component in components:
+        _write_for_hashing(component, buffer, 0x00)
+    encoded = bytearray()
+    _write_for_binary_encoding(float(murmurhash3_32(bytes(buffer))), encoded)
+    for component in components:
+        _write_for_binary_encoding(component, encoded)
+    return encoded.hex().upper()
+
+
+def hash_bound(fraction):
+    """ The EPK at a fraction (0 to 1) of the version 1 hash space, eg. to split it into even ranges """
+    if fraction <= 0:
+        return ''
+    if fraction >= 1:
+        return MAX_EPK
+    encoded = bytearray()
+    _write_for_binary_encoding(float(int(fraction * 2 ** 32)), encoded)
+    return encoded.hex().upper()
+
+
+def partition_key_of(document, definition):
+    """ The partition key value of a document, Undefined when it does not have the property """
+    if not definition or not definition.get('paths'):
+        return None
+    value = document
+    for step in definition['paths'][0].strip('/').split('/'):
+        if not isinstance(value, dict) or step not in value:
+            return Undefined
+        value = value[step]
+    return value
+
+
+class RoutingMap:
+    """ The partition key definition and the partition key ranges of one collection """
+
+    def __init__(self, definition, ranges):
+        self.definition = definition or None
+        self.ranges = sorted(ranges, key=lambda r: r['minInclusive'])
+        self._bounds = [r['minInclusive'] for r in self.ranges]
+        self._by_id = {r['id']: r for r in self.ranges}
+
+    @property
+    def partitioned(self):
+        return bool(self.definition and self.definition.get('paths'))
+
+    def get(self, range_id):
+        return self._by_id.get(range_id)
+
+    def range_for(self, partition_key):
+        key = effective_partition_key(partition_key, self.definition)
+        return self.ranges[max(0, bisect.bisect_right(self._bounds, key) - 1)]
+
+    def range_of(self, document):
+        return self.range_for(partition_key_of(document, self.definition))
+
+    def overlapping(self, min_inclusive, max_exclusive):
+        return [r for r in self.ranges if r['minInclusive'] < max_exclusive and min_inclusive < r['maxExclusive']]
+
+
+class PartitionKeyRouter:
+    """ Caches a RoutingMap per collection link """
+
+    def __init__(self, ttl, max_entries):
+        self._maps = ResourceCache(ttl, max_entries)
+
+    @staticmethod
+    def _key(client, collection_link):
+        # collections with the same link on two accounts, eg. the source and target of a copy, differ
+        return '{0}#{1}'.format(account_of(client), collection_link.strip('/'))
+
+    def get(self, client, collection_link):
+        routing_map = self._maps.get(self._key(client, collection_link))
+        return routing_map if routing_map is not None else self.refresh(client, collection_link)
+
+    def refresh(self, client, collection_link):
+        collection = execute(client, 'ReadContainer', collection_link)
+        ranges = execute(client, '_ReadPartitionKeyRanges', collection_link)
+        routing_map = RoutingMap(collection.get('partitionKey'), ranges)
+        self._maps.put(self._key(client, collection_link), routing_map)
+        return routing_map
+
+    def invalidate(self, client, collection_link):
+        self._maps.invalidate(self._key(client, collection_link))
+
+    def children(self, client, collection_link, range_id):
+        """ The ranges that replaced range_id after it split, read fresh from the service """
+        previous = self._maps.get(self._key(client, collection_link))
+        gone = previous.get(range_id) if previous is not None else None
+        routing_map = self.refresh(client, collection_link)
+        if routing_map.get(range_id) is not None:
+            return [routing_map.get(range_id)]
+        if gone is not None:
+            return routing_map.overlapping(gone['minInclusive'], gone['maxExclusive'])
+        return [r for r in routing_map.ranges if range_id in (r.get('parents') or [])]
+
+
+routing = PartitionKeyRouter(cfg.settings['routing_map_ttl'], cfg.settings['metadata_cache_size'])
@@ -0,0 +1,204 @@
+import azure.cosmos.documents as documents
+import azure.cosmos.errors as errors
+import azure.cosmos.retry_options as retry_options
+import random
+import threading
+import time
+
+import shared.config as cfg
+from shared.metrics import metrics
+
+# ----------------------------------------------------------------------------------------------------------
+# Throttling - every client call made by the management classes goes through execute (or run)
+#
+# Retry - a request rejected with 429 (too many requests), 449 (retry with) or 503 (service unavailable)
+#    is retried. The wait is the retry-after the server sent back (x-ms-retry-after-ms) or, when there is
+#    none, a jittered exponential backoff.
+#
+# Rate limit - a token bucket per collection paces requests to a target RU/s. Each response pays its
+#    request charge out of the bucket, and the next request to that collection waits until the bucket is
+#    refilled, so bulk jobs stay just under the provisioned throughput instead of hitting the ceiling.
+#    A limit set for one client's account (set_rate_limit(link, ru, client)) leaves a collection with the
+#    same link on another account alone, eg. the source and the target of a copy between accounts.
+#
+# Metrics - every attempt, including the throttled ones, is recorded in shared/metrics.py with its
+#    status code, request charge and latency.
+# ----------------------------------------------------------------------------------------------------------
+
+RETRY_STATUS_CODES = (429, 449, 503)
+
+
+class RetryPolicy:
+    """ Decides how long to wait before retrying a throttled request. """
+
+    def __init__(self, max_attempts, base_delay, max_delay):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, attempt, error):
+        return error.status_code in RETRY_STATUS_CODES and attempt < self.max_attempts
+
+    def delay(self, attempt, error):
+        retry_after = error.headers.get('x-ms-retry-after-ms')
+        if retry_after:
+            # a little jitter keeps concurrent writers from retrying at the same instant
+            return float(retry_after) / 1000 * random.uniform(1.0, 1.2)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class RateLimiter:
+    """ A token bucket holding request units. Requests wait while the balance is negative and
+    every response subtracts its request charge, so the long run rate stays at ru_per_second. """
+
+    def __init__(self, ru_per_second):
+        self.ru_per_second = float(ru_per_second)
+        self._balance = self.ru_per_second
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        # at most one second worth of request units can be saved up for a burst
+        self._balance = min(self.ru_per_second, self._balance + (now - self._updated) * self.ru_per_second)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._balance > 0:
+                    return
+                wait = -self._balance / self.ru_per_second
+            time.sleep(wait)
+
+    def consume(self, request_charge):
+        with self._lock:
+            self._refill()
+            self._balance -= request_charge
+
+
+retry_policy = RetryPolicy(cfg.settings['retry_max_attempts'], cfg.settings['retry_base_delay'],
+                           cfg.settings['retry_max_delay'])
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def collection_link(link):
+    """ Returns the collection a resource link belongs to, eg. dbs/Foo/colls/Bar for dbs/Foo/colls/Bar/docs/1 """
+    parts = link.strip('/').split('/')
+    if len(parts) >= 4 and parts[0] == 'dbs' and parts[2] == 'colls':
+        return '/'.join(parts[:4])
+    return None
+
+
+def account_of(client):
+    """ Tells the accounts of clients apart, a client of the SDK by its endpoint """
+    return getattr(client, 'url_connection', None) or id(client)
+
+
+def set_rate_limit(link, ru_per_second, client=None):
+    """ Paces requests to the collection of link at ru_per_second, None removes the limit. With a client
+    the limit only applies to the requests to that client's account. """
+    key = link if client is None else (account_of(client), link)
+    with _limiters_lock:
+        if ru_per_second:
+            _limiters[key] = RateLimiter(ru_per_second)
+        else:
+            _limiters.pop(key, None)
+
+
+def rate_limiter(link, client=None):
+    link = collection_link(link or '')
+    if link is None:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get((account_of(client), link)) if client is not None and _limiters else None
+        if limiter is None:
+            limiter = _limiters.get(link)
+        if limiter is None:
+            ru_per_second = cfg.settings['target_ru_per_second'].get(link)
+            if ru_per_second:
+                limiter = _limiters[link] = RateLimiter(ru_per_second)
+        return limiter
+
+
+def request_charge(headers):
+    return float((headers or {}).get('x-ms-request-charge', 0) or 0)
+
+
+def connection_policy():
+    """ A connection policy with the SDK's built in throttle retries turned off, throttled requests are
+    surfaced to run so they are retried with backoff and counted against the rate limiter. """
+    policy = documents.ConnectionPolicy()
+    policy.RetryOptions = retry_options.RetryOptions(0)
+    return policy
+
+
+def _success_status(operation):
+    # the 3.x SDK does not hand back the status code of a successful response
+    if operation.startswith('Create'):
+        return 201
+    if operation.startswith('Delete'):
+        return 204
+    return 200
+
+
+def run(client, operation, link, function, *args):
+    """ Calls function(*args), retrying throttled requests and pacing them with the rate limiter of link. """
+    limiter = rate_limiter(link, client)
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        started = time.perf_counter()
+        try:
+            result = function(*args)
+            if hasattr(result, 'fetch_next_block'):
+                # queries are lazy, their pages are read here so that every page request happens inside the
+                # retry loop, and recorded one by one
+                return _read_pages(client, operation, link, limiter, result, started)
+            charge = request_charge(client.last_response_headers)
+            metrics.record(operation, link, _success_status(operation), charge, time.perf_counter() - started)
+            if limiter:
+                limiter.consume(charge)
+            return result
+        except errors.HTTPFailure as e:
+            charge = request_charge(e.headers)
+            metrics.record(operation, link, e.status_code, charge, time.perf_counter() - started)
+            if limiter:
+                limiter.consume(charge)
+            attempt += 1
+            if not retry_policy.should_retry(attempt, e):
+                raise
+            delay = retry_policy.delay(attempt, e)
+            print('{0} on \'{1}\' was throttled ({2}), retrying in {3:.2f}s'.format(operation, link, e.status_code, delay))
+            time.sleep(delay)
+
+
+def _read_pages(client, operation, link, limiter, query, started):
+    """ Reads every page of a lazy query, recording the request charge and latency of each page request """
+    documents = []
+    while True:
+        previous = client.last_response_headers
+        page = query.fetch_next_block()
+        headers = client.last_response_headers
+        # the call that finds no more pages sends no request, and leaves the headers as they were
+        if headers is not previous:
+            charge = request_charge(headers)
+            metrics.record(operation, link, _success_status(operation), charge, time.perf_counter() - started)
+            if limiter:
+                limiter.consume(charge)
+        if not page:
+            return documents
+        documents.extend(page)
+        if limiter:
+            limiter.acquire()
+        started = time.perf_counter()
+
+
+def execute(client, operation, *args):
+    """ Runs client.<operation>(*args) through run, eg. execute(client, 'ReadItem', doc_link) """
+    link = args[0] if args and isinstance(args[0], str) else ''
+    return run(client, operation, link, getattr(client, operation), *args)
@@ -0,0 +1,112 @@
+import json
+import re
+import threading
+
+import shared.config as cfg
+
+# ----------------------------------------------------------------------------------------------------------
+# Query workload - the queries sent through DocumentManagement._fetch_page, grouped by shape
+#
+# While recording (query_workload.start(), or 'query_workload_enabled'), every query page is recorded per
+# collection under the shape of its query: the text with literals replaced by ? and whitespace collapsed,
+# so that the same query with different values counts as one shape. Per shape the executions (first pages),
+# pages, results and request charge are summed. When the server returns query metrics the documents it
+# retrieved to produce those results are summed too.
+#
+# IndexingManagement.py analyses the shapes to propose an indexing policy. query_workload.write(path) saves
+# them, so a workload recorded by one process can be analysed by another (QueryWorkload.read(path)).
+# ----------------------------------------------------------------------------------------------------------
+
+# property names in brackets (c["name"]) are kept, other string literals are replaced
+_STRING = re.compile(r'(\[\s*(?:\'[^\']*\'|"[^"]*")\s*\])|\'(?:[^\'\\]|\\.)*\'|"(?:[^"\\]|\\.)*"')
+_NUMBER = re.compile(r'(?<![\w@.])-?\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+_QUERY_METRICS = re.compile(r'(retrievedDocumentCount|outputDocumentCount)=(\d+)')
+
+
+def shape(query):
+    """ The query text with its literals replaced by ?, eg. c.total > 1000 AND c.state IN ('WA', 'OR') becomes
+    c.total > ? AND c.state IN (?) """
+    text = _STRING.sub(lambda m: m.group(1) or '?', query)
+    text = _NUMBER.sub('?', text)
+    text = _LIST.sub('(?)', text)
+    return _SPACE.sub(' ', text).strip()
+
+
+def _query_metrics(headers):
+    """ (retrieved documents, output documents) from the x-ms-documentdb-query-metrics header, or None """
+    value = (headers or {}).get('x-ms-documentdb-query-metrics')
+    if not value:
+        return None
+    counts = dict((name, int(count)) for name, count in _QUERY_METRICS.findall(value))
+    if 'retrievedDocumentCount' not in counts:
+        return None
+    return counts['retrievedDocumentCount'], counts.get('outputDocumentCount', 0)
+
+
+class QueryWorkload:
+
+    def __init__(self, enabled=False, max_shapes=1000):
+        self.enabled = enabled
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def record(self, collection_link, query, first_page, results, request_charge, headers=None):
+        """ Records one page of a query. query is the SQL text or a { 'query', 'parameters' } dictionary. """
+        if not self.enabled:
+            return
+        text = query['query'] if isinstance(query, dict) else query
+        key = (collection_link.strip('/'), shape(text))
+        counts = _query_metrics(headers)
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    return
+                entry = self._shapes[key] = {'executions': 0, 'pages': 0, 'results': 0, 'request_charge': 0.0,
+                                             'retrieved': 0, 'measured_results': 0}
+            entry['executions'] += 1 if first_page else 0
+            entry['pages'] += 1
+            entry['results'] += results
+            entry['request_charge'] += request_charge
+            if counts is not None:
+                entry['retrieved'] += counts[0]
+                entry['measured_results'] += counts[1]
+
+    def shapes(self, collection_link=None):
+        """ Returns [(collection link, shape, totals)], the most expensive shapes first """
+        with self._lock:
+            items = [(link, text, dict(entry)) for (link, text), entry in self._shapes.items()
+                     if collection_link is None or link == collection_link.strip('/')]
+        return sorted(items, key=lambda item: -item[2]['request_charge'])
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+    def to_json(self):
+        return json.dumps([{'collection': link, 'shape': text, 'totals': totals}
+                           for link, text, totals in self.shapes()], indent=2)
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+
+    @staticmethod
+    def read(path):
+        workload = QueryWorkload(enabled=False, max_shapes=float('inf'))
+        with open(path, encoding='utf-8') as f:
+            for item in json.load(f):
+                workload._shapes[(item['collection'], item['shape'])] = item['totals']
+        return workload
+
+
+query_workload = QueryWorkload(cfg.settings['query_workload_enabled'], cfg.settings['query_workload_max_shapes'])
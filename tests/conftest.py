@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# the modules of this project are imported from the top of the repository, as ProgramMenu.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.fake_client import FakeCosmosClient  # noqa: E402
+from shared.routing import routing  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    """ A FakeCosmosClient with database 'd' whose collections have 4 partition key ranges """
+    client = FakeCosmosClient(partition_count=4, seed=1)
+    client.CreateDatabase({'id': 'd'})
+    yield client
+    # the routing maps are cached per client, and a later client can be given the same id()
+    for collection_id in client._databases['d']['colls']:
+        routing.invalidate(client, 'dbs/d/colls/' + collection_id)
+
+
+@pytest.fixture
+def collection(client):
+    """ The link of collection 'o' of database 'd', partitioned on /account_number """
+    client.CreateContainer('dbs/d', {'id': 'o', 'partitionKey': {'paths': ['/account_number'], 'kind': 'Hash'}})
+    return 'dbs/d/colls/o'
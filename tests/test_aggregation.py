@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from AggregationManagement import AggregationManagement
+
+
+@pytest.fixture
+def orders(client, collection):
+    generator = random.Random(5)
+    documents = []
+    for i in range(400):
+        document = {'id': str(i), 'account_number': 'Account{0}'.format(i % 13), 'region': 'R{0}'.format(i % 3),
+                    'subtotal': generator.choice([None, 'n/a', generator.uniform(1, 50), generator.randint(1, 50)])}
+        if i % 11 == 0:
+            del document['subtotal']
+        client.CreateItem(collection, document)
+        documents.append(document)
+    return documents
+
+
+def _numbers(documents):
+    return [d['subtotal'] for d in documents
+            if isinstance(d.get('subtotal'), (int, float)) and not isinstance(d['subtotal'], bool)]
+
+
+def test_sum_and_avg_only_count_numbers(client, orders):
+    result = AggregationManagement.aggregate(client, 'd', 'o', {'orders': 'count', 'total': 'sum(subtotal)',
+                                                                'average': 'avg(subtotal)', 'high': 'max(subtotal)'})
+    numbers = _numbers(orders)
+    assert result['orders'] == len(orders)
+    assert result['total'] == pytest.approx(sum(numbers))
+    assert result['average'] == pytest.approx(sum(numbers) / len(numbers))
+    # strings come after numbers in Cosmos order
+    assert result['high'] == 'n/a'
+
+
+def test_groups_spread_over_ranges_are_merged(client, orders):
+    results = AggregationManagement.aggregate(client, 'd', 'o', {'orders': 'count', 'average': 'avg(subtotal)'},
+                                              group_by=['region'], where='c.account_number != @skip',
+                                              parameters=[{'name': '@skip', 'value': 'Account0'}])
+    assert len(results) == 3
+    for result in results:
+        documents = [d for d in orders if d['region'] == result['region'] and d['account_number'] != 'Account0']
+        numbers = _numbers(documents)
+        assert result['orders'] == len(documents)
+        assert result['average'] == pytest.approx(sum(numbers) / len(numbers))
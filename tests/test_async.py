@@ -0,0 +1,19 @@
+import asyncio
+import warnings
+
+from AsyncManagement import AsyncManagement
+
+
+def test_documents_are_read_concurrently_without_deprecation_warnings(client, collection):
+    for i in range(10):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account{0}'.format(i)})
+
+    async def read():
+        async with AsyncManagement(client, max_concurrency=4) as management:
+            return await asyncio.gather(*[management.read_document('d', 'o', str(i), 'Account{0}'.format(i))
+                                          for i in range(10)])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        documents = asyncio.run(read())
+    assert [d['id'] for d in documents] == [str(i) for i in range(10)]
@@ -0,0 +1,33 @@
+import pytest
+
+from BulkManagement import BulkManagement
+
+
+@pytest.mark.parametrize('value, expected', [('42', 42), ('-7', -7), ('12.5', 12.5), ('00123', '00123'),
+                                             ('1_000', '1_000'), ('nan', 'nan'), ('inf', 'inf'), ('1.50', '1.50'),
+                                             ('Account1', 'Account1'), ('', '')])
+def test_only_values_written_as_numbers_are_converted(value, expected):
+    converted = BulkManagement._convert_value(value)
+    assert converted == expected and type(converted) is type(expected)
+
+
+def test_an_error_fails_its_row_only(client, collection):
+    rows = [(1, {'id': '1', 'account_number': 'Account1'}), (2, {'id': '2', 'account_number': 'Account1', 'bad': {1, 2}}),
+            (3, {'id': '3', 'account_number': 'Account2'})]
+    summary = BulkManagement.import_documents(client, collection, rows)
+    assert summary['written'] == 2
+    assert [(row, status_code) for row, status_code, _ in summary['failed']] == [(2, None)]
+
+
+def test_a_bad_operation_fails_on_its_own(client, collection):
+    operations = [('upsert', {'id': '1', 'account_number': 'Account1'}),
+                  ('upsert', {'id': '2', 'account_number': 'Account1', 'bad': {1, 2}}),
+                  ('merge', {'id': '3', 'account_number': 'Account1'}),
+                  ('upsert', 'not a document'),
+                  ('delete', ('4', 'Account1', 'extra')),
+                  ('upsert', {'id': '5', 'account_number': 'Account2'})]
+    results = sorted(BulkManagement.bulk(client, collection, operations, batch_size=2))
+    assert [(index, status_code) for index, _, _, status_code, _, _ in results] == [
+        (0, 200), (1, None), (2, None), (3, None), (4, None), (5, 200)]
+    assert all(error for _, _, _, status_code, _, error in results if status_code is None)
+    assert sorted(d['id'] for d in client.ReadItems(collection)) == ['1', '5']
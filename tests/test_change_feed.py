@@ -0,0 +1,29 @@
+import threading
+
+from ChangeFeedManagement import ChangeFeedConsumer
+from shared.checkpoint import FileCheckpointStore
+
+
+def test_polling_goes_on_after_a_handler_raised(client, collection, tmp_path):
+    for i in range(20):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account{0}'.format(i % 5)})
+    seen = set()
+    failures = []
+    done = threading.Event()
+
+    def handler(documents, range_id):
+        if not failures:
+            failures.append(range_id)
+            raise RuntimeError('the handler failed')
+        seen.update(d['id'] for d in documents)
+        if len(seen) == 20:
+            done.set()
+
+    consumer = ChangeFeedConsumer(client, 'd', 'o', handler, FileCheckpointStore(str(tmp_path / 'feed.json')),
+                                  start_from_beginning=True)
+    consumer.start(interval=0.01)
+    try:
+        assert done.wait(5)
+    finally:
+        consumer.close()
+    assert failures
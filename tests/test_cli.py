@@ -0,0 +1,35 @@
+import json
+
+import CLI
+
+
+def _run(client, capsys, *argv):
+    code = CLI.main(list(argv) + ['--json'], client=client)
+    return code, json.loads(capsys.readouterr().out.splitlines()[-1])
+
+
+def test_a_command_that_returns_none_fails(client, capsys):
+    code, result = _run(client, capsys, 'read-documents', '--db', 'd', '--coll', 'missing')
+    assert code == 1
+    assert not result['ok']
+
+
+def test_a_command_that_succeeds(client, collection, capsys):
+    code, result = _run(client, capsys, 'get-collection', '--db', 'd', '--coll', 'o')
+    assert code == 0
+    assert result['ok']
+
+
+def test_a_summary_with_failures_fails(client, capsys, monkeypatch):
+    monkeypatch.setitem(CLI.COMMANDS, 'list-databases',
+                        (1, 'List all databases', (), lambda client, args: {'failed': [{'action': 'create'}]}))
+    code, result = _run(client, capsys, 'list-databases')
+    assert code == 1
+    assert result['error'] == '1 of its operations failed'
+
+
+def test_an_injected_client_is_left_open(client, capsys, monkeypatch):
+    closed = []
+    monkeypatch.setattr(CLI.client_factory, 'close', lambda: closed.append(True))
+    _run(client, capsys, 'list-databases')
+    assert closed == []
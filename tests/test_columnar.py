@@ -0,0 +1,28 @@
+import math
+
+from shared.columnar import MISSING, ColumnarResult
+
+
+def _orders():
+    result = ColumnarResult(['account_number', 'total_due'])
+    for account, total in [('Account1', 10.0), ('Account2', 5), ('Account1', 'n/a'), ('Account2', None),
+                           (MISSING, 7.5), ('Account1', 2.5), (3, 1.0)]:
+        result.append([account, total])
+    return result
+
+
+def test_values_of_another_type_keep_the_column_compact():
+    result = _orders()
+    total_due = result.column('total_due')
+    assert total_due.typecode == 'd'
+    assert math.isnan(total_due[2])
+    assert [row['total_due'] for row in result.rows()] == [10.0, 5.0, 'n/a', None, 7.5, 2.5, 1.0]
+    assert result.codes('account_number')[1] == ['Account1', 'Account2']
+    assert [row['account_number'] for row in result.rows()][-1] == 3
+
+
+def test_aggregations_skip_values_that_are_not_numbers():
+    result = _orders()
+    assert result.sum('total_due') == 26.0
+    assert result.group_sum('account_number', 'total_due') == {'Account1': 12.5, 'Account2': 5.0, 3: 1.0}
+    assert result.group_count('account_number', 'total_due') == {'Account1': 3, 'Account2': 1, 3: 1}
@@ -0,0 +1,32 @@
+from DocumentManagement import DocumentManagement
+
+
+def test_read_many_keeps_the_order_of_items_across_ranges(client, collection):
+    # 40 partition keys of 3 ids each: small groups that are read together per partition key range
+    for account in range(40):
+        for order in range(3):
+            client.CreateItem(collection, {'id': 'SalesOrder{0}-{1}'.format(account, order),
+                                           'account_number': 'Account{0}'.format(account)})
+    items = [('SalesOrder{0}-{1}'.format(account, order), 'Account{0}'.format(account))
+             for order in range(3) for account in range(40)]
+    items += [('SalesOrder{0}-9'.format(account), 'Account{0}'.format(account)) for account in range(0, 40, 3)]
+    items.reverse()
+
+    documents, missing = DocumentManagement.read_many(client, 'd', 'o', items)
+
+    assert len(documents) == len(items)
+    for (doc_id, account), document in zip(items, documents):
+        if doc_id.endswith('-9'):
+            assert document is None
+        else:
+            assert (document['id'], document['account_number']) == (doc_id, account)
+    assert missing == [doc_id for doc_id, _ in items if doc_id.endswith('-9')]
+
+
+def test_read_columns_indexes_into_arrays(client, collection):
+    for i in range(5):
+        client.CreateItem(collection, DocumentManagement.GetSalesOrderV2('SalesOrder{0}'.format(i)))
+    result = DocumentManagement.read_columns(client, 'd', 'o', ['id', 'items.0.unit_price', 'items.1.unit_price'])
+    assert len(result) == 5
+    assert list(result.column('items.0.unit_price')) == [17.1] * 5
+    assert list(result.column('items.1.unit_price')) == [None] * 5
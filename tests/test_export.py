@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from DocumentManagement import DocumentManagement
+from ExportManagement import ExportManagement
+from shared.checkpoint import FileCheckpointStore
+
+parquet = pytest.importorskip('pyarrow.parquet')
+
+
+def _rows(files):
+    return [row for path in files for row in parquet.read_table(path).to_pylist()]
+
+
+def test_a_page_of_v1_and_v2_orders_keeps_the_properties_of_both(client, collection, tmp_path):
+    for i in range(40):
+        order = DocumentManagement.GetSalesOrderV2 if i % 2 else DocumentManagement.GetSalesOrder
+        # one account, so that the orders are read in one page that starts with a V1 order
+        client.CreateItem(collection, dict(order(str(i)), account_number='Account1'))
+    summary = ExportManagement.export(client, 'd', 'o', str(tmp_path / 'orders'), file_format='parquet',
+                                      store=FileCheckpointStore(str(tmp_path / 'exports.json')))
+    rows = {row['id']: row for row in _rows(summary['files'])}
+    assert len(rows) == 40
+    assert rows['1']['due_date'] == DocumentManagement.GetSalesOrderV2('1')['due_date']
+    assert rows['1']['discount_amt'] == 1982.872
+    assert rows['0']['due_date'] is None
+    assert json.loads(rows['1']['items'])[0]['product_code'] == 'A-123'
+
+
+def test_a_property_with_values_of_different_types_is_stored_as_json(client, collection, tmp_path):
+    values = [1, 'one', True, {'n': 1}, None]
+    for i, value in enumerate(values):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account1', 'value': value})
+    summary = ExportManagement.export(client, 'd', 'o', str(tmp_path / 'values'), file_format='parquet',
+                                      store=FileCheckpointStore(str(tmp_path / 'exports.json')))
+    rows = {row['id']: row for row in _rows(summary['files'])}
+    assert [None if rows[str(i)]['value'] is None else json.loads(rows[str(i)]['value'])
+            for i in range(len(values))] == values
+
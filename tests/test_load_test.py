@@ -0,0 +1,21 @@
+from LoadTest import LoadTest
+from shared.generator import SalesOrderGenerator
+
+
+def test_request_charges_and_errors_are_counted_per_operation(client, collection, monkeypatch):
+    test = LoadTest(client, collection, SalesOrderGenerator(accounts=20, seed=3), {'write': 0.5, 'query': 0.5}, seed=3)
+    test.preload(50)
+
+    def query():
+        raise ConnectionError('the connection was reset')
+
+    monkeypatch.setattr(test, '_query', query)
+    results = test.run(rate=200, duration=0.5, workers=8)
+
+    operations = {o['operation']: o for o in results['operations']}
+    assert operations['query']['count'] == 0
+    assert operations['query']['errors'] == {'ConnectionError': sum(operations['query']['errors'].values())}
+    assert operations['query']['errors']['ConnectionError'] > 0
+    # an upsert of one order, charged by the fake at 5 RU per KB
+    assert 1.0 <= operations['write']['request_charge_per_op'] < 20
+    assert results['request_units_per_second'] > 0
@@ -0,0 +1,18 @@
+from CollectionManagement import CollectionManagement
+from DBManagement import DatabaseManagement
+from shared.cache import metadata_cache
+
+
+def test_a_conflicting_create_replaces_a_cached_not_found(client):
+    metadata_cache.clear()
+    assert not DatabaseManagement.find_database(client, 'other')
+    # created by another process while the "not found" is cached
+    client.CreateDatabase({'id': 'other'})
+    assert DatabaseManagement.create_database(client, 'other') is None
+    assert DatabaseManagement.find_database(client, 'other')
+
+    assert not CollectionManagement.find_Container(client, 'other', 'orders')
+    client.CreateContainer('dbs/other', {'id': 'orders'})
+    assert CollectionManagement.create_Container(client, 'other', 'orders', {}) is None
+    assert CollectionManagement.find_Container(client, 'other', 'orders')
+    metadata_cache.clear()
@@ -0,0 +1,76 @@
+import azure.cosmos.errors as errors
+
+from MigrationManagement import MigrationManagement
+from shared.checkpoint import FileCheckpointStore
+
+
+def _ids(client, collection_link):
+    return sorted(d['id'] for d in client.ReadItems(collection_link))
+
+
+def test_failed_writes_are_retried_when_the_copy_runs_again(client, collection, tmp_path, monkeypatch):
+    for i in range(300):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account{0}'.format(i % 23)})
+    target = 'dbs/d/colls/t'
+    client.CreateContainer('dbs/d', {'id': 't', 'partitionKey': {'paths': ['/account_number'], 'kind': 'Hash'}})
+    store = FileCheckpointStore(str(tmp_path / 'migrations.json'))
+
+    upsert = client.UpsertItem
+
+    def rejecting(link, document, options=None):
+        if link == target and document['id'] in ('7', '250'):
+            raise errors.HTTPFailure(400, 'Bad Request', {'x-ms-request-charge': '1'})
+        return upsert(link, document, options)
+
+    monkeypatch.setattr(client, 'UpsertItem', rejecting)
+    first = MigrationManagement.copy(client, 'd', 'o', 'd', 't', store=store, page_size=50)
+    assert first['failed'] == 2
+    assert sorted(f['id'] for f in first['failures']) == ['250', '7']
+    assert len(_ids(client, target)) == 298
+
+    monkeypatch.setattr(client, 'UpsertItem', upsert)
+    second = MigrationManagement.copy(client, 'd', 'o', 'd', 't', store=store, page_size=50)
+    assert second['failed'] == 0
+    assert _ids(client, target) == _ids(client, collection)
+    # the pages read again are not counted twice
+    assert (second['read'], second['written']) == (300, 300)
+
+    # complete now, a third run has nothing to do
+    third = MigrationManagement.copy(client, 'd', 'o', 'd', 't', store=store, page_size=50)
+    assert third['source_request_charge'] == 0.0
+
+
+def test_a_range_that_splits_after_a_failed_write_is_counted_once(client, collection, tmp_path, monkeypatch):
+    for i in range(300):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account{0}'.format(i % 23)})
+    target = 'dbs/d/colls/t'
+    client.CreateContainer('dbs/d', {'id': 't', 'partitionKey': {'paths': ['/account_number'], 'kind': 'Hash'}})
+    store = FileCheckpointStore(str(tmp_path / 'migrations.json'))
+
+    upsert = client.UpsertItem
+    query_feed = client.QueryFeed
+    failed = []
+
+    def rejecting(link, document, options=None):
+        if link == target and not failed:
+            failed.append(document['id'])
+            raise errors.HTTPFailure(400, 'Bad Request', {'x-ms-request-charge': '1'})
+        return upsert(link, document, options)
+
+    def splitting(path, collection_id, query, options, partition_key_range_id=None):
+        # the range of the failed write splits on its next page
+        if failed and partition_key_range_id == '0' and len(failed) == 1:
+            failed.append('split')
+            client.split_range(collection, '0')
+        return query_feed(path, collection_id, query, options, partition_key_range_id)
+
+    monkeypatch.setattr(client, 'UpsertItem', rejecting)
+    monkeypatch.setattr(client, 'QueryFeed', splitting)
+    first = MigrationManagement.copy(client, 'd', 'o', 'd', 't', store=store, page_size=10, max_workers=1)
+    assert failed[1:] == ['split']
+    assert (first['read'], first['written'], first['failed']) == (300, 299, 1)
+
+    monkeypatch.setattr(client, 'UpsertItem', upsert)
+    second = MigrationManagement.copy(client, 'd', 'o', 'd', 't', store=store, page_size=10, max_workers=1)
+    assert (second['read'], second['written'], second['failed']) == (300, 300, 0)
+    assert _ids(client, target) == _ids(client, collection)
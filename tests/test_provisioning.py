@@ -0,0 +1,26 @@
+from ProvisioningManagement import ProvisioningManagement
+
+
+def _spec(excluded, mode='consistent'):
+    return {'databases': [{'id': 'd', 'containers': [{
+        'id': 'o', 'partitionKey': {'paths': ['/account_number'], 'kind': 'Hash'},
+        'indexingPolicy': {'indexingMode': mode, 'automatic': True,
+                           'excludedPaths': [{'path': path} for path in excluded]}}]}]}
+
+
+def _actions(client, spec):
+    return [(a['action'], a['detail']) for a in ProvisioningManagement.plan(client, spec)]
+
+
+def test_indexing_policy_lists_are_compared_exactly(client):
+    ProvisioningManagement.provision(client, _spec(['/items/*', '/notes/?']))
+
+    assert _actions(client, _spec(['/notes/?', '/items/*'])) == []
+    assert _actions(client, _spec(['/items/*'])) == [('replace_container', 'indexingPolicy')]
+    assert _actions(client, _spec(['/Items/*', '/notes/?'])) == [('replace_container', 'indexingPolicy')]
+
+
+def test_strings_are_compared_with_their_case(client):
+    ProvisioningManagement.provision(client, _spec([]))
+
+    assert _actions(client, _spec([], mode='Consistent')) == [('replace_container', 'indexingPolicy')]
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from QueryManagement import QueryManagement, QueryPlan
+
+
+def _orders(client, collection, count):
+    for i in range(count):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account{0}'.format(i % 37), 'total_due': i})
+
+
+def test_order_by_requests_the_first_page_of_every_range_at_once(client, collection):
+    _orders(client, collection, 200)
+    list(QueryManagement.query_documents(client, 'd', 'o', 'SELECT * FROM c'))  # reads the routing map
+    client.latency = 0.05
+
+    started = time.perf_counter()
+    results = list(QueryManagement.query_documents(client, 'd', 'o', 'SELECT * FROM c ORDER BY c.total_due DESC',
+                                                   page_size=1000))
+    elapsed = time.perf_counter() - started
+
+    assert [r['total_due'] for r in results] == list(range(199, -1, -1))
+    # one page per range after the other would take 4 round trips
+    assert elapsed < 0.15
+
+
+@pytest.mark.parametrize('query', ['SELECT DISTINCT c.account_number FROM c',
+                                   'SELECT DISTINCT VALUE c.account_number FROM c',
+                                   'SELECT TOP 5 DISTINCT c.account_number FROM c',
+                                   'SELECT VALUE c.total_due FROM c ORDER BY c.total_due',
+                                   'SELECT COUNT(1) FROM c'])
+def test_query_plan_rejects_results_it_cannot_merge(query):
+    with pytest.raises(ValueError):
+        QueryPlan(query, [])
+
+
+def test_query_plan_accepts_select_value_without_order_by():
+    assert QueryPlan('SELECT TOP 3 VALUE c.total_due FROM c', []).top == 3
+
+
+@pytest.mark.parametrize('query', ['SELECT * FROM c', 'SELECT * FROM c ORDER BY c.total_due DESC',
+                                   'SELECT c.id, c.account_number FROM c ORDER BY c.account_number'])
+def test_a_range_that_splits_during_a_query_carries_on_in_its_children(client, collection, monkeypatch, query):
+    _orders(client, collection, 400)
+    query_feed = client.QueryFeed
+    pages = []
+
+    def splitting(path, collection_id, query, options, partition_key_range_id=None):
+        result = query_feed(path, collection_id, query, options, partition_key_range_id)
+        if partition_key_range_id == '1':
+            pages.append(partition_key_range_id)
+            if len(pages) == 1:
+                client.split_range(collection, '1')
+        return result
+
+    monkeypatch.setattr(client, 'QueryFeed', splitting)
+    results = list(QueryManagement.query_documents(client, 'd', 'o', query, page_size=10, max_degree_of_parallelism=1))
+
+    assert sorted(r['id'] for r in results) == sorted(str(i) for i in range(400))
+    if 'total_due' in query:
+        assert [r['total_due'] for r in results] == list(range(399, -1, -1))
+    if 'ORDER BY c.account_number' in query:
+        accounts = [r['account_number'] for r in results]
+        assert accounts == sorted(accounts)
@@ -0,0 +1,26 @@
+from StatisticsManagement import StatisticsManagement
+
+
+def _fill(client, collection, keys, documents):
+    for i in range(documents):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account{0}'.format(i % keys),
+                                       'padding': 'x' * (i % keys)})
+
+
+def test_exact_mode_counts_few_partition_keys_exactly(client, collection):
+    _fill(client, collection, 10, 200)
+    stats = StatisticsManagement.collect(client, 'd', 'o', exact=True, top=3)
+    assert stats['documents'] == 200
+    assert stats['partition_keys']['distinct'] == 10
+    assert not stats['partition_keys']['estimated']
+    assert [(hot['partition_key'], hot['documents']) for hot in stats['partition_keys']['hottest']] == [
+        ('Account9', 20), ('Account8', 20), ('Account7', 20)]
+
+
+def test_exact_mode_holds_sketches_of_the_partition_keys(client, collection):
+    _fill(client, collection, 500, 1000)
+    stats = StatisticsManagement.collect(client, 'd', 'o', exact=True, sketch_size=64)
+    assert stats['documents'] == 1000
+    assert stats['partition_keys']['estimated']
+    assert 300 < stats['partition_keys']['distinct'] < 800
+    assert stats['properties'][0]['documents'] == 1000
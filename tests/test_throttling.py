@@ -0,0 +1,23 @@
+from shared.metrics import metrics
+from shared.throttling import execute
+
+
+def test_every_page_of_a_query_is_recorded(client, collection):
+    for i in range(25):
+        client.CreateItem(collection, {'id': str(i), 'account_number': 'Account{0}'.format(i % 5)})
+    recorded = []
+
+    def listener(operation, link, status_code, request_charge, latency):
+        if operation == 'QueryItems':
+            recorded.append(request_charge)
+
+    metrics.add_listener(listener)
+    try:
+        documents = execute(client, 'QueryItems', collection, 'SELECT * FROM c',
+                            {'maxItemCount': 10, 'enableCrossPartitionQuery': True})
+    finally:
+        metrics.remove_listener(listener)
+
+    assert len(documents) == 25
+    assert len(recorded) == client.request_counts['QueryItems'] == 3
+    assert all(charge > 0 for charge in recorded)
@@ -0,0 +1,37 @@
+from ThroughputManagement import ThroughputController
+
+
+def _busy(controller, link, request_charge):
+    controller._observe('CreateItem', link + '/docs/1', 201, request_charge, 0.01)
+
+
+def test_dry_run_keeps_reporting_the_change_it_would_make(client, collection):
+    with ThroughputController(client, [collection], dry_run=True) as controller:
+        for _ in range(3):
+            _busy(controller, collection, 100000)
+            decision, = controller.evaluate()
+            assert decision['action'] == 'scale up'
+            assert not decision['applied']
+
+
+def test_autoscale_offers_are_skipped(client, collection):
+    offer = next(iter(client._offers.values()))
+    offer['content'] = {'offerAutopilotSettings': {'maxThroughput': 4000}}
+    with ThroughputController(client, [collection]) as controller:
+        _busy(controller, collection, 100000)
+        assert controller.evaluate() == []
+
+
+def test_a_failed_evaluation_does_not_stop_the_controller(client, collection, monkeypatch):
+    with ThroughputController(client, [collection], dry_run=True) as controller:
+        calls = []
+
+        def evaluate():
+            calls.append(True)
+            if len(calls) == 1:
+                raise TimeoutError('reading the offers timed out')
+            return []
+
+        monkeypatch.setattr(controller, 'evaluate', evaluate)
+        controller.run(interval=0.001, rounds=3)
+        assert len(calls) == 3